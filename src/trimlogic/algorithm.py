@@ -1,5 +1,6 @@
-import logging
+import logging, multiprocessing, time
 import trimlogic.predicate
+from trimlogic import stats, trace
 from collections import deque
 from trimlogic.stdlib import cut
 from trimlogic.term import *
@@ -8,10 +9,10 @@ logger = logging.getLogger(__name__)
 
 def log_unify(unify_func):
   def _unify(s1, s2, bindings=None):
-    logger.debug("unify( " + str(s1) + ", " + str(s2) + " ) :: " + str(bindings))
+    logger.debug("unify( %s, %s ) :: %s", s1, s2, bindings)
     mgu = unify_func(s1, s2, bindings)
-    if mgu != None: logger.debug("unified " + str(s1) + " and " + str(s2) + "  with " + str(mgu))
-    else: logger.debug("failed to unify " + str(s1) + " and " + str(s2))
+    if mgu != None: logger.debug("unified %s and %s with %s", s1, s2, mgu)
+    else: logger.debug("failed to unify %s and %s", s1, s2)
     return mgu
   return _unify
 
@@ -34,14 +35,19 @@ def unify(s1, s2, bindings=None):
   in Artificial Intelligence: A Modern Approach 2nd Edition by Stuart J. Russel 
   and Peter Norvig.
   """
-  logger = logging.getLogger('unify')
-  logger.debug("start unify(%s, %s, %s)" % (s1, s2, bindings))
   if bindings == None:
     bindings = {}
   if isinstance(s1, list):
     s1 = tuple(s1)
   if isinstance(s2, list):
     s2 = tuple(s2)
+  if trace.enabled:
+    # _unify extends the bindings in place.
+    old_bindings = dict(bindings)
+    mgu = _unify(s1, s2, bindings)
+    trace.emit(trace.UNIFY, left=s1, right=s2, bindings=old_bindings,
+               unifier=mgu)
+    return mgu
   return _unify(s1, s2, bindings)
 
 def _unify_var(var, x, bindings):
@@ -86,33 +92,392 @@ def _unify(s1, s2, bindings):
   else:
     return None
 
-def fol_bc_ask(goals, substitutions):
+DEFAULT_ENGINE = 'dict'
+
+
+class QueryLimitExceeded(Exception):
+  """
+  Raised by a query which exceeds one of its QueryLimits. The name of the 
+  limit, 'depth', 'steps', 'answers' or 'seconds', is held by limit, and the
+  statistics of the query up to then by stats, see QueryLimits.
+  """
+  
+  def __init__(self, limit, stats):
+    Exception.__init__(self, "Query exceeded its %s limit after %s steps, "
+                       "%s answers and %.3f seconds." 
+                       % (limit, stats['steps'], stats['answers'], 
+                          stats['seconds']))
+    self.limit = limit
+    self.stats = stats
+
+
+class QueryLimits:
+  """
+  Limits on the resources a single query of fol_bc_ask may use: the depth of
+  the derivation being tried, that is its number of nested resolution steps, 
+  the number of resolution steps in all, the number of answers and the wall
+  clock time in seconds. A limit which is None is not checked. A query 
+  exceeding a limit raises QueryLimitExceeded, whose statistics are a dict 
+  with the steps taken, the deepest derivation tried, the answers generated
+  and the seconds elapsed.
+  """
+  
+  def __init__(self, depth=None, steps=None, answers=None, seconds=None):
+    self.depth = depth
+    self.steps = steps
+    self.answers = answers
+    self.seconds = seconds
+  
+  def start(self):
+    """
+    Returns the monitor counting the resources of a query started now.
+    """
+    return _QueryMonitor(self)
+
+
+class _QueryMonitor:
+  
+  def __init__(self, limits):
+    self.limits = limits
+    self.steps = 0
+    self.depth = 0
+    self.answers = 0
+    self.started = time.time()
+  
+  def call(self, depth):
+    """
+    Counts a resolution step at the given depth, unless it would exceed a 
+    limit.
+    """
+    limits = self.limits
+    if limits.depth != None and depth > limits.depth:
+      self.exceeded('depth')
+    if limits.steps != None and self.steps >= limits.steps:
+      self.exceeded('steps')
+    if (limits.seconds != None 
+        and time.time() - self.started > limits.seconds):
+      self.exceeded('seconds')
+    self.steps += 1
+    if depth > self.depth:
+      self.depth = depth
+  
+  def answer(self):
+    if self.limits.answers != None and self.answers >= self.limits.answers:
+      self.exceeded('answers')
+    self.answers += 1
+  
+  def get_stats(self):
+    return {'steps': self.steps, 'depth': self.depth, 
+            'answers': self.answers, 'seconds': time.time() - self.started}
+  
+  def exceeded(self, limit):
+    raise QueryLimitExceeded(limit, self.get_stats())
+
+
+def fol_bc_ask(goals, substitutions, engine=None, limits=None):
   """
   Attempts to satisfy a given set of goals, if one or more of the goals contains unbound variables,
   this algorithm will find every binding for every variable so that the goals are satisfied. The 
   solutions are given as a sequence of variable mappings that satisfy the goals. If there is no 
   mapping that will satisfy the goals then the generator yields no results.
+  
+  @param engine: The resolution engine to use, 'dict' to compose substitution 
+      dicts or 'trail' to bind variables in place and undo them on 
+      backtracking. Defaults to DEFAULT_ENGINE.
+  @type engine: str
+  @param limits: The limits of the query, which are not checked if None.
+  @type limits: QueryLimits
+  @raise QueryLimitExceeded: If the query exceeds one of its limits.
+  """
+  if engine == None: engine = DEFAULT_ENGINE
+  monitor = None
+  if limits != None:
+    monitor = limits.start()
+  if engine == 'dict':
+    answers = dict_bc_ask(goals, substitutions, monitor)
+  elif engine == 'trail':
+    from trimlogic.trail import trail_bc_ask
+    answers = trail_bc_ask(goals, substitutions, monitor)
+  else:
+    raise ValueError("Unknown resolution engine '%s'." % engine)
+  if monitor != None:
+    return _count_answers(answers, monitor)
+  return answers
+
+def _count_answers(answers, monitor):
+  for answer in answers:
+    if answer != None:
+      monitor.answer()
+    yield answer
+
+def ask_many(predicate, tuples, engine=None, processes=None):
+  """
+  Answers whether predicate(*values) follows for each values in tuples, 
+  returning a list of booleans in the order of tuples. A variable among the
+  values matches any value, as it does in a query.
+
+  The tuples are answered together. With the trail engine, if the predicate
+  is defined by facts or by Datalog rules its extension, and the extensions 
+  of the subgoals it depends on, are computed bottom-up once for as long as
+  no clause changes. The tuples are then grouped by their bound arguments and
+  looked up in a hash index of the extension on those arguments. Otherwise
+  the tuples are proved top-down through the answer tables of 
+  trimlogic.tabling, which are also kept until a clause changes. With the 
+  trail engine, a predicate whose modes are declared and whose rules are
+  Horn clauses is called once for each binding of its input parameters, and
+  the table of that call answers every tuple with those inputs. With the 
+  dict engine a ground tuple is its own call, which is cheaper than a dict
+  engine proof and is kept for later calls. Any other distinct query is 
+  proved with fol_bc_ask, which stops at its first answer where the table 
+  of the query may have no end. The dict engine fails some calls which 
+  bottom-up evaluation answers, so with it every query is asked as it is.
+
+  @param engine: The resolution engine of fol_bc_ask. Defaults to 
+      DEFAULT_ENGINE.
+  @type engine: str
+  @param processes: The number of worker processes proving the queries 
+      top-down, each with fol_bc_ask, or None to prove them in this process.
+  @type processes: int
+  """
+  from trimlogic.tabling import variant_key
+  from trimlogic.trail import _is_rule_resolver
+  if engine == None: engine = DEFAULT_ENGINE
+  tuples = [tuple(values) for values in tuples]
+  stable, horn = _inspect_rules(predicate)
+  relation = None
+  if engine == 'trail':
+    relation = _relation(predicate, stable)
+  results = [False] * len(tuples)
+  queries, positions = [], {}
+  for i in xrange(len(tuples)):
+    if relation != None:
+      pattern = _lookup_pattern(tuples[i])
+      if pattern == tuple(xrange(len(tuples[i]))):
+        results[i] = tuples[i] in relation
+        continue
+      elif pattern != None:
+        results[i] = _matches(relation, tuples[i], pattern)
+        continue
+    key = variant_key(tuples[i])
+    if not positions.has_key(key):
+      positions[key] = []
+      queries.append(tuples[i])
+    positions[key].append(i)
+  if queries:
+    if processes != None:
+      answers = _ask_parallel(processes, predicate, queries, engine)
+    elif stable and _is_rule_resolver(predicate):
+      inputs = None
+      if engine == 'trail' and horn:
+        inputs = _input_positions(predicate)
+      answers = _ask_tabled(predicate, queries, engine, inputs)
+    else:
+      answers = [_holds(predicate, values, engine) for values in queries]
+    for values, answer in zip(queries, answers):
+      for i in positions[variant_key(values)]:
+        results[i] = answer
+  return results
+
+# The extensions ask_many computed bottom-up, and the generation of the 
+# clauses they were computed from.
+_relations = {}
+_relations_generation = [None]
+
+def _relation(predicate, stable):
+  """
+  Returns the extension of a predicate defined by facts or Datalog rules, or
+  None if it can not be evaluated bottom-up. The extension is reused until a
+  clause changes, unless the predicate depends on a MutableRule.
+  """
+  from trimlogic import index
+  from trimlogic.datalog import evaluate
+  if _relations_generation[0] != index.generation:
+    _relations.clear()
+    _relations_generation[0] = index.generation
+  if _relations.has_key(predicate):
+    return _relations[predicate]
+  try:
+    relation = evaluate([predicate])[predicate]
+  except ValueError:
+    relation = None
+  if stable:
+    _relations[predicate] = relation
+  return relation
+
+def _inspect_rules(predicate):
+  """
+  Returns whether the answers of the predicate only change along with 
+  index.generation, that is whether no predicate it depends on has a 
+  MutableRule, and whether its rules, and those of the predicates it calls, 
+  are Horn clauses over predicates defined by rules or facts. An answer of a
+  Horn predicate holds whatever further bindings its call gets.
+  """
+  from trimlogic.facttable import FactTablePredicate
+  from trimlogic.predicate import MutableRule
+  from trimlogic.trail import _is_rule_resolver
+  stable = horn = True
+  seen = set([predicate])
+  predicates = [predicate]
+  while predicates:
+    called = predicates.pop()
+    if isinstance(called, FactTablePredicate):
+      continue
+    if not _is_rule_resolver(called):
+      horn = False
+      continue
+    for rule in called.rules:
+      if isinstance(rule, MutableRule):
+        stable = False
+      for literal in rule.body:
+        if not isinstance(literal, Pred):
+          horn = False
+          continue
+        # compound arguments may be goals the literal calls.
+        goals = [literal] + [term for term in literal.terms 
+                             if isinstance(term, Pred)]
+        for goal in goals:
+          if goal.predicate not in seen:
+            seen.add(goal.predicate)
+            predicates.append(goal.predicate)
+  return stable, horn
+
+def _input_positions(predicate):
+  modes = predicate.param_modes
+  if modes == None:
+    return None
+  return tuple([i for i in xrange(len(modes)) 
+                if modes[i] == trimlogic.predicate.INPUT])
+
+def _ask_tabled(predicate, queries, engine, inputs):
+  """
+  Answers the queries from the answer tables of the calls they share. Given
+  the input positions of the predicate, a query binding all of them shares 
+  the call which only binds those. With the dict engine any other ground 
+  query is its own call, and the remaining queries are proved with 
+  fol_bc_ask, as the trail engine proves a ground query faster than its 
+  table is computed.
+  """
+  from trimlogic.tabling import answer_table, variant_key, _rename
+  from trimlogic.trail import BindingStore
+  tables = {}
+  answers = []
+  for values in queries:
+    call = values
+    if inputs != None and len(values) == len(predicate.param_modes):
+      call = [Var('_A%s' % i) for i in xrange(len(values))]
+      for i in inputs:
+        if find_variables([values[i]]):
+          call = values
+          break
+        call[i] = values[i]
+      call = tuple(call)
+    if call is values and (engine == 'trail' 
+                           or find_variables(list(values))):
+      answers.append(_holds(predicate, values, engine))
+      continue
+    key = variant_key(call)
+    if not tables.has_key(key):
+      tables[key] = answer_table(predicate, call, engine)
+    table = tables[key]
+    if call is values:
+      answers.append(len(table) > 0)
+    elif table.ground and not find_variables(list(values)):
+      if table.__dict__.get('_members') == None:
+        table._members = set(table.answers)
+      answers.append(values in table._members)
+    else:
+      for answer in table.answers:
+        if BindingStore().unify(values, _rename(answer)):
+          answers.append(True)
+          break
+      else:
+        answers.append(False)
+  return answers
+
+def _lookup_pattern(values):
+  """
+  Returns the positions of the constants among values, or None if a value is
+  neither a constant nor a variable.
+  """
+  columns = []
+  for i in xrange(len(values)):
+    if isinstance(values[i], (Pred, Function, list, tuple)):
+      return None
+    if not isinstance(values[i], Var):
+      columns.append(i)
+  return tuple(columns)
+
+def _matches(relation, values, columns):
+  key = tuple([values[i] for i in columns])
+  equal, first = [], {}
+  for i in xrange(len(values)):
+    if isinstance(values[i], Var):
+      equal.append((first.setdefault(values[i], i), i))
+  for row in relation.lookup(columns, key):
+    for i, k in equal:
+      if row[i] != row[k]:
+        break
+    else:
+      return True
+  return False
+
+def _holds(predicate, values, engine):
+  for answer in fol_bc_ask([predicate(*values)], {}, engine):
+    return answer != None
+  return False
+
+# The predicate and queries the workers of ask_many prove, set before the 
+# pool is created so that the workers inherit them when they are forked.
+_ask_state = None
+
+def _ask_task(i):
+  predicate, queries, engine = _ask_state
+  return _holds(predicate, queries[i], engine)
+
+def _ask_parallel(processes, predicate, queries, engine):
+  global _ask_state
+  _ask_state = (predicate, queries, engine)
+  try:
+    pool = multiprocessing.Pool(processes)
+  finally:
+    _ask_state = None
+  try:
+    return pool.map(_ask_task, xrange(len(queries)))
+  finally:
+    pool.terminate()
+    pool.join()
+
+def dict_bc_ask(goals, substitutions, monitor=None, depth=1):
+  """
+  The original resolution engine. Every resolution step composes the unifier
+  into a new substitution dict. A cut stops the whole proof by generating None
+  after its last answer.
+  
+  @param monitor: Counts the resolution steps, see QueryLimits.start.
+  @param depth: The depth of the resolution step proving the first goal.
   """
-  logger.debug("fol_bc_ask( " + str(goals) + " ) :: " + str(substitutions))
   if len(goals) == 0:
     yield substitutions
     return
+  if monitor != None:
+    monitor.call(depth)
   goal = goals[0].apply_bindings(substitutions)
-  logger.debug("goal after substitution: " + str(goal))
-  for mgu,new_goals,variables in goal.predicate._resolve(goal.terms):
-    for child_answers in fol_bc_ask(new_goals + goals[1:], compose(substitutions, mgu)):
+  resolvents = goal.predicate._resolve(goal.terms)
+  if stats.collector != None:
+    resolvents = stats.collector.observe_resolvents(goal.predicate, resolvents)
+  if trace.enabled:
+    resolvents = trace.observe_resolvents(goal, depth, resolvents)
+  for mgu,new_goals,variables in resolvents:
+    for child_answers in dict_bc_ask(new_goals + goals[1:], compose(substitutions, mgu),
+                                     monitor, depth + 1):
       if child_answers == None: 
-        logger.debug("received None for answers")
         yield None
         return
       for var in variables:
         try: 
           del child_answers[var]
-          logger.debug("Removed answer for %s" % var)
         except: pass
-      logger.debug("yielding %s" % child_answers)
       yield child_answers
   if goal.predicate == cut:
-    logger.debug("Cut encountered, stopping back tracking")
     yield None
     
\ No newline at end of file
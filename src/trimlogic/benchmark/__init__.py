@@ -0,0 +1,3 @@
+"""
+Benchmarks over synthetic data sets, see trimlogic.benchmark.runner.
+"""
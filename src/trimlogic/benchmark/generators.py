@@ -0,0 +1,151 @@
+"""
+Generators of synthetic data sets of any size. Every generator taking a seed
+is deterministic for a given seed, so results from different runs are over
+the same data.
+"""
+import random
+from trimlogic.term import VariableFactory
+from trimlogic.predicate import RuleBasedPredicate
+from trimlogic.facttable import FactTablePredicate
+from trimlogic.stdlib import plist
+
+
+def family_tree(generations, children=2):
+  """
+  Generates a family tree of the given number of generations. The first
+  generation is a single couple, and every couple has the given number of
+  children, each of whom marries someone from outside the tree and has
+  children in the next generation.
+
+  @return: The father and mother fact tables, over (parent, child) pairs of
+      names, and the list of people.
+  @rtype: tuple
+  """
+  father = FactTablePredicate('father', (str, str))
+  mother = FactTablePredicate('mother', (str, str))
+  people = ['p0', 'p1']
+  couples = [('p0', 'p1')]
+  for generation in xrange(1, generations):
+    next_couples = []
+    for husband, wife in couples:
+      for i in xrange(children):
+        child = 'p%s' % len(people)
+        spouse = 'p%s' % (len(people) + 1)
+        people.extend([child, spouse])
+        father.add_fact((husband, child))
+        mother.add_fact((wife, child))
+        # sons and daughters alternate.
+        if i % 2 == 0:
+          next_couples.append((child, spouse))
+        else:
+          next_couples.append((spouse, child))
+    couples = next_couples
+  return father, mother, people
+
+def random_dag(edges, nodes=None, seed=0):
+  """
+  Returns a list of edges (i, j), i < j, of a random directed acyclic graph
+  over nodes 0 to nodes - 1, which are edges / 2 + 1 if not given.
+  """
+  if nodes == None: nodes = edges / 2 + 1
+  if edges > nodes * (nodes - 1) / 2:
+    raise ValueError("A DAG of %s nodes has at most %s edges."
+                     % (nodes, nodes * (nodes - 1) / 2))
+  rng = random.Random(seed)
+  found = set()
+  while len(found) < edges:
+    i, j = rng.randrange(nodes), rng.randrange(nodes)
+    if i != j:
+      found.add((min(i, j), max(i, j)))
+  return sorted(found)
+
+def cyclic_graph(edges, nodes=None, seed=0):
+  """
+  Returns a list of edges (i, j) of a random directed graph over nodes 0 to
+  nodes - 1, which are edges / 2 + 1 if not given. The first nodes edges form
+  a cycle through every node, the others are random.
+  """
+  if nodes == None: nodes = edges / 2 + 1
+  if edges < nodes or edges > nodes * (nodes - 1):
+    raise ValueError("A cyclic graph of %s nodes has from %s to %s edges."
+                     % (nodes, nodes, nodes * (nodes - 1)))
+  rng = random.Random(seed)
+  found = set([(i, (i + 1) % nodes) for i in xrange(nodes)])
+  while len(found) < edges:
+    i, j = rng.randrange(nodes), rng.randrange(nodes)
+    if i != j:
+      found.add((i, j))
+  return sorted(found)
+
+def edge_table(edges, name='edge'):
+  return FactTablePredicate(name, (int, int), facts=edges)
+
+def path_predicate(edge, name='path'):
+  """
+  Returns the transitive closure of edge. It is tabled, so that it halts on
+  cyclic graphs, and left recursive, so that a call with a bound first 
+  argument has a single recursive call variant.
+  """
+  v = VariableFactory()
+  path = RuleBasedPredicate(name, (int, int), tabled=True)
+  path.add_rule( Head=( v.X, v.Y ), Body=( edge(v.X, v.Y), ) )
+  path.add_rule( Head=( v.X, v.Y ), Body=( path(v.X, v.Z), edge(v.Z, v.Y) ) )
+  return path
+
+def number_list(length):
+  """
+  Returns the list of the integers 0 to length - 1 as a term.
+  """
+  return plist(range(length))
+
+def compose(pairs, other_pairs):
+  """
+  Returns the set of pairs (x, z) such that (x, y) is in pairs and (y, z) in
+  other_pairs for some y.
+  """
+  successors = {}
+  for y, z in other_pairs:
+    successors.setdefault(y, []).append(z)
+  return set([(x, z) for x, y in pairs for z in successors.get(y, ())])
+
+def closure(pairs):
+  """
+  Returns the transitive closure of a set of pairs.
+  """
+  result = set(pairs)
+  step = set(pairs)
+  while step:
+    step = compose(step, pairs) - result
+    result |= step
+  return result
+
+def noisy_examples(relation, universe, positives, negatives, noise=0.0,
+                   seed=0):
+  """
+  Samples positive examples from relation and negative examples from the
+  pairs of universe not in it, then mislabels a fraction noise of each by
+  swapping them with the other.
+
+  @param relation: The tuples in the relation.
+  @type relation: set
+  @param universe: The values the negative examples are made of.
+  @type universe: list
+  @return: The lists of positive and negative examples.
+  @rtype: tuple
+  """
+  rng = random.Random(seed)
+  relation = sorted(relation)
+  positive = rng.sample(relation, min(positives, len(relation)))
+  in_relation = set(relation)
+  negative = set()
+  if len(universe) ** 2 - len(in_relation) < negatives:
+    raise ValueError("There are fewer than %s negative examples." % negatives)
+  while len(negative) < negatives:
+    pair = (rng.choice(universe), rng.choice(universe))
+    if not pair in in_relation:
+      negative.add(pair)
+  negative = sorted(negative)
+  rng.shuffle(negative)
+  flips = int(round(noise * min(len(positive), len(negative))))
+  return (negative[:flips] + positive[flips:],
+          positive[:flips] + negative[flips:])
@@ -0,0 +1,266 @@
+"""
+Times queries, FOIL and its postprocessing, and the parallel search for
+literals over the synthetic data sets of trimlogic.benchmark.generators at
+increasing sizes, and writes the results as JSON. Run it from the src
+directory, for example:
+
+  python -m trimlogic.benchmark.runner --queries 100,200,400 \\
+      --generations 2,3,4 --output results.json
+"""
+import time, json, random, platform, argparse, logging
+from trimlogic import stats, index
+from trimlogic.term import VariableFactory, UniqueVariableFactory
+from trimlogic.predicate import RuleBasedPredicate, MutableRule
+from trimlogic.algorithm import fol_bc_ask, ask_many
+from trimlogic.stdlib import dot, plist, append, reverse
+from trimlogic.tabling import abolish_tables
+from trimlogic.foil import foil, Budget, TrainingSet, ProbePool
+from trimlogic.foil import find_gainful_and_determinate_literals
+from trimlogic.foil import find_partial_ordering_of_terms
+from trimlogic.benchmark.generators import family_tree, random_dag, \
+     cyclic_graph, edge_table, path_predicate, number_list, closure, \
+     noisy_examples
+
+QUERY_SIZES = (100, 200, 400)
+GENERATIONS = (2, 3, 4)
+
+
+def time_call(function, repeat=1):
+  """
+  Calls function repeat times and returns the shortest time a call took, in
+  seconds, and the result of the last call.
+  """
+  best = None
+  for i in xrange(repeat):
+    started = time.time()
+    result = function()
+    seconds = time.time() - started
+    if best == None or seconds < best:
+      best = seconds
+  return best, result
+
+def count_answers(goals, engine):
+  def count():
+    abolish_tables()
+    n = 0
+    for answer in fol_bc_ask(goals, {}, engine):
+      n += 1
+    return n
+  return count
+
+def ask_all(predicate, tuples, engine):
+  def ask():
+    # a new generation of the clauses drops the extensions and answer tables
+    # ask_many kept from the previous call.
+    index.changed()
+    return sum(ask_many(predicate, tuples, engine))
+  return ask
+
+def member_predicate():
+  v = VariableFactory()
+  member = RuleBasedPredicate('member')
+  member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+  member.add_rule( Head=( v.X, dot(v.H, v.T) ), Body=( member(v.X, v.T), ) )
+  return member
+
+def benchmark_queries(sizes=QUERY_SIZES, engine='trail', repeat=1, seed=0):
+  """
+  Times queries over graphs of size edges and lists of size elements.
+
+  @return: A list of result records.
+  """
+  v = VariableFactory()
+  member = member_predicate()
+  results = []
+  for size in sizes:
+    dag = edge_table(random_dag(size, seed=seed))
+    dag_path = path_predicate(dag)
+    cyclic = edge_table(cyclic_graph(size, seed=seed))
+    cyclic_path = path_predicate(cyclic)
+    nodes = size / 2 + 1
+    rng = random.Random(seed)
+    pairs = [(rng.randrange(nodes), rng.randrange(nodes))
+             for i in xrange(size)]
+    numbers = number_list(size)
+    # naive reverse is quadratic, so it gets shorter lists.
+    short_numbers = number_list(max(1, size / 4))
+    queries = [('dag_path', count_answers([dag_path(0, v.Y)], engine)),
+               ('cyclic_path', count_answers([cyclic_path(0, v.Y)], engine)),
+               ('dag_path_ask_many', ask_all(dag_path, pairs, engine)),
+               ('member', count_answers([member(v.X, numbers)], engine)),
+               ('append', count_answers([append(numbers, plist([0]), v.X)],
+                                        engine)),
+               ('reverse', count_answers([reverse(short_numbers, v.X)],
+                                         engine))]
+    for name, query in queries:
+      seconds, answers = time_call(query, repeat)
+      results.append({'benchmark': name, 'engine': engine, 'size': size,
+                      'seconds': seconds, 'answers': answers})
+  return results
+
+def benchmark_foil(generations=GENERATIONS, engine='trail', examples=20,
+                   noise=0.0, seconds=None, seed=0):
+  """
+  Times learning the ancestor relation from the father and mother relations
+  of family trees of the given numbers of generations, end to end and for
+  the postprocessing of the learned rules alone.
+
+  @param examples: The number of positive and of negative examples.
+  @param noise: The fraction of the examples which are mislabelled.
+  @param seconds: The budget of each run, see foil.
+  @return: A list of result records.
+  """
+  results = []
+  for size in generations:
+    father, mother, people = family_tree(size)
+    parents = set(list(father) + list(mother))
+    positive, negative = noisy_examples(closure(parents), people, examples,
+                                        examples, noise, seed)
+    ancestor = RuleBasedPredicate('ancestor', (str, str))
+    budget = None
+    if seconds != None:
+      budget = Budget(seconds=seconds)
+    collector = stats.enable()
+    try:
+      total, complete = time_call(lambda: foil(ancestor, positive, negative,
+                                               [father, mother, ancestor],
+                                               engine=engine,
+                                               budget=budget))
+    finally:
+      stats.disable()
+    timings = collector.as_dict()['timings']
+    results.append({'benchmark': 'foil_ancestor', 'engine': engine,
+                    'size': size, 'seconds': total,
+                    'foil_main_seconds': timings['foil_main']['seconds'],
+                    'postprocessing_seconds':
+                        timings['postprocessing']['seconds'],
+                    'people': len(people), 'examples': examples,
+                    'noise': noise, 'complete': complete,
+                    'rules': [str(rule) for rule in ancestor.rules],
+                    'literals': collector.counters})
+  return results
+
+def benchmark_parallel_search(generations=GENERATIONS, engine='trail', 
+                              examples=40, processes=2, searches=3, seed=0):
+  """
+  Times the search for the first literal of a clause of a relation between 
+  the people of family trees, in this process and by a ProbePool of worker
+  processes. The background predicates are parent and ancestor, defined by
+  rules over the father and mother relations, so every candidate literal of
+  them is proved top-down for each example. A quarter of the examples are
+  mislabelled so that no literal completes the clause and every candidate 
+  is probed. The search is run searches times, the pool being created once as
+  it is for a run of foil, and the speedup is the serial time over the 
+  parallel one. It can only exceed 1 given a processor for each worker.
+
+  @return: A list of result records.
+  """
+  v = VariableFactory()
+  results = []
+  for size in generations:
+    father, mother, people = family_tree(size)
+    parent = RuleBasedPredicate('parent', (str, str))
+    parent.add_rule( Head=( v.X, v.Y ), Body=( father(v.X, v.Y), ) )
+    parent.add_rule( Head=( v.X, v.Y ), Body=( mother(v.X, v.Y), ) )
+    ancestor = RuleBasedPredicate('ancestor', (str, str))
+    ancestor.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Y), ) )
+    ancestor.add_rule( Head=( v.X, v.Y ), 
+                       Body=( parent(v.X, v.Z), ancestor(v.Z, v.Y) ) )
+    relation = closure(set(list(father) + list(mother)))
+    count = min(examples, len(relation), len(people) ** 2 - len(relation))
+    positive, negative = noisy_examples(relation, people, count, count, 
+                                        0.25, seed)
+    related = RuleBasedPredicate('related', (str, str))
+    factory = UniqueVariableFactory()
+    head = factory.next_variable_sequence(2, prefix='PARAM_', 
+                                          types=[str, str])
+    rule = MutableRule(related, tuple(head), [])
+    related.rules.append(rule)
+    bk = [father, mother, parent, ancestor, related]
+    ordering = find_partial_ordering_of_terms(rule)
+    def search(pool):
+      for i in xrange(searches):
+        training_set = TrainingSet(related, head, positive, negative, 
+                                   engine, cache_size=0)
+        literals, determinate = find_gainful_and_determinate_literals(
+            related, rule, training_set, bk, UniqueVariableFactory(), 
+            ordering, 
+            grab_size=3, pool=pool)
+      return [str(literal) for gain, literal, variables in literals]
+    serial_seconds, serial_literals = time_call(lambda: search(None))
+    def search_in_pool():
+      pool = ProbePool(processes, bk)
+      try:
+        return search(pool)
+      finally:
+        pool.close()
+    seconds, literals = time_call(search_in_pool)
+    results.append({'benchmark': 'parallel_search', 'engine': engine,
+                    'size': size, 'seconds': seconds,
+                    'serial_seconds': serial_seconds,
+                    'speedup': serial_seconds / max(seconds, 1e-9),
+                    'processes': processes, 'searches': searches,
+                    'people': len(people), 'examples': count,
+                    'same_literals': literals == serial_literals,
+                    'literals': literals})
+  return results
+
+def run(query_sizes=QUERY_SIZES, generations=GENERATIONS, engine='trail',
+        repeat=1, examples=20, noise=0.0, seconds=None, seed=0, processes=2):
+  """
+  Runs every benchmark and returns the results with a description of the
+  environment they were run in.
+  """
+  results = benchmark_queries(query_sizes, engine, repeat, seed)
+  results.extend(benchmark_foil(generations, engine, examples, noise,
+                                seconds, seed))
+  results.extend(benchmark_parallel_search(generations, engine, 
+                                           2 * examples, processes, 
+                                           seed=seed))
+  return {'python': platform.python_version(),
+          'platform': platform.platform(),
+          'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'results': results}
+
+def _sizes(text):
+  return [int(size) for size in text.split(',') if size]
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--queries', type=_sizes, default=list(QUERY_SIZES),
+                      help='comma separated graph and list sizes')
+  parser.add_argument('--generations', type=_sizes,
+                      default=list(GENERATIONS),
+                      help='comma separated family tree generations')
+  parser.add_argument('--engine', default='trail', choices=['dict', 'trail'])
+  parser.add_argument('--repeat', type=int, default=1,
+                      help='times each query is run, the fastest counting')
+  parser.add_argument('--examples', type=int, default=20,
+                      help='positive and negative examples for FOIL')
+  parser.add_argument('--noise', type=float, default=0.0,
+                      help='fraction of mislabelled examples')
+  parser.add_argument('--seconds', type=float, default=None,
+                      help='budget of each FOIL run')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--processes', type=int, default=2,
+                      help='worker processes of the parallel literal search')
+  parser.add_argument('--output', default=None,
+                      help='file the JSON results are written to, standard '
+                           'output if not given')
+  options = parser.parse_args(argv)
+  logging.basicConfig(level=logging.WARNING)
+  report = run(options.queries, options.generations, options.engine,
+               options.repeat, options.examples, options.noise,
+               options.seconds, options.seed, options.processes)
+  document = json.dumps(report, indent=2, sort_keys=True)
+  if options.output == None:
+    print document
+  else:
+    output = open(options.output, 'w')
+    try:
+      output.write(document + '\n')
+    finally:
+      output.close()
+
+if __name__ == "__main__":
+  main()
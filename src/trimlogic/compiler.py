@@ -0,0 +1,333 @@
+"""
+Compilation of function-free rules into Python generator functions.
+
+A compiled predicate answers calls without renaming rules, unifying terms or
+composing substitutions. Its rules are compiled separately for each call
+mode, that is for each combination of bound and free arguments, into a single
+generator function which takes the values of the bound arguments and
+generates a tuple holding the values of all the arguments for every answer.
+As the mode of every body literal is then known, each variable of a clause is
+a local variable of the function which is either known to be bound or is
+assigned by the literal binding it, and each body literal is a loop over the
+answers of the function compiled for its predicate and mode. A cut returns
+from the function once the goals after it are exhausted, so it discards the
+alternatives of the goals before it and the clauses after it, as the trail
+engine does.
+
+The predicates a compiled predicate calls are compiled as well if they can
+be, the others being called through fol_bc_ask, or looked up directly if they
+are fact tables. Every answer has to be ground.
+"""
+from trimlogic import index
+from trimlogic.term import Var, Pred, Function, find_variables
+from trimlogic.predicate import CutPredicate
+from trimlogic.facttable import FactTablePredicate
+
+
+class CompiledPredicate:
+  """
+  A predicate whose rules are compiled into Python functions. The functions
+  are compiled the first time they are called, and compiled again after the
+  clauses or facts of any predicate change.
+  """
+
+  def __init__(self, predicate):
+    if not is_compilable(predicate):
+      raise ValueError("Predicate '%s' can not be compiled, its rules are not "
+                       "function-free and range restricted." % predicate)
+    self.predicate = predicate
+    self._program = None
+
+  def get_procedure(self, mode):
+    """
+    Returns the function answering calls in the given mode, a sequence of
+    booleans telling which arguments are bound. The function takes the values
+    of the bound arguments and generates a tuple of values for every answer.
+    """
+    program = self._program
+    if program == None or program.generation != index.generation:
+      if not is_compilable(self.predicate):
+        raise ValueError("Predicate '%s' can no longer be compiled."
+                         % self.predicate)
+      program = self._program = _Program()
+    return program.get_procedure(self.predicate, tuple(mode))
+
+  def ask(self, *terms):
+    """
+    Generates the answers to a call with the given arguments, each answer
+    being a dict binding the variables among them, like the answers of
+    fol_bc_ask.
+    """
+    mode, values, positions, equal = [], [], {}, []
+    for i in xrange(len(terms)):
+      term = terms[i]
+      if isinstance(term, Var):
+        if positions.has_key(term):
+          equal.append((positions[term], i))
+        else:
+          positions[term] = i
+        mode.append(False)
+      elif is_ground(term):
+        mode.append(True)
+        values.append(term)
+      else:
+        raise ValueError("Argument %s is neither ground nor a variable."
+                         % term)
+    procedure = self.get_procedure(mode)
+    positions = positions.items()
+    for row in procedure(*values):
+      matched = True
+      for i, k in equal:
+        if not (row[i] == row[k] or _same(row[i], row[k])):
+          matched = False
+          break
+      if matched:
+        answer = {}
+        for var, i in positions:
+          answer[var] = row[i]
+        yield answer
+
+  def holds(self, *terms):
+    for answer in self.ask(*terms):
+      return True
+    return False
+
+
+def is_ground(term):
+  if isinstance(term, Var):
+    return False
+  if isinstance(term, (Pred, Function, list, tuple)):
+    return not find_variables(term)
+  return True
+
+def is_cut(literal):
+  return (isinstance(literal, CutPredicate)
+          or isinstance(literal.predicate, CutPredicate))
+
+def is_compilable(predicate):
+  """
+  True if the predicate is defined by rules whose arguments are variables or
+  ground terms and whose head variables all occur in their bodies.
+  """
+  from trimlogic.trail import _is_rule_resolver
+  if not _is_rule_resolver(predicate) or predicate.tabled:
+    return False
+  for rule in predicate.rules:
+    body_variables = set()
+    for literal in rule.body:
+      if not isinstance(literal, Pred):
+        return False
+      if is_cut(literal):
+        continue
+      for term in literal.terms:
+        if isinstance(term, Var):
+          body_variables.add(term)
+        elif not is_ground(term):
+          return False
+    for term in rule.terms:
+      if isinstance(term, Var):
+        if not term in body_variables:
+          return False
+      elif not is_ground(term):
+        return False
+  return True
+
+def _same(a, b):
+  # compound terms are equal if their arguments are, like they unify.
+  if not (isinstance(a, Pred) and isinstance(b, Pred)):
+    return False
+  if a.predicate != b.predicate or len(a.terms) != len(b.terms):
+    return False
+  for x, y in zip(a.terms, b.terms):
+    if not (x == y or _same(x, y)):
+      return False
+  return True
+
+def _equal(x, y):
+  return "(%s == %s or _same(%s, %s))" % (x, y, x, y)
+
+
+class _Program:
+  """
+  The functions compiled for the predicates and modes reachable from the
+  calls made so far. The functions refer to each other by name in a shared
+  namespace, so recursive predicates need no special treatment.
+  """
+
+  def __init__(self):
+    self.generation = index.generation
+    self.namespace = {'_same': _same}
+    self._names = {}
+    self._pending = []
+
+  def get_procedure(self, predicate, mode):
+    name = self.get_name(predicate, mode)
+    while self._pending:
+      self._define(*self._pending.pop())
+    return self.namespace[name]
+
+  def get_name(self, predicate, mode):
+    """
+    Returns the name of the function for predicate and mode, which is
+    defined before the next call returns from get_procedure.
+    """
+    try:
+      return self._names[(predicate, mode)]
+    except KeyError:
+      name = 'p%s_%s' % (len(self._names),
+                         ''.join([bound and 'b' or 'f' for bound in mode]))
+      self._names[(predicate, mode)] = name
+      self._pending.append((name, predicate, mode))
+      return name
+
+  def get_constant(self, value):
+    name = 'k%s' % len(self.namespace)
+    self.namespace[name] = value
+    return name
+
+  def _define(self, name, predicate, mode):
+    if isinstance(predicate, FactTablePredicate):
+      self.namespace[name] = _table_procedure(predicate, mode)
+    elif is_compilable(predicate):
+      source = '\n'.join(self._compile(name, predicate, mode)) + '\n'
+      exec compile(source, '<compiled %s>' % predicate, 'exec') in (
+          self.namespace)
+    else:
+      self.namespace[name] = _goal_procedure(predicate, mode)
+
+  def _compile(self, name, predicate, mode):
+    arguments = ['a%s' % i for i in xrange(len(mode)) if mode[i]]
+    lines = ['def %s(%s):' % (name, ', '.join(arguments))]
+    rules = [rule for rule in predicate.rules if len(rule.terms) == len(mode)]
+    for k in xrange(len(rules)):
+      _ClauseCompiler(self, rules[k], mode, 'c%s_' % k, lines).compile()
+    if not rules:
+      lines.extend(['  return', '  yield'])
+    return lines
+
+
+class _ClauseCompiler:
+  """
+  Appends the code answering a call in the given mode with one rule to lines.
+  """
+
+  def __init__(self, program, rule, mode, prefix, lines):
+    self.program = program
+    self.rule = rule
+    self.mode = mode
+    self.prefix = prefix
+    self.lines = lines
+    self.slots = {}
+    self.bound = set()
+    self.answer = []
+
+  def emit(self, indent, line):
+    self.lines.append('  ' * indent + line)
+
+  def slot(self, var):
+    try:
+      return self.slots[var]
+    except KeyError:
+      slot = self.slots[var] = '%sv%s' % (self.prefix, len(self.slots))
+      return slot
+
+  def compile(self):
+    indent = 1
+    for i in xrange(len(self.mode)):
+      term = self.rule.terms[i]
+      argument = 'a%s' % i
+      if isinstance(term, Var):
+        slot = self.slot(term)
+        if not self.mode[i]:
+          self.answer.append(slot)
+          continue
+        if term in self.bound:
+          self.emit(indent, 'if %s:' % _equal(argument, slot))
+          indent += 1
+        else:
+          self.emit(indent, '%s = %s' % (slot, argument))
+          self.bound.add(term)
+        self.answer.append(argument)
+      elif self.mode[i]:
+        constant = self.program.get_constant(term)
+        self.emit(indent, 'if %s:' % _equal(argument, constant))
+        indent += 1
+        self.answer.append(argument)
+      else:
+        self.answer.append(self.program.get_constant(term))
+    self.compile_body(0, indent)
+
+  def compile_body(self, position, indent):
+    body = self.rule.body
+    if position == len(body):
+      self.emit(indent, 'yield (%s,)' % ', '.join(self.answer))
+      return
+    literal = body[position]
+    if is_cut(literal):
+      self.compile_body(position + 1, indent)
+      self.emit(indent, 'return')
+      return
+    mode, arguments, free, equal = [], [], [], []
+    first = {}
+    for i in xrange(len(literal.terms)):
+      term = literal.terms[i]
+      if isinstance(term, Var) and not term in self.bound:
+        if first.has_key(term):
+          equal.append((first[term], i))
+        else:
+          first[term] = i
+          free.append((term, i))
+        mode.append(False)
+      else:
+        if isinstance(term, Var):
+          arguments.append(self.slot(term))
+        else:
+          arguments.append(self.program.get_constant(term))
+        mode.append(True)
+    name = self.program.get_name(literal.predicate, tuple(mode))
+    row = '%sr%s' % (self.prefix, position)
+    self.emit(indent, 'for %s in %s(%s):' % (row, name, ', '.join(arguments)))
+    indent += 1
+    for var, i in free:
+      self.emit(indent, '%s = %s[%s]' % (self.slot(var), row, i))
+      self.bound.add(var)
+    for i, k in equal:
+      self.emit(indent, 'if %s:' % _equal('%s[%s]' % (row, i),
+                                          '%s[%s]' % (row, k)))
+      indent += 1
+    self.compile_body(position + 1, indent)
+
+
+def _table_procedure(table, mode):
+  positions = [i for i in xrange(len(mode)) if mode[i]]
+  def procedure(*values):
+    if table.arity != len(mode):
+      return iter(())
+    return table.select(zip(positions, values))
+  return procedure
+
+def _goal_procedure(predicate, mode):
+  from trimlogic.algorithm import fol_bc_ask
+  variables = [Var('_A%s' % i) for i in xrange(len(mode))]
+  def procedure(*values):
+    values = iter(values)
+    terms = []
+    for i in xrange(len(mode)):
+      if mode[i]:
+        terms.append(values.next())
+      else:
+        terms.append(variables[i])
+    goal = predicate(*terms)
+    for answer in fol_bc_ask([goal], {}, 'trail'):
+      row = []
+      for i in xrange(len(mode)):
+        if mode[i]:
+          row.append(terms[i])
+        else:
+          value = answer[variables[i]]
+          if not is_ground(value):
+            raise ValueError("%s has an answer which is not ground, %s."
+                             % (goal, value))
+          row.append(value)
+      yield tuple(row)
+  return procedure
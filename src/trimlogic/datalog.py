@@ -0,0 +1,405 @@
+"""
+Bottom-up evaluation of function-free (Datalog) rules.
+
+The extension of every derived predicate is computed with semi-naive
+iteration: after a first round over the full relations, each round only joins
+the tuples derived in the previous round with the rest of a rule body, until
+no new tuple is found. Body literals are joined left to right with hash
+joins on the variables they share with the literals before them. The results
+are materialized into fact tables, which the top-down engines can query.
+"""
+from trimlogic.term import Var, Pred, Function, find_variables
+from trimlogic.predicate import RuleBasedPredicate, CutPredicate
+from trimlogic.facttable import FactTablePredicate
+
+
+class Relation:
+  """
+  A set of tuples with hash indexes on the column combinations that joins look
+  them up by. The indexes are built on the first lookup and kept up to date as
+  tuples are added.
+  """
+
+  def __init__(self, tuples=()):
+    self.tuples = []
+    self._set = set()
+    self._indexes = {}
+    for row in tuples:
+      self.add(row)
+
+  def add(self, row):
+    if row in self._set:
+      return False
+    self._set.add(row)
+    self.tuples.append(row)
+    for columns, index in self._indexes.iteritems():
+      index.setdefault(tuple([row[i] for i in columns]), []).append(row)
+    return True
+
+  def lookup(self, columns, key):
+    """
+    Returns the tuples whose values in the given columns are key.
+    """
+    if not columns:
+      return self.tuples
+    try:
+      index = self._indexes[columns]
+    except KeyError:
+      index = self._indexes[columns] = {}
+      for row in self.tuples:
+        index.setdefault(tuple([row[i] for i in columns]), []).append(row)
+    return index.get(key, ())
+
+  def __contains__(self, row):
+    return row in self._set
+
+  def __iter__(self):
+    return iter(self.tuples)
+
+  def __len__(self):
+    return len(self.tuples)
+
+
+def materialize(kb, predicates=None):
+  """
+  Computes the extensions of the given predicates bottom-up and returns a dict
+  mapping each of them to a FactTablePredicate holding its extension. If no
+  predicates are given every predicate of kb defined by rules is materialized.
+  The predicates the rules depend on are found through the rule bodies and
+  evaluated as well.
+
+  Rules must be function-free and every head variable must occur in the body.
+  Body literals over predicates defined by ground facts or by rules are joined
+  bottom-up. Any other literal, such as a call to a built in predicate, is
+  proved top-down with the trail engine for each partial tuple once its
+  variables bound by earlier literals are known.
+
+  @raise ValueError: If a rule is not a Datalog rule.
+  """
+  if predicates == None:
+    predicates = [predicate for predicate in kb if _is_derived(predicate)]
+  relations = evaluate(predicates)
+  tables = {}
+  for predicate in predicates:
+    table = FactTablePredicate(predicate.name, predicate.param_types)
+    table.arity = predicate.arity
+    table.param_orderings = predicate.param_orderings
+    table.param_modes = predicate.param_modes
+    table.add_facts(relations[predicate])
+    tables[predicate] = table
+  return tables
+
+def evaluate(predicates):
+  """
+  Computes the extensions of the given predicates, and of the derived
+  predicates they depend on, returning a dict from each predicate to its
+  Relation.
+  """
+  relations = {}
+  derived = _collect_derived(predicates, relations)
+  for component in _components(derived):
+    _evaluate_component(component, derived, relations)
+  return relations
+
+def _is_derived(predicate):
+  if not _resolves_by_rules(predicate):
+    return False
+  for rule in predicate.rules:
+    if rule.body:
+      return True
+  return False
+
+def _resolves_by_rules(predicate):
+  resolve = getattr(predicate.__class__, '_resolve', None)
+  return (resolve != None
+          and resolve.im_func is RuleBasedPredicate._resolve.im_func)
+
+def _is_constant(term):
+  return not isinstance(term, (Var, Pred, Function, list, tuple))
+
+def _base_relation(predicate):
+  """
+  Returns the Relation of a predicate defined by ground facts, or None if the
+  predicate is not.
+  """
+  if isinstance(predicate, FactTablePredicate):
+    return Relation(predicate)
+  if not _resolves_by_rules(predicate):
+    return None
+  relation = Relation()
+  for rule in predicate.rules:
+    if rule.body:
+      return None
+    for term in rule.terms:
+      if not _is_constant(term):
+        return None
+    relation.add(tuple(rule.terms))
+  return relation
+
+def _collect_derived(predicates, relations):
+  """
+  Returns a dict from each derived predicate reachable from predicates to its
+  compiled rules, adding the relations of the base predicates they use to
+  relations.
+  """
+  derived = {}
+  stack = []
+  for predicate in predicates:
+    if _is_derived(predicate):
+      derived[predicate] = _plan_rules(predicate)
+      stack.append(predicate)
+    else:
+      relation = _base_relation(predicate)
+      if relation == None:
+        raise ValueError("Predicate '%s' is neither defined by ground facts "
+                         "nor by Datalog rules." % predicate)
+      relations[predicate] = relation
+  while stack:
+    for plan in derived[stack.pop()]:
+      for literal in plan.literals:
+        predicate = literal.predicate
+        if derived.has_key(predicate):
+          continue
+        if relations.has_key(predicate):
+          if relations[predicate] == None:
+            plan.builtins.add(literal)
+          continue
+        plans = None
+        if _is_derived(predicate):
+          try:
+            plans = _plan_rules(predicate)
+          except ValueError:
+            pass
+        if plans != None:
+          derived[predicate] = plans
+          stack.append(predicate)
+        else:
+          # neither a Datalog predicate nor a base relation, so it is proved 
+          # top-down.
+          relations[predicate] = _base_relation(predicate)
+          if relations[predicate] == None:
+            plan.builtins.add(literal)
+  for predicate in relations.keys():
+    if relations[predicate] == None:
+      del relations[predicate]
+  return derived
+
+def _plan_rules(predicate):
+  return [_RulePlan(rule) for rule in predicate.rules]
+
+def _components(derived):
+  """
+  Returns the strongly connected components of the dependency graph of the
+  derived predicates, each one after the components it depends on.
+  """
+  def dependencies(predicate):
+    for plan in derived[predicate]:
+      for literal in plan.literals:
+        if derived.has_key(literal.predicate):
+          yield literal.predicate
+  # Tarjan's algorithm, with an explicit stack of (predicate, dependencies).
+  numbers, lowlinks, on_stack = {}, {}, set()
+  stack, components = [], []
+  for root in derived:
+    if numbers.has_key(root):
+      continue
+    work = [(root, dependencies(root))]
+    numbers[root] = lowlinks[root] = len(numbers)
+    stack.append(root)
+    on_stack.add(root)
+    while work:
+      predicate, successors = work[-1]
+      for successor in successors:
+        if not numbers.has_key(successor):
+          numbers[successor] = lowlinks[successor] = len(numbers)
+          stack.append(successor)
+          on_stack.add(successor)
+          work.append((successor, dependencies(successor)))
+          break
+        elif successor in on_stack:
+          lowlinks[predicate] = min(lowlinks[predicate], numbers[successor])
+      else:
+        work.pop()
+        if work:
+          parent = work[-1][0]
+          lowlinks[parent] = min(lowlinks[parent], lowlinks[predicate])
+        if lowlinks[predicate] == numbers[predicate]:
+          component = []
+          while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            component.append(member)
+            if member is predicate:
+              break
+          components.append(component)
+  return components
+
+def _evaluate_component(component, derived, relations):
+  for predicate in component:
+    relations[predicate] = Relation()
+  recursive = set(component)
+  # the first round uses the full relations, which are empty for the
+  # predicates of the component.
+  delta = {}
+  for predicate in component:
+    delta[predicate] = Relation()
+    for plan in derived[predicate]:
+      for row in plan.evaluate(relations):
+        if relations[predicate].add(row):
+          delta[predicate].add(row)
+  # later rounds join the tuples derived in the previous round, for each
+  # recursive literal of a rule in turn.
+  while True:
+    new = {}
+    found = False
+    for predicate in component:
+      new[predicate] = Relation()
+      for plan in derived[predicate]:
+        for i in xrange(len(plan.literals)):
+          if not plan.literals[i].predicate in recursive:
+            continue
+          for row in plan.evaluate(relations, i, delta):
+            if not row in relations[predicate] and new[predicate].add(row):
+              found = True
+    if not found:
+      break
+    for predicate in component:
+      for row in new[predicate]:
+        relations[predicate].add(row)
+    delta = new
+
+
+class _RulePlan:
+  """
+  A rule compiled for bottom-up evaluation. The variables of the rule are
+  numbered in the order the body binds them, a partial solution being a tuple
+  holding their values.
+  """
+
+  def __init__(self, rule):
+    self.rule = rule
+    self.literals = []
+    self.builtins = set()
+    for literal in rule.body:
+      if (not isinstance(literal, Pred) or isinstance(literal, CutPredicate)
+          or isinstance(literal.predicate, CutPredicate)):
+        raise ValueError("Rule %s has a body literal %s that can not be "
+                         "evaluated bottom-up." % (rule, literal))
+      self.literals.append(literal)
+    self.head = list(rule.terms)
+    for term in self.head:
+      if not (isinstance(term, Var) or _is_constant(term)):
+        raise ValueError("Rule %s is not function-free." % rule)
+    self._steps = None
+
+  def _compile(self):
+    slots = {}
+    steps = []
+    for literal in self.literals:
+      bound_columns, key, new, equal = [], [], [], []
+      if literal in self.builtins:
+        variables = []
+        for var in find_variables(list(literal.terms)):
+          if not slots.has_key(var) and not var in variables:
+            variables.append(var)
+        bound = [(var, slots[var]) for var in slots]
+        for var in variables:
+          slots[var] = len(slots)
+        steps.append((literal, True, bound, variables, None))
+        continue
+      first = {}
+      for i in xrange(len(literal.terms)):
+        term = literal.terms[i]
+        if isinstance(term, Var):
+          if slots.has_key(term):
+            bound_columns.append(i)
+            key.append((True, slots[term]))
+          elif first.has_key(term):
+            equal.append((first[term], i))
+          else:
+            first[term] = i
+            new.append(i)
+        elif _is_constant(term):
+          bound_columns.append(i)
+          key.append((False, term))
+        else:
+          raise ValueError("Rule %s is not function-free." % self.rule)
+      for i in new:
+        slots[literal.terms[i]] = len(slots)
+      steps.append((literal, False, tuple(bound_columns), key, (new, equal)))
+    head = []
+    for term in self.head:
+      if isinstance(term, Var):
+        if not slots.has_key(term):
+          raise ValueError("Rule %s is not range restricted, %s does not "
+                           "occur in its body." % (self.rule, term))
+        head.append((True, slots[term]))
+      else:
+        head.append((False, term))
+    self._steps, self._head = steps, head
+
+  def evaluate(self, relations, delta_position=None, delta=None):
+    """
+    Generates the head tuples derived by the rule. If delta_position is given
+    the literal at that position is joined with its relation in delta rather
+    than in relations.
+    """
+    if self._steps == None:
+      self._compile()
+    rows = [()]
+    for position in xrange(len(self._steps)):
+      literal, builtin, bound, key, extra = self._steps[position]
+      if builtin:
+        rows = _prove(literal, bound, key, rows)
+        continue
+      if position == delta_position:
+        relation = delta[literal.predicate]
+      else:
+        relation = relations[literal.predicate]
+      new, equal = extra
+      extended = []
+      for row in rows:
+        values = _instantiate(key, row)
+        for match in relation.lookup(bound, values):
+          matched = True
+          for i, k in equal:
+            if match[i] != match[k]:
+              matched = False
+              break
+          if matched:
+            extended.append(row + tuple([match[i] for i in new]))
+      rows = extended
+      if not rows:
+        return
+    for row in rows:
+      yield _instantiate(self._head, row)
+
+
+def _instantiate(pattern, row):
+  # pattern holds (True, slot) for a variable and (False, value) for a constant.
+  values = []
+  for is_slot, value in pattern:
+    if is_slot:
+      values.append(row[value])
+    else:
+      values.append(value)
+  return tuple(values)
+
+def _prove(literal, bound, variables, rows):
+  from trimlogic.trail import trail_bc_ask
+  extended = []
+  for row in rows:
+    bindings = {}
+    for var, slot in bound:
+      bindings[var] = row[slot]
+    goal = literal.apply_bindings(bindings)
+    for answer in trail_bc_ask([goal], {}):
+      values = []
+      for var in variables:
+        value = answer.get(var, var)
+        if not _is_constant(value):
+          raise ValueError("Literal %s does not bind %s to a constant."
+                           % (literal, var))
+        values.append(value)
+      extended.append(row + tuple(values))
+  return extended
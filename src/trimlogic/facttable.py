@@ -0,0 +1,270 @@
+from array import array
+from trimlogic import index
+from trimlogic.term import Term, Atom, Var, find_variables
+from trimlogic.predicate import RuleBasedPredicate, Fact
+
+
+class SymbolTable:
+  """
+  Interns constants as small integers. The table is shared by every fact table
+  so that equal constants have the same number in every column.
+  """
+
+  def __init__(self):
+    self._numbers = {}
+    self._symbols = []
+
+  def intern(self, constant):
+    try:
+      return self._numbers[constant]
+    except KeyError:
+      number = len(self._symbols)
+      self._numbers[constant] = number
+      self._symbols.append(constant)
+      return number
+
+  def lookup(self, constant):
+    """
+    Returns the number of a constant, or None if the constant was never
+    interned and so can not appear in any fact table.
+    """
+    try:
+      return self._numbers.get(constant)
+    except TypeError:
+      return None
+
+  def __getitem__(self, number):
+    return self._symbols[number]
+
+  def __len__(self):
+    return len(self._symbols)
+
+symbols = SymbolTable()
+
+
+class FactTablePredicate(RuleBasedPredicate):
+  """
+  A predicate defined only by ground facts over atomic constants. The facts
+  are stored column wise, each column being an array of interned constants.
+  The first column is always indexed by constant, the others are indexed the
+  first time a call binds them. Calls are answered directly from the columns,
+  without renaming or unifying any rule. Facts are kept as a set, adding a 
+  fact which is already in the table has no effect.
+  """
+
+  def __init__(self, name=None, types=None, facts=None, modes=None):
+    RuleBasedPredicate.__init__(self, name, types, modes=modes)
+    if facts != None:
+      self.add_facts(facts)
+
+  def __setattr__(self, name, value):
+    if name == 'rules':
+      self.clear()
+      for rule in value:
+        self.add_rule(Head=rule.terms, Body=rule.body or None)
+    else:
+      self.__dict__[name] = value
+
+  def clear(self):
+    self._columns = None
+    self._indexes = None
+    self._size = 0
+    self._rules = None
+    index.changed()
+
+  def get_rules(self):
+    """
+    Returns the facts of the table as Fact objects. The list is made once and
+    shared until a fact is added, it should not be changed.
+    """
+    if self._rules == None:
+      self._rules = [Fact(self, self.row(i)) for i in xrange(self._size)]
+    return self._rules
+
+  rules = property(fget=get_rules)
+
+  def add_rule(self, Head=None, Body=None):
+    if Body:
+      raise ValueError("Fact table '%s' can not hold the rule %s :- %s."
+                       % (self, Head, Body))
+    self.add_fact(Head)
+
+  def add_fact(self, values):
+    values = tuple(values)
+    if self.arity == None: self.arity = len(values)
+    if len(values) != self.arity:
+      raise ValueError("Fact %s does not have arity %s." % (values, self.arity))
+    if self._columns == None:
+      self._columns = [array('l') for i in xrange(self.arity)]
+      self._indexes = [{}] + [None] * (self.arity - 1)
+    numbers = []
+    for i in xrange(len(values)):
+      value = values[i]
+      if ((isinstance(value, Term) and not isinstance(value, Atom))
+          or (isinstance(value, tuple) and find_variables(value))):
+        raise ValueError("Fact table '%s' only holds ground constants, not %s "
+                         "in column %s." % (self, value, i))
+      try:
+        numbers.append(symbols.intern(value))
+      except TypeError:
+        raise ValueError("Fact table '%s' only holds hashable constants, not "
+                         "%s in column %s." % (self, value, i))
+    if self._find_row(numbers) != None:
+      return
+    row = self._size
+    for column, column_index, number in zip(self._columns, self._indexes, 
+                                            numbers):
+      column.append(number)
+      if column_index != None:
+        _index_row(column_index, number, row)
+    self._size += 1
+    self._rules = None
+    index.changed()
+
+  def add_facts(self, facts):
+    for values in facts:
+      self.add_fact(values)
+
+  def row(self, i):
+    return tuple([symbols[column[i]] for column in self._columns])
+
+  def __iter__(self):
+    for i in xrange(self._size):
+      yield self.row(i)
+
+  def __len__(self):
+    return self._size
+
+  def __contains__(self, values):
+    if len(values) != self.arity:
+      return False
+    numbers = []
+    for value in values:
+      number = symbols.lookup(value)
+      if number == None:
+        return False
+      numbers.append(number)
+    return self._find_row(numbers) != None
+
+  def select(self, bound):
+    """
+    Generates, as tuples, the facts whose column i holds value for every 
+    (i, value) in bound.
+    """
+    numbers = []
+    for i, value in bound:
+      number = symbols.lookup(value)
+      if number == None:
+        return
+      numbers.append((i, number))
+    columns = self._columns
+    for row in self._match_rows(numbers, ()):
+      yield tuple([symbols[column[row]] for column in columns])
+
+  def _find_row(self, numbers):
+    # only the index of the first column, which is always kept, is probed, so
+    # that looking a fact up does not index the other columns.
+    bound = zip(xrange(len(numbers)), numbers)
+    columns = self._columns
+    for row in self._match_rows(bound[:1], ()):
+      matched = True
+      for i, number in bound[1:]:
+        if columns[i][row] != number:
+          matched = False
+          break
+      if matched:
+        return row
+    return None
+
+  def _match_rows(self, bound, equal):
+    """
+    Generates, in ascending order, the rows whose column i holds the interned
+    constant n for every (i, n) in bound, and whose columns i and k hold the
+    same constant for every (i, k) in equal.
+    """
+    if self._size == 0:
+      return
+    columns = self._columns
+    rows = None
+    for i, number in bound:
+      candidates = self._get_index(i).get(number)
+      if candidates == None:
+        return
+      if isinstance(candidates, int):
+        candidates = (candidates,)
+      if rows == None or len(candidates) < len(rows):
+        rows = candidates
+    if rows == None:
+      rows = xrange(self._size)
+    for row in rows:
+      matched = True
+      for i, number in bound:
+        if columns[i][row] != number:
+          matched = False
+          break
+      if matched:
+        for i, k in equal:
+          if columns[i][row] != columns[k][row]:
+            matched = False
+            break
+      if matched:
+        yield row
+
+  def _get_index(self, i):
+    column_index = self._indexes[i]
+    if column_index == None:
+      column_index = {}
+      column = self._columns[i]
+      for row in xrange(self._size):
+        _index_row(column_index, column[row], row)
+      self._indexes[i] = column_index
+    return column_index
+
+  def _resolve(self, terms):
+    if self._columns == None or len(terms) != self.arity:
+      return
+    bound, equal, free = [], [], []
+    first_position = {}
+    for i in xrange(len(terms)):
+      term = terms[i]
+      if isinstance(term, Var):
+        if first_position.has_key(term):
+          equal.append((first_position[term], i))
+        else:
+          first_position[term] = i
+          free.append((term, self._columns[i]))
+      else:
+        number = symbols.lookup(term)
+        if number == None:
+          return
+        bound.append((i, number))
+    for row in self._match_rows(bound, equal):
+      mgu = {}
+      for var, column in free:
+        mgu[var] = symbols[column[row]]
+      yield (mgu, [], ())
+
+
+def _index_row(column_index, number, row):
+  # a constant found in a single row is indexed by the bare row number, which
+  # saves allocating an array for every key of a unique column.
+  rows = column_index.get(number)
+  if rows == None:
+    column_index[number] = row
+  elif isinstance(rows, int):
+    column_index[number] = array('l', (rows, row))
+  else:
+    rows.append(row)
+
+def fact_table(predicate):
+  """
+  Returns a fact table holding the facts of a predicate whose rules are all
+  ground facts.
+  """
+  table = FactTablePredicate(predicate.name, predicate.param_types)
+  table.arity = predicate.arity
+  table.param_orderings = predicate.param_orderings
+  table.param_modes = predicate.param_modes
+  for rule in predicate.rules:
+    table.add_rule(Head=rule.terms, Body=rule.body or None)
+  return table
@@ -1,11 +1,19 @@
-import math, logging, sys, itertools, operator, time
+import math, logging, sys, itertools, operator, time, multiprocessing
+import collections, heapq
+from types import ClassType, TypeType
+from trimlogic import index, stats, trace
 from trimlogic.term import UniqueVariableFactory, VariableFactory, Var
-from trimlogic.term import Atom, Pred
-from trimlogic.algorithm import fol_bc_ask
+from trimlogic.term import Atom, Pred, Term, ListPred, list_items, make_list
+from trimlogic.algorithm import fol_bc_ask, ask_many, QueryLimitExceeded
+from trimlogic.algorithm import DEFAULT_ENGINE
 from trimlogic.counting import choose, permute
-from trimlogic.predicate import Rule, MutableRule
+from trimlogic.predicate import Rule, MutableRule, CutPredicate, INPUT
+from trimlogic.predicate import RuleBasedPredicate
+from trimlogic.facttable import FactTablePredicate
 from trimlogic.partialordering import find_ordering
 from trimlogic.partialordering import create_partial_comparator
+from trimlogic.tabling import variant_key
+from trimlogic.datalog import evaluate
 logger = logging.getLogger(__name__)
 
 ##############################################################################
@@ -13,6 +21,9 @@ logger = logging.getLogger(__name__)
 ##############################################################################
 NEW_VARIABLE_GAIN_BIAS = 0.001
 MINIMUM_LITERAL_GAIN_TO_ADD = 0.80
+LITERAL_CACHE_SIZE = 10000
+# the candidate literals sent to each worker of a ProbePool at a time.
+PROBE_BATCH_SIZE = 4
 
 ##############################################################################
 # Data strutures for storing and managing positive and negative examples.
@@ -46,49 +57,160 @@ class ExampleTree:
     self.levels = 1
     self._count_list = [1]
   
-  def extend(self, goals, variables):
+  def extend(self, goals, variables, engine=None, matches=None, limits=None):
     """
     Extends the current example by using the fol_bc_ask algorithm to determine
-    values for the new variables.
+    values for the new variables. If every goal is a literal of a fact table 
+    the examples are instead joined with the fact table of the last goal, see
+    extend_join.
     
     @param goals: The goals by which the extension of the example is to be 
         calculated.
     @type goals: A list of Term objects.
     @param variables: The new variables in the extension.
     @type variables: A list of Var objects.
+    @param engine: The resolution engine passed on to fol_bc_ask.
+    @type engine: str
+    @param matches: Passed on to extend_join.
+    @type matches: dict
+    @param limits: The limits of each query passed on to fol_bc_ask.
+    @type limits: QueryLimits
+    @return: The number of examples created from extending.
+    @raise QueryLimitExceeded: If the query of an example exceeds limits, in
+        which case the tree is left as it was.
+    """
+    if is_joinable(goals):
+      return self.extend_join(goals[-1], variables, matches)
+    extension_count = 0
+    examples_count = 0
+    try:
+      for node, bindings in self.enumerate_nodes_bindings():
+        extended = False
+        for answer in fol_bc_ask(goals, bindings, engine, limits):
+          if answer != None:
+            examples_count += 1
+            extended = True
+            value = []
+            for var in variables:
+              value.append(answer[var])
+            node.children.append(ExampleTree.Node(variables, value, node))
+        if extended:
+          extension_count += 1
+    except QueryLimitExceeded:
+      # drop the examples of the level extended so far.
+      self.cut_levels(self.levels)
+      raise
+    self.levels += 1
+    self._count_list.append(examples_count)
+    if stats.collector != None:
+      stats.collector.record_extension(self.levels - 1, examples_count)
+    if trace.enabled:
+      trace.emit(trace.EXTEND, goals=goals, variables=variables,
+                 extensions=extension_count)
+    return extension_count
+  
+  def extend_join(self, literal, variables, matches=None):
+    """
+    Extends the current example with the rows of a fact table, the examples 
+    being the probe side of a hash join with the table's column indexes. Only
+    the new literal is evaluated, the examples already satisfy the literals 
+    before it. Each distinct combination of values the examples bind the 
+    literal's arguments to is looked up once, which gives the same extensions,
+    in the same order, as proving the goals for every example.
+    
+    @param literal: A literal of a FactTablePredicate.
+    @type literal: Pred
+    @param variables: The new variables in the extension.
+    @type variables: A list of Var objects.
+    @param matches: The values of the new variables for each looked up 
+        combination, which may be shared by the trees of a collection.
+    @type matches: dict
     @return: The number of examples created from extending.
     """
-    logger.debug("extend( " + str(goals) + ", " + str(variables) + " )")
+    if matches == None: matches = {}
+    table, terms = literal.predicate, literal.terms
     extension_count = 0
     examples_count = 0
     for node, bindings in self.enumerate_nodes_bindings():
-      extended = False
-      logger.debug("calling " + str(fol_bc_ask) + " with '" + str(goals) 
-                    + "' '" + str(bindings) + "'")
-      for answer in fol_bc_ask(goals, bindings):
-        if answer != None:
-          examples_count += 1
-          extended = True
-          value = []
-          for var in variables:
-            value.append(answer[var])
-          node.children.append(ExampleTree.Node(variables, value, node))
-      if extended:
+      key = _bind_terms(terms, bindings)
+      try:
+        values_list = matches[key]
+      except KeyError:
+        values_list = []
+        for mgu, new_goals, new_variables in table._resolve(key):
+          values_list.append([mgu[var] for var in variables])
+        matches[key] = values_list
+      for values in values_list:
+        node.children.append(ExampleTree.Node(variables, values, node))
+      if values_list:
+        examples_count += len(values_list)
         extension_count += 1
     self.levels += 1
     self._count_list.append(examples_count)
-    logger.debug("Performed " + str(extension_count) + " extensions.")
+    if stats.collector != None:
+      stats.collector.record_extension(self.levels - 1, examples_count)
+    if trace.enabled:
+      trace.emit(trace.EXTEND, goals=[literal], variables=variables,
+                 extensions=extension_count)
     return extension_count
   
+  def count_extensions(self, goals, variables, engine=None, matches=None,
+                       limits=None):
+    """
+    Counts the extensions extend would make, without creating any nodes.
+    
+    @param matches: The number of rows matching each looked up combination of
+        values when the goals are joined, see extend_join.
+    @type matches: dict
+    @return: The number of examples which would be extended and the number of
+        examples which would be created.
+    """
+    extension_count = 0
+    examples_count = 0
+    for count in self.extension_counts(goals, variables, engine, matches,
+                                       limits):
+      if count:
+        examples_count += count
+        extension_count += 1
+    return extension_count, examples_count
+  
+  def extension_counts(self, goals, variables, engine=None, matches=None,
+                       limits=None):
+    """
+    Generates, for each example in turn, the number of extensions extend 
+    would give it. See count_extensions.
+    """
+    if is_joinable(goals):
+      if matches == None: matches = {}
+      literal = goals[-1]
+      table, terms = literal.predicate, literal.terms
+      for node, bindings in self.enumerate_nodes_bindings():
+        key = _bind_terms(terms, bindings)
+        try:
+          count = matches[key]
+        except KeyError:
+          count = 0
+          for answer in table._resolve(key):
+            count += 1
+          matches[key] = count
+        yield count
+    else:
+      for node, bindings in self.enumerate_nodes_bindings():
+        count = 0
+        for answer in fol_bc_ask(goals, bindings, engine, limits):
+          if answer != None:
+            count += 1
+        yield count
+  
   def enumerate_nodes_bindings(self, i=None, node=None, bindings=None):
     if i == None: i = self.levels - 1
     if node == None: node = self.root
     if bindings == None: bindings = {}
-    logger.debug("enumerate_nodes_bindings( " + str(i) + ", " + str(node) + ", " + str(bindings) + " )")
     for var,const in zip(node.variables, node.values):
       assert not bindings.has_key(var)
       bindings[var] = const
-    logger.debug("Bindings '" + str(bindings) + "'.")
+    if trace.enabled:
+      trace.emit(trace.BINDINGS, level=i, node=node, bindings=dict(bindings))
     if i == 0:
       yield node, bindings
       return
@@ -102,15 +224,15 @@ class ExampleTree:
   def enumerate_examples(self, level=None, node=None):
     if level == None: level = self.levels - 1
     if node == None: node = self.root
-    logger.debug("enumerate_examples( " + str(level) + ", " 
-                  + str(node) + " )")
+    # the values of the base example and of its extensions may be tuples or 
+    # lists, the examples are tuples.
     if level == 0:
-      yield node.values
+      yield tuple(node.values)
       return
     k = level - 1
     for child in node.children:
       for l in self.enumerate_examples(k, child):
-        yield node.values + l
+        yield tuple(node.values) + l
       
   def __iter__(self):
     return self.enumerate_examples()
@@ -158,12 +280,17 @@ class ExampleTree:
 
 class ExampleCollection:
   
-  def __init__(self, predicate, formals, examples):
+  def __init__(self, predicate, formals, examples, engine=None, limits=None):
     self.predicate = predicate
     self._examples = []
     for example in examples:
       self._examples.append(ExampleTree(formals, example))
     self.variables = formals
+    self.engine = engine
+    # the limits of the queries extending the examples.
+    self.limits = limits
+    # incremented whenever examples are removed.
+    self.version = 0
   
   def __len__(self):
     return sum(map(len, self._examples))
@@ -176,26 +303,114 @@ class ExampleCollection:
       tree.rollback()
   
   def extend(self, goals, variables):
-    return sum(map(lambda t: t.extend(goals, variables), self._examples))
+    """
+    Extends every example tree, returning the number of examples extended.
+    
+    @raise QueryLimitExceeded: If the query of an example exceeds the limits,
+        in which case no tree is extended.
+    """
+    # the trees share the results of their fact table lookups.
+    matches = {}
+    extended = 0
+    for i in xrange(len(self._examples)):
+      try:
+        extended += self._examples[i].extend(goals, variables, self.engine, 
+                                             matches, self.limits)
+      except QueryLimitExceeded:
+        for tree in self._examples[:i]:
+          tree.rollback()
+        raise
+    return extended
+  
+  def probe(self, goals, variables):
+    """
+    Returns the number of examples extend would extend and the number of 
+    examples there would be after it, without extending any.
+    """
+    extended, size = 0, 0
+    for count in self.extension_counts(goals, variables):
+      if count:
+        extended += 1
+        size += count
+    return extended, size
+  
+  def extension_counts(self, goals, variables):
+    """
+    Generates, for each example in turn, the number of extensions extend 
+    would give it.
+    """
+    matches = {}
+    for tree in self._examples:
+      for count in tree.extension_counts(goals, variables, self.engine, 
+                                         matches, self.limits):
+        yield count
   
   def reset(self):
     map(lambda x: x.reset(), self._examples)
     
-  def prune_covered(self):
-    logger.debug("Examples to consider for pruning: ")
-    logger.debug(str(self._examples))
-    for ex in self._examples[:]:
-      prune = False
-      logger.debug("Calling fol_bc_ask(" + str(self.predicate(*ex.root.values)) + ", {})")
-      for answer in fol_bc_ask([self.predicate(*ex.root.values)], {}):
-        logger.debug("fol_bc_ask(" + str(self.predicate(*ex.root.values)) 
-                     + ", {}) -> " + str(answer))
-        if answer != None and answer != False:
-          self._examples.remove(ex)
-          prune = True
-          logger.debug("Pruned '%s'." % ex)
-        break
-      if not prune: logger.debug("Did not prune '%s'." % ex)
+  def prune_covered(self, rule=None):
+    """
+    Removes the examples covered by the predicate.
+    
+    @param rule: The rule just added to the predicate. The examples left were
+        not covered by the rules before it, so if the rule does not call the
+        predicate only the examples it covers are removed, it being evaluated
+        bottom-up if its body is a join of fact tables. Otherwise the 
+        predicate is evaluated bottom-up once for every example if it is a 
+        Datalog predicate, and proved for each example if it is not. With 
+        the dict engine, which fails some calls bottom-up evaluation 
+        answers, every example is proved.
+    @type rule: Rule
+    """
+    started = time.time()
+    covers = self._get_coverage_test(rule)
+    examples = []
+    for ex in self._examples:
+      pruned = covers(ex.root.values)
+      if trace.enabled:
+        trace.emit(trace.EXAMPLE_PRUNED, example=ex.root.values, 
+                   pruned=pruned)
+      if not pruned:
+        examples.append(ex)
+    if len(examples) != len(self._examples):
+      self.version += 1
+    self._examples = examples
+    if stats.collector != None:
+      stats.collector.add_time('prune_covered', time.time() - started)
+  
+  def _get_coverage_test(self, rule):
+    # the dict engine fails some calls which bottom-up evaluation answers, so
+    # with it every example is proved, as it is when the rules are used.
+    engine = self.engine
+    if engine == None: engine = DEFAULT_ENGINE
+    bottom_up = engine == 'trail'
+    if rule != None and has_independent_coverage(rule):
+      view = RuleBasedPredicate(str(self.predicate))
+      view.rules = [Rule(view, rule.terms, rule.body)]
+      if bottom_up and is_joinable(rule.body):
+        try:
+          return _relation_test(evaluate([view])[view])
+        except ValueError:
+          pass
+      return self._proof_test(view)
+    if rule != None and bottom_up:
+      try:
+        return _relation_test(evaluate([self.predicate])[self.predicate])
+      except ValueError:
+        pass
+    return self._proof_test(self.predicate)
+  
+  def _proof_test(self, predicate):
+    # an example whose proof exceeds the limits is not taken to be covered.
+    def covers(values):
+      try:
+        for answer in fol_bc_ask([predicate(*values)], {}, self.engine, 
+                                 self.limits):
+          return answer != None and answer != False
+      except QueryLimitExceeded:
+        pass
+      return False
+    return covers
         
   def __repr__(self):
     s = ""
@@ -207,17 +422,176 @@ class ExampleCollection:
     return self.__repr__()
       
   
+class LiteralCache:
+  """
+  A bounded cache of the results of bounded_probe, discarding the least
+  recently used entry when full. Entries are keyed by the clause prefix and
+  candidate literal the examples are extended with, up to a renaming of their
+  variables, and are only valid for the examples and clauses they were
+  computed from, as given by a fingerprint. The cache is emptied as soon as 
+  it is used with a different fingerprint.
+  """
+  
+  def __init__(self, size=LITERAL_CACHE_SIZE):
+    self.size = size
+    self.fingerprint = None
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self._entries = collections.OrderedDict()
+  
+  def validate(self, fingerprint):
+    if fingerprint != self.fingerprint:
+      if self._entries:
+        self.invalidations += 1
+        self._entries.clear()
+      self.fingerprint = fingerprint
+  
+  def lookup(self, key, threshold=None):
+    """
+    Returns the cached result of probing with the given threshold, or None if
+    there is none. A literal given up on is also given up on with any higher
+    threshold.
+    """
+    try:
+      entry = self._entries.pop(key)
+    except KeyError:
+      self.misses += 1
+      return None
+    self._entries[key] = entry
+    given_up_threshold, result = entry
+    probe, extends_positives = result
+    if (probe == None and extends_positives 
+        and (threshold == None or threshold < given_up_threshold)):
+      self.misses += 1
+      return None
+    self.hits += 1
+    return result
+  
+  def store(self, key, threshold, result):
+    if self._entries.has_key(key):
+      del self._entries[key]
+    self._entries[key] = (threshold, result)
+    if len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+  
+  def clear(self):
+    self._entries.clear()
+  
+  def get_stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 
+            'evictions': self.evictions, 'invalidations': self.invalidations,
+            'entries': len(self._entries)}
+  
+  def __len__(self):
+    return len(self._entries)
+
+
+class LiteralBeam:
+  """
+  The best literals found by a literal search, at most width of them. A 
+  literal is only kept in place of another if its gain is higher, so of 
+  literals with the same gain the first ones found are kept.
+  """
+  
+  def __init__(self, width=1, literals=()):
+    self.width = width
+    self._heap = []
+    self._count = 0
+    for gain, literal, new_variables in literals:
+      self.add(gain, literal, new_variables)
+  
+  def add(self, gain, literal, new_variables):
+    # the heap is ordered by gain, the last literal found first.
+    self._count += 1
+    entry = (gain, -self._count, literal, new_variables)
+    if len(self._heap) < self.width:
+      heapq.heappush(self._heap, entry)
+    elif gain > self._heap[0][0]:
+      heapq.heapreplace(self._heap, entry)
+  
+  def get_threshold(self):
+    """
+    Returns the gain a literal has to exceed to be kept, or None if any 
+    literal would be kept.
+    """
+    if len(self._heap) < self.width:
+      return None
+    return self._heap[0][0]
+  
+  def get_literals(self):
+    """
+    Returns a list of (gain, literal, new_variables), the best literal first.
+    """
+    return [(gain, literal, new_variables) for gain, count, literal, 
+            new_variables in sorted(self._heap, reverse=True)]
+  
+  def __len__(self):
+    return len(self._heap)
+
+
+class BudgetExhausted(Exception):
+  pass
+
+
+class Budget:
+  """
+  A limit on the time and on the number of steps FOIL may take, a step being
+  a candidate literal probed while building a clause or a candidate rule 
+  checked while compacting the rules. The time is wall clock time counted 
+  from the creation of the budget.
+  """
+  
+  def __init__(self, seconds=None, steps=None):
+    self.seconds = seconds
+    self.steps = steps
+    self.spent = 0
+    self.started = time.time()
+  
+  def spend(self, steps=1):
+    self.spent += steps
+  
+  def exhausted(self):
+    return ((self.steps != None and self.spent >= self.steps)
+            or (self.seconds != None 
+                and time.time() - self.started >= self.seconds))
+  
+  def check(self):
+    """
+    @raise BudgetExhausted: If the budget is exhausted.
+    """
+    if self.exhausted():
+      raise BudgetExhausted("Budget of %s seconds and %s steps exhausted." 
+                            % (self.seconds, self.steps))
+
+
 class TrainingSet:
   
-  def __init__(self, predicate, formals, positive_examples, negative_examples):
+  def __init__(self, predicate, formals, positive_examples, negative_examples,
+               engine=None, cache_size=LITERAL_CACHE_SIZE, limits=None):
     self.positive_examples = self._insureExampleCollection(predicate, 
                                                            formals, 
-                                                           positive_examples)
+                                                           positive_examples,
+                                                           engine,
+                                                           limits)
     self.negative_examples = self._insureExampleCollection(predicate, 
                                                            formals, 
-                                                           negative_examples)
+                                                           negative_examples,
+                                                           engine,
+                                                           limits)
+    # the formals are typed by the parameters of the predicate, the new 
+    # variables examples are extended with by the literals binding them.
+    if predicate.param_types != None:
+      for var, type in zip(formals, predicate.param_types):
+        if var.type == None:
+          var.type = type
     self._variables = [formals]
     self._extensions = 0
+    self.literal_cache = None
+    if cache_size:
+      self.literal_cache = LiteralCache(cache_size)
     
   def get_variables(self):
     vars = []
@@ -225,11 +599,12 @@ class TrainingSet:
       vars.extend(l)
     return vars
   
-  def _insureExampleCollection(self, predicate, formals, examples):
+  def _insureExampleCollection(self, predicate, formals, examples, engine,
+                               limits):
     if isinstance(examples, ExampleCollection):
       return examples
     else:
-      return ExampleCollection(predicate, formals, examples)
+      return ExampleCollection(predicate, formals, examples, engine, limits)
   
   def rollback(self):
     assert self._extensions > 0
@@ -251,15 +626,65 @@ class TrainingSet:
     return False
   
   def extend(self, goals, variables):
+    """
+    Extends the positive and negative examples, returning the numbers of each
+    extended.
+    
+    @raise QueryLimitExceeded: If the query of an example exceeds the limits,
+        in which case the training set is left as it was.
+    """
+    positives = self.positive_examples.extend(goals, variables)
+    try:
+      negatives = self.negative_examples.extend(goals, variables)
+    except QueryLimitExceeded:
+      self.positive_examples.rollback()
+      raise
     self._extensions += 1
     self._variables.append(variables)
-    return (self.positive_examples.extend(goals, variables), 
-            self.negative_examples.extend(goals, variables))
+    return positives, negatives
+  
+  def probe(self, goals, variables):
+    """
+    Determines what extend would do without extending the examples.
+    
+    @return: A tuple (s_pos, s_neg, new_pos_len, new_neg_len, determinate) 
+        where s_pos and s_neg are the numbers of positive and negative 
+        examples which would be extended, the return values of extend, 
+        new_pos_len and new_neg_len the numbers of examples there would be 
+        after extending, and determinate is True if the extension would give 
+        every positive example exactly one extension and every negative 
+        example at most one, binding at least one new variable.
+    """
+    old_pos_len = len(self.positive_examples)
+    old_neg_len = len(self.negative_examples)
+    s_pos, new_pos_len = self.positive_examples.probe(goals, variables)
+    s_neg, new_neg_len = self.negative_examples.probe(goals, variables)
+    determinate = (s_pos == old_pos_len == new_pos_len
+                   and s_neg <= old_neg_len
+                   and s_neg == new_neg_len
+                   and len(variables) > 0)
+    return s_pos, s_neg, new_pos_len, new_neg_len, determinate
+  
+  def get_fingerprint(self):
+    """
+    Identifies the examples and the clauses probes are computed from. It 
+    changes when examples are pruned or when the clauses or facts of any
+    predicate change.
+    """
+    return (self.positive_examples.version, self.negative_examples.version,
+            index.generation)
+  
+  def get_literal_key(self, goals):
+    """
+    Returns a key which is the same for two sequences of goals extending the 
+    initial examples exactly when they are equal up to a renaming of the 
+    variables they add.
+    """
+    return variant_key([tuple(self._variables[0])] + list(goals))
   
   def get_information_measure(self):
-    return -math.log(float(len(self.positive_examples) + 1) 
-                     / float(len(self.negative_examples) 
-                             + len(self.positive_examples) + 1), 2)
+    return information_measure(len(self.positive_examples), 
+                               len(self.negative_examples))
     
   def get_maximum_possible_gain(self):
     return len(self.positive_examples)*self.get_information_measure()
@@ -273,72 +698,158 @@ class TrainingSet:
   variables = property(fget=get_variables)
 
 
+def _relation_test(relation):
+  def covers(values):
+    return tuple(values) in relation
+  return covers
+
+def _bind_terms(terms, bindings):
+  values = []
+  for term in terms:
+    if isinstance(term, Var) and bindings.has_key(term):
+      term = bindings[term]
+    values.append(term)
+  return tuple(values)
+
+def is_joinable(goals):
+  """
+  True if the examples satisfying all but the last of goals can be extended 
+  with a join, that is if every goal is a literal of a fact table over 
+  constants and variables. Fact tables have set semantics, so an example 
+  satisfies the literals before the last goal exactly once.
+  """
+  if not goals:
+    return False
+  for goal in goals:
+    if not (isinstance(goal, Pred) 
+            and isinstance(goal.predicate, FactTablePredicate)):
+      return False
+    for term in goal.terms:
+      if isinstance(term, Pred):
+        return False
+  return True
+
+
+def information_measure(pos_len, neg_len):
+  return -math.log(float(pos_len + 1) / float(neg_len + pos_len + 1), 2)
+
+
 ##############################################################################
 # Functions for building a clause.
 ##############################################################################
+def extend_clause(training_set, body, literal, variables):
+  """
+  Appends literal to the body of a clause and extends the training set with
+  the body. If a query extending an example exceeds the query limits of the
+  training set, the literal is given up on, the body and the training set
+  being left as they were.
+  
+  @return: True if the training set was extended.
+  """
+  body.append(literal)
+  try:
+    training_set.extend(body, variables)
+  except QueryLimitExceeded, e:
+    body.pop()
+    if trace.enabled:
+      trace.emit(trace.LITERAL_PRUNED, literal=literal, reason=str(e))
+    return False
+  return True
+
 def construct_clause_recursive(predicate, rule, training_set, bk, 
-                               variable_factory=None, ordering=None, depth=0):
+                               variable_factory=None, ordering=None, depth=0,
+                               processes=None, beam_width=1, budget=None,
+                               pool=None):
+  """
+  Builds the body of rule by adding literals until it covers no negative 
+  example, backtracking over the beam of gainful literals of each step and 
+  over the determinate literals.
+  
+  @param pool: The ProbePool searching for literals, if they are searched 
+      in parallel.
+  @type pool: ProbePool
+  
+  @raise BudgetExhausted: If the budget is exhausted before a clause is 
+      found.
+  """
   assert isinstance(rule, Rule)
   assert isinstance(training_set, TrainingSet)
   logger.debug("Starting construct_clause_recursive(...).")
   logger.debug("Training set contains %s positive examples and %s negative " 
-    "examples." % (len(training_set.positive_examples), 
-                   len(training_set.negative_examples)))
+    "examples.", len(training_set.positive_examples), 
+    len(training_set.negative_examples))
   ordering = find_partial_ordering_of_terms(rule)
   if variable_factory == None: variable_factory = UniqueVariableFactory()
   head, body = rule.terms, rule.body
   if len(training_set.negative_examples) > 0:
-    logger.debug("Clause so far %s :- %s." % (head, body))
+    logger.debug("Clause so far %s :- %s.", head, body)
     new_literals, determinate_literals = (
         find_gainful_and_determinate_literals(predicate, 
                                               rule, 
                                               training_set, 
                                               bk, 
                                               variable_factory, 
-                                              ordering))
-    logger.debug("New literals: " + str(new_literals))
+                                              ordering,
+                                              grab_size=beam_width,
+                                              processes=processes,
+                                              budget=budget,
+                                              pool=pool))
+    logger.debug("New literals: %s", new_literals)
     gain = new_literals[0][0]
     gain_ratio = gain / training_set.get_maximum_possible_gain()
-    logger.debug("Gain ratio %s." % str(gain_ratio))
+    logger.debug("Gain ratio %s.", gain_ratio)
     depth += 1
     if( gain_ratio < MINIMUM_LITERAL_GAIN_TO_ADD 
         and len(determinate_literals) > 0 ):
+      added = 0
       for literal, new_variables in determinate_literals:
         for var in new_variables: var.depth = depth
-        body.append(literal)
-        training_set.extend(body, new_variables)
-      logger.debug("Determinate literals added.")
-      if construct_clause_recursive(predicate, 
-                                    rule, 
-                                    training_set, 
-                                    bk, 
-                                    ordering=ordering, 
-                                    variable_factory=variable_factory,
-                                    depth=depth):
-        return True
-      else:
+        if not extend_clause(training_set, body, literal, new_variables):
+          break
+        added += 1
+      if added == len(determinate_literals):
+        logger.debug("Determinate literals added.")
+        if construct_clause_recursive(predicate, 
+                                      rule, 
+                                      training_set, 
+                                      bk, 
+                                      ordering=ordering, 
+                                      variable_factory=variable_factory,
+                                      depth=depth,
+                                      processes=processes,
+                                      beam_width=beam_width,
+                                      budget=budget,
+                                      pool=pool):
+          return True
         logger.debug("Adding determinates of no use, back tracking.")
-        for i in xrange(len(determinate_literals)): 
-          training_set.rollback()
-          body.pop()
+      for i in xrange(added): 
+        training_set.rollback()
+        body.pop()
     if gain < 0.001:
-      logger.debug("Returning False because gain of %s < 0.001." % gain)
+      logger.debug("Returning False because gain of %s < 0.001.", gain)
       return False
-    logger.debug("Gainful literals to try: %s" % new_literals)
+    logger.debug("Gainful literals to try: %s", new_literals)
     for gain, literal, new_variables in new_literals:
       for var in new_variables: var.depth = depth
-      body.append(literal)
-      training_set.extend(body, new_variables)
-      logger.debug("Trying solution: " + str((gain, literal, new_variables)))
+      if not extend_clause(training_set, body, literal, new_variables):
+        continue
+      if trace.enabled:
+        trace.emit(trace.LITERAL_CHOSEN, literal=literal, gain=gain,
+                   variables=new_variables)
       if construct_clause_recursive(predicate, 
                                     rule, 
                                     training_set, 
                                     bk, 
                                     ordering=ordering, 
                                     variable_factory=variable_factory, 
-                                    depth=depth):
+                                    depth=depth,
+                                    processes=processes,
+                                    beam_width=beam_width,
+                                    budget=budget,
+                                    pool=pool):
         return True
-      logger.debug("Trying next solution.")
+      if trace.enabled:
+        trace.emit(trace.LITERAL_REJECTED, literal=literal)
       training_set.rollback()
       body.pop()
     return False
@@ -347,14 +858,17 @@ def construct_clause_recursive(predicate, rule, training_set, bk,
     if rule.is_recursive():
       pass
     predicate.rules.remove(rule)
-    predicate.rules.append(rule.immutable_instance)
-    logger.debug("Found a rule %s." % predicate.rules[len(predicate.rules)-1])
+    new_rule = rule.immutable_instance
+    predicate.rules.append(new_rule)
+    if trace.enabled:
+      trace.emit(trace.CLAUSE_LEARNED, rule=new_rule)
     training_set.reset()
-    training_set.positive_examples.prune_covered()
+    training_set.positive_examples.prune_covered(new_rule)
     return True
   raise "Fell through!"
   
-def variablization(predicate, vars, variable_factory):
+def variablization(predicate, vars, variable_factory, seen=None):
+  if seen == None: seen = LiteralSet()
   if len(vars) == 0 or vars[len(vars)-1].depth < 4:
     for i in xrange(1, predicate.arity+1):
       for old_vars in choose(vars, i):
@@ -363,29 +877,19 @@ def variablization(predicate, vars, variable_factory):
                                              predicate.name[0].upper() 
                                              + predicate.name[1:] + '_')
         for seq in permute(new_vars + old_vars):
-          yield predicate(*seq), new_vars
+          literal = predicate(*seq)
+          if seen.add(literal, new_vars):
+            yield literal, new_vars
   else:
     for old_vars in choose(vars, predicate.arity):
       for seq in permute(old_vars):
         yield predicate(*seq), []
 
-def insert_literal((gain, literal, new_variables), literals, length):
-  if len(literals) == 0:
-    literals.append((gain, literal, new_variables))
-  else:
-    for i in xrange(len(literals)):
-      if gain > literals[i][0]:
-        literals.insert(i, (gain, literal, new_variables))
-        break
-  if len(literals) > length:
-    literals.pop()
-    
-
 ##############################################################################
 # Functions for determining the soundness of recursive literals.
 ##############################################################################
 def determine_param_orderings(predicate):
-  logger.debug("Determining ordering for: " + str(predicate))
+  logger.debug("Determining ordering for: %s", predicate)
   
   def establish_relationship(value_pair, index_pair, op, cmp_map):
     x,y = value_pair
@@ -399,7 +903,7 @@ def determine_param_orderings(predicate):
           cmp_map[(i,k)] = op
       elif cmp_map.has_key((i,k)) and op == cmp_map[(i,k)]:
         cmp_map[(i,k)] = None
-      logger.debug(str(cmp_map))
+      logger.debug("%s", cmp_map)
   # end establish_relationship
       
   v = UniqueVariableFactory()
@@ -415,13 +919,13 @@ def determine_param_orderings(predicate):
       pairs.append(list(x))
   cmp_map = {}
   variables = v.next_variable_sequence(predicate.arity)
-  logger.debug("Calling: fol_bc_ask( %s )" % predicate(*variables))
+  logger.debug("Calling: fol_bc_ask( %s )", predicate(*variables))
   for answer in fol_bc_ask([predicate(*variables)], {}):
-    logger.debug("Answer: " + str(answer))
+    logger.debug("Answer: %s", answer)
     for pair in pairs:
       i,k = pair
       x,y = answer[variables[i]], answer[variables[k]]
-      logger.debug("Comparing %s and %s." % (x, y))
+      logger.debug("Comparing %s and %s.", x, y)
       try:
         for op in [operator.lt, operator.gt, operator.eq]:
           establish_relationship((x,y), (i,k), op, cmp_map)
@@ -433,7 +937,7 @@ def create_unique_variable_sequence(prefix, length):
   return map(lambda x: Var(prefix + length), range(0, length))
 
 def find_partial_ordering_of_terms(rule):
-  logger.debug("Finding ordering for rule '%s'." % rule)
+  logger.debug("Finding ordering for rule '%s'.", rule)
   constraints = []
   for literal in rule.body:
     if isinstance(literal, Pred):
@@ -443,24 +947,24 @@ def find_partial_ordering_of_terms(rule):
           x = literal.terms[key[0]]
           y = literal.terms[key[1]]
           constraints.append((predicate.param_orderings[key], x, y))
-  logger.debug("Found constraints: " + str(constraints))
+  logger.debug("Found constraints: %s", constraints)
   return create_partial_comparator(constraints)
       
 def will_halt(predicate, recursive_literal, variables, ordering=None):
   will_halt = False
   head_terms = variables[:predicate.arity]
   recr_terms = recursive_literal.terms
-  logger.debug("Determining if %s > %s." % (predicate(*head_terms), 
-                                            recursive_literal))
+  logger.debug("Determining if %s > %s.", predicate(*head_terms), 
+               recursive_literal)
   for i in xrange(predicate.arity):
     if head_terms[i] == recr_terms[i]:
       continue
     if not recr_terms[i] in ordering:
-      logger.debug("Term '%s' not in ordering." % recr_terms[i])
+      logger.debug("Term '%s' not in ordering.", recr_terms[i])
       will_halt = False
       break
     if  not head_terms[i] in ordering:
-      logger.debug("Term '%s' not in ordering." % head_terms[i])
+      logger.debug("Term '%s' not in ordering.", head_terms[i])
       will_halt = False
       break
     if ordering.eq(head_terms[i], recr_terms[i]):
@@ -472,31 +976,102 @@ def will_halt(predicate, recursive_literal, variables, ordering=None):
       will_halt = False
       break 
   if will_halt:
-    logger.debug("Found that %s > %s." % (predicate(*head_terms), 
-                                          recursive_literal))
+    logger.debug("Found that %s > %s.", predicate(*head_terms), 
+                 recursive_literal)
   return will_halt
 
+_NEW_VARIABLE = object()
+
+class LiteralSet:
+  """
+  The canonical forms of the candidate literals generated so far, counting 
+  the candidates which were not generated again as they only differ from one
+  already generated in the names of their new variables.
+  """
+  
+  def __init__(self):
+    self._keys = set()
+    self.duplicates = 0
+  
+  def add(self, literal, new_variables):
+    """
+    Adds a literal and returns True if no variant of it was added before.
+    """
+    key = canonical_literal(literal, new_variables)
+    if key in self._keys:
+      self.duplicates += 1
+      return False
+    self._keys.add(key)
+    return True
+  
+  def __len__(self):
+    return len(self._keys)
+
+def canonical_literal(literal, new_variables):
+  """
+  Returns a hashable key which is the same for two literals exactly when they
+  are equal up to a renaming of their new variables. New variables are 
+  numbered in order of first occurrence.
+  """
+  new_variables = set(new_variables)
+  numbering = {}
+  key = []
+  for term in literal.terms:
+    if term in new_variables:
+      if not numbering.has_key(term):
+        numbering[term] = len(numbering)
+      key.append((_NEW_VARIABLE, numbering[term]))
+    else:
+      key.append(term)
+  return (literal.predicate, tuple(key))
+
 def gen_variablization_space(predicate, 
                              path_finding_func,
                              variables,
                              variable_factory,
                              parameters=None, 
-                             new_variable_positions=None):
+                             new_variable_positions=None,
+                             seen=None,
+                             position_variables=None):
+  """
+  Generates (literal, new_variables) for the literals of predicate over the 
+  given variables and new ones, each with at least one of the variables. The 
+  literals with more of the variables are generated from each literal for 
+  which path_finding_func is True. A literal is generated once, even if it
+  can be reached from several others, its duplicates being counted in seen.
+  
+  A variable is only put in the position of a parameter whose type is 
+  compatible with its own, and new variables are given the types of their
+  parameters. If the predicate has parameter modes, only literals with one 
+  of the variables as an input parameter are generated.
+  
+  @param seen: The literals generated so far.
+  @type seen: LiteralSet
+  """
+  if seen == None:
+    seen = LiteralSet()
   if parameters == None:
-    parameters = variable_factory.next_variable_sequence(predicate.arity)
+    parameters = variable_factory.next_variable_sequence(predicate.arity, 
+                                                         types=param_types(
+                                                                   predicate))
+    position_variables = [[var for var in variables 
+                           if is_type_compatible(var.type, new_var.type)]
+                          for new_var in parameters]
     new_variable_positions = range(len(parameters))
     for i in xrange(len(parameters)):
       new_var = parameters[i]
       pos = new_variable_positions[i]
       del new_variable_positions[i]
-      for old_var in variables:
+      for old_var in position_variables[pos]:
         parameters[i] = old_var
         for x in gen_variablization_space(predicate,
                                                path_finding_func,
                                                variables,
                                                variable_factory,
                                                parameters,
-                                               new_variable_positions):
+                                               new_variable_positions,
+                                               seen,
+                                               position_variables):
           yield x
       new_variable_positions.insert(i, pos)
       parameters[i] = new_var
@@ -505,24 +1080,377 @@ def gen_variablization_space(predicate,
     for k in new_variable_positions:
         new_variables.append(parameters[k])
     literal = predicate(*parameters)
-    yield (literal, new_variables)
-    if path_finding_func(literal, new_variables):
+    # the literals generated from a duplicate were generated from the 
+    # literal it duplicates.
+    if not seen.add(literal, new_variables):
+      return
+    expand = True
+    if binds_input(predicate, new_variable_positions):
+      yield (literal, new_variables)
+      expand = path_finding_func(literal, new_variables)
+    if expand:
       for i in xrange(len(new_variable_positions)):
         pos = new_variable_positions[i]
         del new_variable_positions[i]
         new_var = parameters[pos]
-        for old_var in variables:
+        for old_var in position_variables[pos]:
           parameters[pos] = old_var
           for x in gen_variablization_space(predicate,
                                                  path_finding_func,
                                                  variables,
                                                  variable_factory,
                                                  parameters,
-                                                 new_variable_positions):
+                                                 new_variable_positions,
+                                                 seen,
+                                                 position_variables):
             yield x
         new_variable_positions.insert(i, pos)
         parameters[pos] = new_var
 
+def param_types(predicate):
+  if predicate.param_types == None:
+    return None
+  return list(predicate.param_types)
+
+def is_type_compatible(type, other_type):
+  """
+  True if a value may be of both types. A type is either a class, whose 
+  values are its instances, or a functor such as a ListPredicate, whose 
+  values are compound terms. An unknown type, None, is compatible with any.
+  """
+  if type == None or other_type == None or type == other_type:
+    return True
+  type_is_class = isinstance(type, (ClassType, TypeType))
+  other_is_class = isinstance(other_type, (ClassType, TypeType))
+  if type_is_class and other_is_class:
+    return issubclass(type, other_type) or issubclass(other_type, type)
+  if type_is_class:
+    return issubclass(Term, type)
+  if other_is_class:
+    return issubclass(Term, other_type)
+  return False
+
+def binds_input(predicate, new_variable_positions):
+  """
+  True if a literal of predicate with new variables at the given positions
+  has a variable of the clause as an input parameter, or if the predicate 
+  has no parameter modes.
+  """
+  modes = predicate.param_modes
+  if modes == None:
+    return True
+  for pos in xrange(len(modes)):
+    if modes[pos] == INPUT and not pos in new_variable_positions:
+      return True
+  return False
+
+def admissible_literals(predicate, candidates, variables, ordering=None):
+  """
+  Filters out the recursive literals among candidates that may lead to 
+  infinite recursion.
+  """
+  for literal, new_variables in candidates:
+    if predicate == literal.predicate:
+      if not will_halt(predicate, literal, variables, ordering):
+        logger.debug("Adding '%s' may lead to infinit recursion.", literal)
+        continue
+      else:
+        logger.debug("Adding '%s' will not lead to infinit recursion.",
+                     literal)
+    yield literal, new_variables
+
+def gain_bound(s, old_info_value):
+  """
+  An upper bound of the gain of a literal extending s examples. The 
+  information measure after adding a literal is never negative, so the gain
+  is at most s times the information measure before adding it, plus the bias
+  for new variables.
+  """
+  return s * old_info_value + NEW_VARIABLE_GAIN_BIAS
+
+def bounded_probe(training_set, goals, variables, threshold=None):
+  """
+  Probes goals like TrainingSet.probe, but gives up on the literal they end in
+  as soon as it is known that it can not change the result of the literal
+  search: it extends no positive example, or its gain can not exceed 
+  threshold, it can not be determinate and it does not complete the clause.
+  Positive examples are counted first. Once the gain bound of the literal,
+  counting every remaining example as extended, drops to threshold, the
+  literal is given up unless a search of the negative examples finds none it
+  extends. A literal extending no negative example completes the clause and 
+  is counted exactly whatever its gain.
+  
+  A literal is also given up if a query extending an example with it exceeds
+  the query limits of the training set.
+  
+  @return: The result of TrainingSet.probe, or None if the literal was given 
+      up, and whether the literal extends any positive example. If it does
+      not, no literal with more bound variables does either.
+  """
+  try:
+    return _bounded_probe(training_set, goals, variables, threshold)
+  except QueryLimitExceeded, e:
+    if trace.enabled:
+      trace.emit(trace.LITERAL_PRUNED, literal=goals[-1], reason=str(e))
+    return None, True
+
+def _bounded_probe(training_set, goals, variables, threshold):
+  positives = training_set.positive_examples
+  negatives = training_set.negative_examples
+  old_info_value = training_set.get_information_measure()
+  old_pos_len, old_neg_len = len(positives), len(negatives)
+  determinate = len(variables) > 0
+  s_pos, new_pos_len, seen = 0, 0, 0
+  for count in positives.extension_counts(goals, variables):
+    seen += 1
+    if count:
+      s_pos += 1
+      new_pos_len += count
+    if count != 1:
+      determinate = False
+    if (threshold != None and new_pos_len > 0 and not determinate
+        and gain_bound(s_pos + old_pos_len - seen + old_neg_len, 
+                       old_info_value) <= threshold):
+      for count in negatives.extension_counts(goals, variables):
+        if count:
+          return None, True
+      threshold = None
+  if new_pos_len == 0:
+    return None, False
+  s_neg, new_neg_len, seen = 0, 0, 0
+  for count in negatives.extension_counts(goals, variables):
+    seen += 1
+    if count:
+      s_neg += 1
+      new_neg_len += count
+    if count > 1:
+      determinate = False
+    if (threshold != None and new_neg_len > 0 and not determinate
+        and gain_bound(s_pos + s_neg + old_neg_len - seen, 
+                       old_info_value) <= threshold):
+      return None, True
+  return (s_pos, s_neg, new_pos_len, new_neg_len, determinate), True
+
+def cached_probe(training_set, goals, variables, threshold=None):
+  """
+  Like bounded_probe, but answered from the literal cache of the training set
+  when the same goals, up to a renaming of their new variables, were probed
+  before against the same examples.
+  """
+  cache = training_set.literal_cache
+  if cache == None:
+    return bounded_probe(training_set, goals, variables, threshold)
+  cache.validate(training_set.get_fingerprint())
+  key = training_set.get_literal_key(goals)
+  result = cache.lookup(key, threshold)
+  if result == None:
+    result = bounded_probe(training_set, goals, variables, threshold)
+    cache.store(key, threshold, result)
+  return result
+
+def probe_literals(training_set, body, candidates, threshold=None):
+  """
+  Generates (literal, new_variables, probe, extends_positives) for each 
+  candidate, where probe and extends_positives are the result of 
+  cached_probe for the body extended with the literal.
+  
+  @param threshold: A function returning the current threshold of 
+      bounded_probe, called for each candidate.
+  """
+  for literal, new_variables in candidates:
+    body.append(literal)
+    try:
+      if threshold == None:
+        result = cached_probe(training_set, body, new_variables)
+      else:
+        result = cached_probe(training_set, body, new_variables, threshold())
+    finally:
+      body.pop()
+    yield (literal, new_variables) + result
+
+# The predicates the workers of a ProbePool know, set before the pool is
+# created so that the workers inherit them when they are forked, and the 
+# snapshot a worker last probed against.
+_pool_state = None
+_worker_snapshot = [None]
+
+class ProbePool:
+  """
+  A pool of worker processes probing candidate literals, created once for a
+  run of FOIL. The workers are forked knowing the given predicates. Every 
+  batch of candidates is sent along with a snapshot of the training set and
+  of the clauses of the predicate being learned, as plain values, so the 
+  pool is not tied to any one clause or training set. A worker rebuilds the 
+  training set of a snapshot once and keeps it for the batches which 
+  follow.
+  """
+  
+  def __init__(self, processes, predicates):
+    import trimlogic.stdlib
+    global _pool_state
+    self.processes = processes
+    # list cells may be among the values of the examples.
+    self.predicates = []
+    self._positions = {}
+    for predicate in list(predicates) + [trimlogic.stdlib.dot]:
+      if not self._positions.has_key(predicate):
+        self._positions[predicate] = len(self.predicates)
+        self.predicates.append(predicate)
+    self._snapshots = 0
+    _pool_state = self.predicates
+    try:
+      self._pool = multiprocessing.Pool(processes)
+    finally:
+      _pool_state = None
+  
+  def snapshot(self, training_set, predicate, rule):
+    """
+    Returns the snapshot workers probe the candidates extending the body of
+    rule against, or None if a term can not be sent to the workers, its
+    predicate not being known to them.
+    """
+    encode = self._encode
+    try:
+      rules = [(encode(other.terms), encode(other.body), other is rule)
+               for other in predicate.rules]
+      examples = (encode(list(training_set.positive_examples)),
+                  encode(list(training_set.negative_examples)))
+      variables = encode(training_set.variables)
+      target = self._positions[predicate]
+    except KeyError:
+      return None
+    self._snapshots += 1
+    collection = training_set.positive_examples
+    return (self._snapshots, target, rules, variables, examples, 
+            collection.engine, collection.limits)
+  
+  def knows(self, predicate):
+    return self._positions.has_key(predicate)
+  
+  def map(self, tasks):
+    chunk_size = max(1, (len(tasks) + self.processes - 1) / self.processes)
+    return self._pool.map(_probe_task, tasks, chunk_size)
+  
+  def close(self):
+    self._pool.terminate()
+    self._pool.join()
+  
+  def _encode(self, term):
+    if isinstance(term, Var):
+      return ('v', term.name)
+    if isinstance(term, ListPred):
+      # lists are made again by make_list, as plist makes them.
+      items, tail = list_items(term)
+      return ('l', self._positions[term.predicate], 
+              tuple(map(self._encode, items)), self._encode(tail))
+    if isinstance(term, Pred):
+      return ('p', self._positions[term.predicate], 
+              tuple(map(self._encode, term.terms)))
+    if isinstance(term, (list, tuple)):
+      return ('s', type(term), tuple(map(self._encode, term)))
+    if isinstance(term, Term) and not isinstance(term, Atom):
+      raise KeyError(term)
+    return ('c', term)
+
+def _decode(value):
+  tag = value[0]
+  if tag == 'v':
+    return Var(value[1])
+  if tag == 'l':
+    return make_list(_pool_state[value[1]], map(_decode, value[2]), 
+                     _decode(value[3]))
+  if tag == 'p':
+    return _pool_state[value[1]](*map(_decode, value[2]))
+  if tag == 's':
+    return value[1](map(_decode, value[2]))
+  return value[1]
+
+def _load_snapshot(snapshot):
+  key, target, rules, variables, examples, engine, limits = snapshot
+  if _worker_snapshot[0] != None and _worker_snapshot[0][0] == key:
+    return _worker_snapshot[0][1:]
+  predicate = _pool_state[target]
+  body = []
+  clauses = []
+  for terms, rule_body, current in rules:
+    if current:
+      body.extend(_decode(rule_body))
+      clauses.append(MutableRule(predicate, _decode(terms), body))
+    else:
+      clauses.append(Rule(predicate, _decode(terms), _decode(rule_body)))
+  predicate.rules = clauses
+  positives, negatives = map(_decode, examples)
+  training_set = TrainingSet(predicate, _decode(variables), positives, 
+                             negatives, engine, cache_size=0, limits=limits)
+  _worker_snapshot[0] = (key, training_set, body)
+  return training_set, body
+
+def _probe_task((snapshot, index, terms, new_names, threshold)):
+  training_set, body = _load_snapshot(snapshot)
+  # the parent process keeps the literal cache up to date.
+  body.append(_pool_state[index](*_decode(terms)))
+  try:
+    return bounded_probe(training_set, body, map(Var, new_names), threshold)
+  finally:
+    body.pop()
+
+def probe_literals_parallel(pool, training_set, predicate, rule, candidates, 
+                            threshold=None):
+  """
+  Generates the results of probe_literals, in the order of candidates, 
+  probing the candidates in the workers of a ProbePool. The candidates are 
+  taken in batches of PROBE_BATCH_SIZE for each worker, each batch only once
+  the results of the one before it have been consumed, so that candidates 
+  pruned by the results of earlier ones, as those derived from a literal 
+  extending no positive example are, are not generated. The threshold of a
+  batch is the one when it is sent, which is never above the one a serial 
+  search would use, so a literal is only given up if a serial search would
+  give it up. Candidates found in the literal cache of the training set are
+  not sent to the workers, and the cache is updated with the results of the
+  others. If the training set can not be sent to the workers the candidates
+  are probed in this process.
+  
+  @param threshold: A function returning the current threshold of 
+      bounded_probe, called for each batch.
+  """
+  body = rule.body
+  snapshot = pool.snapshot(training_set, predicate, rule)
+  if snapshot == None:
+    for result in probe_literals(training_set, body, candidates, threshold):
+      yield result
+    return
+  cache = training_set.literal_cache
+  candidates = iter(candidates)
+  while True:
+    batch = list(itertools.islice(candidates, 
+                                  pool.processes * PROBE_BATCH_SIZE))
+    if not batch:
+      return
+    current = None
+    if threshold != None:
+      current = threshold()
+    if cache != None:
+      cache.validate(training_set.get_fingerprint())
+    results, pending, tasks = [], [], []
+    for literal, new_variables in batch:
+      result = key = None
+      if cache != None:
+        key = training_set.get_literal_key(body + [literal])
+        result = cache.lookup(key, current)
+      if result == None:
+        pending.append((len(results), key))
+        tasks.append((snapshot, pool._positions[literal.predicate], 
+                      pool._encode(literal.terms),
+                      [var.name for var in new_variables], current))
+      results.append(result)
+    if tasks:
+      for (i, key), result in zip(pending, pool.map(tasks)):
+        results[i] = result
+        if cache != None:
+          cache.store(key, current, result)
+    for (literal, new_variables), result in zip(batch, results):
+      yield (literal, new_variables) + result
+
 def find_gainful_and_determinate_literals(predicate, 
                                           rule, 
                                           training_set, 
@@ -532,86 +1460,137 @@ def find_gainful_and_determinate_literals(predicate,
                                           clause=None, 
                                           determinate_literals=None, 
                                           new_literals=None, 
-                                          grab_size=1):
+                                          grab_size=1,
+                                          processes=None,
+                                          budget=None,
+                                          pool=None):
+  """
+  Scores every candidate literal over the predicates of bk.
+  
+  @param grab_size: The width of the beam, the number of gainful literals 
+      returned.
+  @type grab_size: int
+  @param processes: If greater than 1 and no pool is given, the candidates
+      are probed in parallel by a ProbePool of that many forked worker 
+      processes created for this search. The probes are merged in candidate
+      order, so the result is the same as the one of a serial search.
+  @type processes: int
+  @param pool: The pool probing the candidates in parallel, see processes.
+  @type pool: ProbePool
+  @param budget: Spent for each literal probed.
+  @type budget: Budget
+  @raise BudgetExhausted: If the budget is exhausted.
+  """
   logger.debug("Finding a new literal.")
   logger.debug("Rules so far:")
   for rule in predicate.rules:
-    logger.debug(str(rule))
+    logger.debug("%s", rule)
   head, body = rule.terms, rule.body
   if determinate_literals == None: determinate_literals = []
-  if new_literals == None: new_literals = []
-  variables = training_set.variables
-  current_depth = 0
-  best_literal = None
-  best_gain = -10000
-  best_new_variables = None
+  beam = LiteralBeam(grab_size, new_literals or ())
   old_info_value = training_set.get_information_measure()
-  for next_predicate in bk:
-      continue_search = True
+  predicates = list(bk)
+  own_pool = None
+  if pool == None and processes > 1:
+    pool = own_pool = ProbePool(processes, predicates + [predicate])
+  try:
+    return _find_gainful_and_determinate_literals(predicate, rule,
+                                                  training_set, predicates, 
+                                                  variable_factory, ordering,
+                                                  determinate_literals, beam,
+                                                  body, old_info_value, pool,
+                                                  budget)
+  finally:
+    if own_pool != None:
+      own_pool.close()
+
+def _find_gainful_and_determinate_literals(predicate, rule, training_set, 
+                                           predicates, variable_factory, 
+                                           ordering, determinate_literals, 
+                                           beam, body, old_info_value, pool,
+                                           budget):
+  variables = training_set.variables
+  for index in xrange(len(predicates)):
+      next_predicate = predicates[index]
+      # a literal with more bound variables extends a subset of the examples
+      # the literal it is derived from extends, so none is generated from a 
+      # literal which extends no positive example. The literals are kept by 
+      # id so that no other literal is given the id of one.
+      dead_ends = {}
       def path_finding_func(literal, new_variables):
-        return continue_search
-      for literal, new_variables in gen_variablization_space(next_predicate,
-                                                             path_finding_func,
-                                                             variables, 
-                                                             variable_factory):
-        continue_search = True
-        if predicate == next_predicate:
-          if not will_halt(predicate, 
-                           literal, 
-                           training_set.variables, 
-                           ordering):
-            logger.debug("Adding '%s' may lead to infinit recursion." 
-                         % literal)
-            continue
-          else:
-            logger.debug("Adding '%s' will not lead to infinit recursion." 
-                         % literal)
-        body.append(literal)
-        old_len_pos = len(training_set.positive_examples)
-        old_len_neg = len(training_set.negative_examples)
-        s_pos, s_neg = training_set.extend(body, new_variables)
+        return not dead_ends.has_key(id(literal))
+      seen = LiteralSet()
+      candidates = admissible_literals(predicate, 
+                                       gen_variablization_space(
+                                                         next_predicate,
+                                                         path_finding_func,
+                                                         variables, 
+                                                         variable_factory,
+                                                         seen=seen),
+                                       variables,
+                                       ordering)
+      if pool != None and pool.knows(next_predicate):
+        probes = probe_literals_parallel(pool, training_set, predicate, rule,
+                                         candidates, beam.get_threshold)
+      else:
+        probes = probe_literals(training_set, body, candidates,
+                                beam.get_threshold)
+      collector = stats.collector
+      for literal, new_variables, probe, extends_positives in probes:
+        if budget != None:
+          budget.spend()
+          budget.check()
+        if collector != None:
+          collector.count('literals_generated')
+          collector.count(probe == None and 'literals_pruned' 
+                          or 'literals_scored')
+        if not extends_positives:
+          dead_ends[id(literal)] = literal
+        if probe == None:
+          if trace.enabled:
+            trace.emit(trace.LITERAL_PRUNED, literal=literal, 
+                       reason="its gain can not exceed %s" 
+                              % beam.get_threshold())
+          continue
+        s_pos, s_neg, new_len_pos, new_len_neg, determinate = probe
         s = s_pos + s_neg
-        new_info_value = training_set.get_information_measure()
+        new_info_value = information_measure(new_len_pos, new_len_neg)
         gain = foil_gain(s, old_info_value, new_info_value)
         if new_variables > 0: gain += NEW_VARIABLE_GAIN_BIAS
-        if (len(training_set.positive_examples) > 0 
-            and len(training_set.negative_examples) == 0):
+        if trace.enabled:
+          trace.emit(trace.LITERAL_SCORED, literal=literal, gain=gain,
+                     positives=s_pos, negatives=s_neg, 
+                     determinate=determinate)
+        if new_len_pos > 0 and new_len_neg == 0:
           """
           Return 'literal' as the best literal as it excludes all negative 
           examples but includes at least 1 positive example. We do this 
           primarily to reduce the complexity of individual rules as well as 
           prevent excessive branching.
           """
-          training_set.rollback()
-          body.pop()
-          logging.debug("Found literal '%s' which completes subset of "
-                        "relation, choosing as best literal." % literal)
+          logger.debug("Found literal '%s' which completes subset of "
+                       "relation, choosing as best literal.", literal)
+          if collector != None:
+            collector.count('literals_deduplicated', seen.duplicates)
           return ([(gain, literal, new_variables)], [])
-        if (s_pos == old_len_pos == len(training_set.positive_examples) 
-            and s_neg <= old_len_neg 
-            and s_neg == len(training_set.negative_examples) 
-            and len(new_variables) > 0):
+        if determinate:
           determinate_vars = variable_factory.next_variable_sequence(
-                                                           len(new_variables))
+                                       len(new_variables), 
+                                       types=[var.type for var in new_variables])
           remap_bindings = {}
           for nvar,dvar in zip(new_variables, determinate_vars):
             remap_bindings[nvar] = dvar
           determinate_literals.append((literal.apply_bindings(remap_bindings),
                                        determinate_vars))
-        logger.debug("Considering literal '%s' with gain of %s which yields"
-                     " %s positive and %s negative extensions."  % (literal, 
-                                                                    gain, 
-                                                                    s_pos, 
-                                                                    s_neg))
-        if len(training_set.positive_examples) > 0:
-          insert_literal((gain, literal, new_variables), 
-                         new_literals, grab_size)
-        training_set.rollback()
-        body.pop()
-        if s * old_info_value < best_gain:
-           continue_search = False
-  logger.debug("Best literal found '%s'." % best_literal)
-  logger.debug("Determinate literals found '%s'." % determinate_literals)
+        if new_len_pos > 0:
+          beam.add(gain, literal, new_variables)
+      logger.debug("Generated %s literals of '%s', suppressing %s "
+                   "duplicates.", len(seen), next_predicate, seen.duplicates)
+      if collector != None:
+        collector.count('literals_deduplicated', seen.duplicates)
+  new_literals = beam.get_literals()
+  logger.debug("Best literal found '%s'.", new_literals[:1])
+  logger.debug("Determinate literals found '%s'.", determinate_literals)
   return (new_literals, determinate_literals)
 
 def foil_gain(s, old_information_value, new_information_value):
@@ -625,9 +1604,9 @@ def determine_covered(predicate, tuple):
     return True
   return False
     
-def determine_tuples_covered(predicate, tuples):
-  tuples = [x for x in tuples if determine_covered(predicate, x)]
-  return tuples
+def determine_tuples_covered(predicate, tuples, engine=None):
+  covered = ask_many(predicate, tuples, engine)
+  return [tuples[i] for i in xrange(len(tuples)) if covered[i]]
 
 def determine_tuples_covered_same_or_better(predicate, 
                                             positive_tuples, 
@@ -646,6 +1625,96 @@ def determine_tuples_covered_same_or_better(predicate,
     return True
   return False
 
+def coverage_bitset(predicate, tuples, engine=None):
+  """
+  Returns an integer whose bit i is set if the predicate covers tuples[i].
+  """
+  bits = 0
+  covered = ask_many(predicate, tuples, engine)
+  for i in xrange(len(tuples)):
+    if covered[i]:
+      bits |= 1 << i
+  return bits
+
+def is_subset(bits, other_bits):
+  return bits & ~other_bits == 0
+
+def has_independent_coverage(rule):
+  """
+  True if the tuples a rule covers do not depend on the other rules of its
+  predicate, that is if neither its body nor any predicate it calls, directly,
+  through other predicates or through goals passed as arguments, calls the
+  predicate. A cut or a goal only known when it is called, as in negation as
+  failure, is not monotone, and the rule is then taken to depend on the 
+  others too. The coverage of rules which all have independent coverage is 
+  the union of their coverages.
+  """
+  seen = set()
+  stack = [rule.body]
+  while stack:
+    for literal in stack.pop():
+      if (not isinstance(literal, Pred) or isinstance(literal, CutPredicate)
+          or isinstance(literal.predicate, CutPredicate)
+          or literal.predicate is rule.predicate):
+        return False
+      # compound arguments may be goals the literal calls.
+      goals = [term for term in literal.terms if isinstance(term, Pred)]
+      if goals:
+        stack.append(goals)
+      predicate = literal.predicate
+      if predicate in seen:
+        continue
+      seen.add(predicate)
+      if (isinstance(predicate, RuleBasedPredicate) 
+          and not isinstance(predicate, FactTablePredicate)):
+        for called in predicate.rules:
+          if called.body:
+            stack.append(called.body)
+  return True
+
+class RuleCoverage:
+  """
+  Computes the coverage bitsets of sets of rules of a predicate over positive
+  and negative tuples. The coverage of each rule with independent coverage is
+  proved once and combined with that of the other rules by bitwise or, any 
+  other set of rules is proved as a whole, with the given resolution engine.
+  """
+  
+  def __init__(self, predicate, positive_tuples, negative_tuples, 
+               engine=None):
+    self.predicate = predicate
+    self.engine = engine
+    self.positive_tuples = positive_tuples
+    self.negative_tuples = negative_tuples
+    self._coverages = {}
+  
+  def get(self, rules):
+    """
+    Returns the bitsets (positive, negative) of the tuples covered by the 
+    predicate with the given rules.
+    """
+    for rule in rules:
+      if not has_independent_coverage(rule):
+        return self._prove(rules)
+    positive_bits, negative_bits = 0, 0
+    for rule in rules:
+      if not self._coverages.has_key(rule):
+        self._coverages[rule] = self._prove([rule])
+      rule_positive_bits, rule_negative_bits = self._coverages[rule]
+      positive_bits |= rule_positive_bits
+      negative_bits |= rule_negative_bits
+    return positive_bits, negative_bits
+  
+  def _prove(self, rules):
+    predicate = self.predicate
+    saved_rules = predicate.rules
+    predicate.rules = list(rules)
+    try:
+      return (coverage_bitset(predicate, self.positive_tuples, self.engine), 
+              coverage_bitset(predicate, self.negative_tuples, self.engine))
+    finally:
+      predicate.rules = saved_rules
+
 def will_rule_halt(predicate, rule):
   body_temp = []
   for term in rule.body:
@@ -661,10 +1730,14 @@ def will_rule_halt(predicate, rule):
 
 def predicate_rules_postprocessing_compact(predicate,
                                            positive_tuples,
-                                           negative_tuples):
+                                           negative_tuples,
+                                           budget=None,
+                                           engine=None):
   """
   Removes redundant rules and terms from a predicate. This is an approximation
-  algorithm since the optimal result is undecidable.
+  algorithm since the optimal result is undecidable. The coverage of each 
+  candidate set of rules is kept as a pair of bitsets over the tuples, see 
+  RuleCoverage, so comparing coverages takes a few integer operations.
   
   @param predicate: The predicate whose rules are to be compacted.
   @type predicate: Predicate
@@ -672,93 +1745,192 @@ def predicate_rules_postprocessing_compact(predicate,
       insure that compaction does not affect the coverage of the predicate.
   @param negative_tuples: Tuples not covered by the predicate. These are used
       it insure that compaction does not affect the coverage of the predicate.
+  @param budget: Spent for each candidate rule checked. Once it is exhausted
+      the rules not compacted yet are kept as they are.
+  @type budget: Budget
+  @param engine: The resolution engine proving the coverage of the rules.
+  @type engine: str
+  @return: False if the budget was exhausted, True otherwise.
   """
   logger.debug("Start " + predicate_rules_postprocessing_compact.func_name)
-  rules = predicate.rules
-  predicate.rules = []
-  for rule in rules:
+  stopped = []
+  def exhausted():
+    if budget != None and budget.exhausted():
+      stopped.append(True)
+    return bool(stopped)
+  def spend():
+    if budget != None:
+      budget.spend()
+  positive_tuples = list(positive_tuples)
+  negative_tuples = list(negative_tuples)
+  coverage = RuleCoverage(predicate, positive_tuples, negative_tuples, engine)
+  all_positive_bits = (1 << len(positive_tuples)) - 1
+  rules = list(predicate.rules)
+  compacted = []
+  for position in xrange(len(rules)):
+    rule = rules[position]
+    if exhausted():
+      compacted.extend(rules[position:])
+      break
     new_rule = rule
-    predicate.rules.append(rule)
-    covered_positive_tuples, covered_negative_tuples = (
-        map(lambda x: determine_tuples_covered(predicate, x), 
-            [positive_tuples, negative_tuples]))
-    predicate.rules.pop()
+    covered_positive_bits, covered_negative_bits = (
+        coverage.get(compacted + [rule]))
     for i in xrange(1, len(rule.body)):
       found_rule = False
       for sub_rule_body in choose(rule.body, len(rule.body) - i):
+        if exhausted():
+          break
         sub_rule = Rule(predicate, rule.terms, sub_rule_body)
         if not will_rule_halt(predicate, sub_rule):
           continue
-        predicate.rules.append(sub_rule)
-        better_rule = determine_tuples_covered_same_or_better(predicate, 
-                                                    positive_tuples, 
-                                                    negative_tuples, 
-                                                    covered_positive_tuples, 
-                                                    covered_negative_tuples)
-        predicate.rules.pop()
-        if better_rule:
+        spend()
+        positive_bits, negative_bits = coverage.get(compacted + [sub_rule])
+        if (is_subset(covered_positive_bits, positive_bits)
+            and is_subset(negative_bits, covered_negative_bits)):
           new_rule = sub_rule
           found_rule = True
           break
       if not found_rule:
         break
-    predicate.rules.append(new_rule)
+    compacted.append(new_rule)
     rule_removed = True
-    while rule_removed:
+    while rule_removed and not exhausted():
       rule_removed = False
-      for i in xrange(len(predicate.rules)):
-        rule = predicate.rules[i]
-        del predicate.rules[i]
-        if determine_tuples_covered_same_or_better(predicate, 
-                                                   positive_tuples, 
-                                                   negative_tuples):
+      for i in xrange(len(compacted)):
+        if exhausted():
+          break
+        spend()
+        # a rule is redundant if the others cover every positive tuple.
+        positive_bits, negative_bits = coverage.get(compacted[:i] 
+                                                    + compacted[i+1:])
+        if positive_bits == all_positive_bits:
+          del compacted[i]
           rule_removed = True
           break
-        else:
-          predicate.rules.insert(i, rule)    
+  predicate.rules = compacted
   logger.debug("End " + predicate_rules_postprocessing_compact.func_name)
+  return not stopped
           
 def predicate_rules_postprocessing(predicate, 
                                    positive_tuples, 
-                                   negative_tuples):
+                                   negative_tuples,
+                                   budget=None,
+                                   engine=None):
   s = time.clock()
-  predicate_rules_postprocessing_compact(predicate,
-                                         positive_tuples,
-                                         negative_tuples)
+  complete = predicate_rules_postprocessing_compact(predicate,
+                                                    positive_tuples,
+                                                    negative_tuples,
+                                                    budget,
+                                                    engine)
   f = time.clock()
   logger.debug(predicate_rules_postprocessing_compact.func_name 
                       + " completed in %s seconds." % (f-s))
+  if stats.collector != None:
+    stats.collector.add_time('postprocessing', f - s)
+  return complete
 
 ##############################################################################
 # Main entry point for the FOIL algorithm.
 ##############################################################################          
-def foil(predicate, positive_tuples, negative_tuples, bk, ordering=None):
+def foil(predicate, positive_tuples, negative_tuples, bk, ordering=None, 
+         engine=None, processes=None, beam_width=1, budget=None, limits=None):
+  """
+  Learns rules of predicate covering the positive tuples and none of the 
+  negative tuples from the predicates of bk.
+  
+  @param beam_width: The number of gainful literals tried at each step of
+      building a clause.
+  @type beam_width: int
+  @param budget: Limits both learning and compacting the rules. Once it is
+      exhausted the clauses learned so far are kept and compacting stops,
+      leaving the rules it did not get to as they are.
+  @type budget: Budget
+  @param limits: The limits of each query extending an example while 
+      learning. A candidate literal whose queries exceed them is given up.
+  @type limits: QueryLimits
+  @return: False if the budget was exhausted, True otherwise.
+  """
   s = time.clock()
-  foil_main(predicate, positive_tuples, negative_tuples, bk, ordering)
+  complete = foil_main(predicate, positive_tuples, negative_tuples, bk, 
+                       ordering, engine, processes, beam_width, budget, 
+                       limits)
   f = time.clock()
   logger.debug(foil_main.func_name 
                       + " completed in %s seconds." % (f-s))
-  predicate_rules_postprocessing(predicate, positive_tuples, negative_tuples)
+  if stats.collector != None:
+    stats.collector.add_time('foil_main', f - s)
+  complete = (predicate_rules_postprocessing(predicate, positive_tuples, 
+                                             negative_tuples, budget, engine)
+              and complete)
+  return complete
     
-def foil_main(predicate, positive_tuples, negative_tuples, bk, ordering=None):
+def foil_main(predicate, positive_tuples, negative_tuples, bk, ordering=None,
+              engine=None, processes=None, beam_width=1, budget=None, 
+              limits=None):
+  """
+  Learns the rules of predicate clause by clause until every positive tuple
+  is covered, or until the budget is exhausted, in which case the clause 
+  being built is dropped. If processes is greater than 1, a ProbePool of 
+  that many workers searches for the literals of every clause.
+  
+  @return: False if the budget was exhausted, True otherwise.
+  """
   arity = predicate.arity
   clauses = set([])
   variable_factory = UniqueVariableFactory()
   params = variable_factory.next_variable_sequence(predicate.arity, 
-                                                   prefix="PARAM_")
+                                                   prefix="PARAM_",
+                                                   types=param_types(predicate))
   training_set = TrainingSet(predicate, 
                              params, 
                              positive_tuples, 
-                             negative_tuples)
+                             negative_tuples,
+                             engine,
+                             limits=limits)
+  pool = None
+  if processes > 1:
+    pool = ProbePool(processes, list(bk) + [predicate])
+  try:
+    return _foil_main(predicate, training_set, bk, variable_factory, ordering,
+                      processes, beam_width, budget, pool)
+  finally:
+    if pool != None:
+      pool.close()
+
+def _foil_main(predicate, training_set, bk, variable_factory, ordering, 
+               processes, beam_width, budget, pool):
+  complete = True
   while len(training_set.positive_examples) > 0:
     head = tuple(training_set.variables)
     for x in head: x.depth = 0
     body = []
     rule = MutableRule(predicate, head, body)
     predicate.rules.append(rule)
-    construct_clause_recursive(predicate, 
-                               rule, 
-                               training_set, 
-                               bk, 
-                               variable_factory=variable_factory, 
-                               ordering=ordering)
+    started = time.time()
+    try:
+      construct_clause_recursive(predicate, 
+                                 rule, 
+                                 training_set, 
+                                 bk, 
+                                 variable_factory=variable_factory, 
+                                 ordering=ordering,
+                                 processes=processes,
+                                 beam_width=beam_width,
+                                 budget=budget,
+                                 pool=pool)
+      if stats.collector != None:
+        stats.collector.record_clause(predicate.rules[-1], 
+                                      time.time() - started)
+    except BudgetExhausted:
+      predicate.rules.remove(rule)
+      training_set.reset()
+      logger.info("Budget exhausted, keeping the %s rules learned so far "
+                  "with %s positive examples left uncovered." 
+                  % (len(predicate.rules), 
+                     len(training_set.positive_examples)))
+      complete = False
+      break
+  if training_set.literal_cache != None:
+    logger.debug("Literal cache statistics: %s" 
+                 % training_set.literal_cache.get_stats())
+  return complete
@@ -0,0 +1,148 @@
+from trimlogic.term import Var, Pred, Function
+
+# Incremented whenever the clauses or facts of any predicate change, so that
+# results derived from them, such as answer tables, can tell they are stale.
+generation = 0
+
+def changed():
+  global generation
+  generation += 1
+
+def index_key(term):
+  """
+  Returns the key under which a head or call argument is indexed, that is its
+  principal functor for compound terms, its length for tuples and lists and
+  the constant itself otherwise. None is returned for terms that can not be
+  indexed, such as variables, in which case the argument matches any key.
+  """
+  if isinstance(term, Var) or isinstance(term, Function):
+    return None
+  if isinstance(term, Pred):
+    return (term.predicate, len(term.terms))
+  if isinstance(term, (list, tuple)):
+    # a tuple may hold variables, and the trail engine unifies tuples and
+    # lists element by element, so both are keyed on their length alone.
+    return (list, len(term))
+  try:
+    hash(term)
+  except TypeError:
+    return None
+  return term
+
+
+class ClauseList(list):
+  """
+  A list of rules which keeps an index on the principal functor of every head
+  argument. For each argument position the index maps a key to the positions,
+  in clause order, of the rules whose head argument has that key or is a
+  variable. Appending a rule updates the index in place, any other change to
+  the list discards it and it is rebuilt on the next lookup.
+  """
+
+  def __init__(self, rules=()):
+    list.__init__(self, rules)
+    self._index = None
+    self.version = 0
+
+  def lookup(self, terms):
+    """
+    Returns the positions of the rules which may unify with the given call
+    arguments, choosing the bound argument with the fewest candidates, or None
+    if no argument is bound and every rule has to be considered.
+    """
+    if self._index is None:
+      self._build_index()
+    index = self._index
+    best = None
+    for i in xrange(min(len(terms), len(index))):
+      key = index_key(terms[i])
+      if key is None:
+        continue
+      key_map, var_positions = index[i]
+      candidates = key_map.get(key, var_positions)
+      if best is None or len(candidates) < len(best):
+        best = candidates
+        if not best:
+          break
+    return best
+
+  def _build_index(self):
+    self._index = []
+    for position in xrange(len(self)):
+      self._index_rule(position, list.__getitem__(self, position))
+
+  def _index_rule(self, position, rule):
+    index = self._index
+    terms = rule.terms
+    while len(index) < len(terms):
+      # a shorter head can never unify with a call binding this position, so
+      # the rules indexed so far are left out of it.
+      index.append(({}, []))
+    for i in xrange(len(terms)):
+      key_map, var_positions = index[i]
+      key = index_key(terms[i])
+      if key is None:
+        var_positions.append(position)
+        for positions in key_map.itervalues():
+          positions.append(position)
+      else:
+        if not key_map.has_key(key):
+          key_map[key] = var_positions[:]
+        key_map[key].append(position)
+
+  def _invalidate(self):
+    self._index = None
+    self.version += 1
+    changed()
+
+  def append(self, rule):
+    list.append(self, rule)
+    self.version += 1
+    changed()
+    if self._index is not None:
+      self._index_rule(len(self) - 1, rule)
+
+  def extend(self, rules):
+    for rule in rules:
+      self.append(rule)
+
+  def __iadd__(self, rules):
+    self.extend(rules)
+    return self
+
+  def insert(self, i, rule):
+    list.insert(self, i, rule)
+    self._invalidate()
+
+  def remove(self, rule):
+    list.remove(self, rule)
+    self._invalidate()
+
+  def pop(self, *args):
+    rule = list.pop(self, *args)
+    self._invalidate()
+    return rule
+
+  def __setitem__(self, i, rule):
+    list.__setitem__(self, i, rule)
+    self._invalidate()
+
+  def __delitem__(self, i):
+    list.__delitem__(self, i)
+    self._invalidate()
+
+  def __setslice__(self, i, j, rules):
+    list.__setslice__(self, i, j, rules)
+    self._invalidate()
+
+  def __delslice__(self, i, j):
+    list.__delslice__(self, i, j)
+    self._invalidate()
+
+  def sort(self, *args, **kwargs):
+    list.sort(self, *args, **kwargs)
+    self._invalidate()
+
+  def reverse(self):
+    list.reverse(self)
+    self._invalidate()
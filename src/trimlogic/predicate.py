@@ -1,5 +1,8 @@
-import logging
+import logging, operator
 from trimlogic.term import *
+from trimlogic import trace
+from trimlogic import index
+from trimlogic.index import ClauseList
 
 logger = logging.getLogger()
 
@@ -21,6 +24,11 @@ def create_python_boolean_predicate(boolean_function, name):
   return PythonBooleanPredicate()
 
 
+# parameter modes.
+INPUT = '+'
+OUTPUT = '-'
+
+
 class KnowledgeBase:
   
   def __init__(self):
@@ -49,6 +57,7 @@ class Predicate:
   def __init__(self, arity = 1):
     self.arity = arity
     self.param_types = None
+    self.param_modes = None
     self.param_orderings = None
     
   def contains(self):
@@ -62,29 +71,100 @@ class Predicate:
   
   
 class RuleBasedPredicate(Predicate):
+  """
+  A predicate defined by facts and rules. A tabled predicate memoizes the
+  answers of each call variant, see trimlogic.tabling, which makes recursive
+  definitions over cyclic data terminate and stops shared subgoals from being
+  proved again. Tabling is suspended while the predicate has a MutableRule,
+  such as a clause FOIL is building.
+  
+  The modes of the parameters, if given, are INPUT for a parameter a call is
+  expected to bind and OUTPUT for one it may leave unbound. FOIL only adds 
+  literals of the predicate which bind at least one input parameter.
+  """
+  
+  tabled = False
   
-  def __init__(self, name = None, types=None):
+  def __init__(self, name = None, types=None, tabled=False, modes=None):
     Predicate.__init__(self)
     self.rules = []
     self.name = name
+    self.tabled = tabled
     if types:
       self.param_types = tuple(types)
     if types == None:
       self.arity = None
     else:
       self.arity = len(types)
+    if modes != None:
+      if self.arity != None and len(modes) != self.arity:
+        raise ValueError("Predicate '%s' has %s parameters but %s modes." 
+                         % (name, self.arity, len(modes)))
+      self.param_modes = tuple(modes)
+    
+  def __setattr__(self, name, value):
+    # keep the rules in a ClauseList so that they stay indexed, even when the 
+    # list is replaced wholesale. Replacing the rules changes the clauses as 
+    # much as editing the list does.
+    if name == 'rules':
+      if not isinstance(value, ClauseList):
+        value = ClauseList(value)
+      if self.__dict__.has_key('rules'):
+        index.changed()
+    self.__dict__[name] = value
+    
+  def _select_rules(self, terms):
+    rules = self.rules
+    positions = rules.lookup(terms)
+    if positions is None:
+      return rules
+    return (rules[i] for i in positions)
     
   def _resolve(self, terms):
+    if self.tabled and not self._has_mutable_rules():
+      from trimlogic.tabling import resolve_tabled
+      return resolve_tabled(self, terms)
+    return self._resolve_rules(terms)
+    
+  def _has_mutable_rules(self):
+    # checked on every call to a tabled predicate, so the rules are only 
+    # scanned again once their version shows they have changed.
+    rules = self.rules
+    cached = self.__dict__.get('_mutable_rules')
+    if cached == None or cached[0] is not rules or cached[1] != rules.version:
+      found = False
+      for rule in rules:
+        if isinstance(rule, MutableRule):
+          found = True
+          break
+      cached = self._mutable_rules = (rules, rules.version, found)
+    return cached[2]
+    
+  def _resolve_rules(self, terms):
     from trimlogic.algorithm import unify
-    logging.debug(str(self) + "._resolve( " + str(terms) + " ) ")
-    for rule in self.rules:
-      rule = rule.instantiate()
-      logging.debug("considering rule: " + str(rule))
-      Head, Body, variables = rule.terms, rule.body, rule.variables
+    for rule in self._select_rules(terms):
+      # the body of an instance is only built once its head has unified.
+      template = rule.template
+      frame = template.new_frame()
+      Head = template.head(frame)
       mgu = unify(terms, Head, {})
+      if trace.enabled:
+        trace.emit(trace.CLAUSE, predicate=self, terms=terms,
+                   rule=Rule(rule.predicate, Head, template.body(frame)),
+                   unifier=mgu)
       if mgu != None: 
-        logging.debug("substitutions: " + str(mgu))
-        yield (mgu, list(Body), variables)
+        yield (mgu, list(template.body(frame)), set(frame))
+      
+  def compile(self):
+    """
+    Returns the predicate compiled into Python functions, a CompiledPredicate
+    answering the same calls much faster than fol_bc_ask.
+    
+    @raise ValueError: If the rules are not function-free and range 
+        restricted.
+    """
+    from trimlogic.compiler import CompiledPredicate
+    return CompiledPredicate(self)
       
   def add_rule(self, Head=None, Body=None):
     if self.arity == None: self.arity = len(Head)
@@ -134,7 +214,7 @@ class NegationAsFailure(RuleBasedPredicate):
   
 class ListPredicate(RuleBasedPredicate):
   def __call__(self, *terms):
-    return ListPred(self, *terms)
+    return listpred(self, *terms)
 
 class IsPredicate(Predicate):
   def __init__(self):
@@ -157,6 +237,7 @@ class Rule:
     self.terms = tuple(terms)
     self.body = tuple(body)
     self._variables = None
+    self._template = None
   
   def get_variables(self):
     if self._variables == None:
@@ -166,18 +247,17 @@ class Rule:
       self._variables = set(variables)
     return self._variables
   
+  def get_template(self):
+    if self._template == None:
+      self._template = ClauseTemplate(self.terms, self.body, self.variables)
+    return self._template
+  
   def instantiate(self):
-    instance_var_map = {}
-    for var in self.variables: instance_var_map[var] = Var.get_unique(var)
-    new_terms = []
-    for term in self.terms:
-      if isinstance(term, Term): new_terms.append(term.apply_bindings(instance_var_map))
-      else: new_terms.append(term)
-    new_body = []
-    for term in self.body:
-      if isinstance(term, Term): new_body.append(term.apply_bindings(instance_var_map))
-      else: new_body.append(term)
-    return Rule(self.predicate, new_terms, new_body)
+    template = self.get_template()
+    frame = template.new_frame()
+    rule = Rule(self.predicate, template.head(frame), template.body(frame))
+    rule._variables = set(frame)
+    return rule
   
   def is_recursive(self):
     for literal in self.body:
@@ -192,6 +272,7 @@ class Rule:
     return str(self.predicate) + str(self.terms) + " :- " + ", ".join(map(str, self.body)) + "."
   
   variables = property(fget=get_variables)
+  template = property(fget=get_template)
 
 
 class MutableRule(Rule):
@@ -207,13 +288,104 @@ class MutableRule(Rule):
     find_variables(self.body, variables)
     return set(variables)
   
+  def get_template(self):
+    # the body changes while FOIL extends the rule, so it is compiled anew.
+    return ClauseTemplate(self.terms, self.body, self.variables)
+  
   def get_immutable_instance(self):
     return Rule(self.predicate, self.terms, self.body)
   
   variables = property(fget=get_variables)
+  template = property(fget=get_template)
   immutable_instance = property(fget=get_immutable_instance)
 
 
 class Fact(Rule):
   def __init__(self, predicate, terms):
-    Rule.__init__(self, predicate, terms, ())
\ No newline at end of file
+    Rule.__init__(self, predicate, terms, ())
+
+
+class ClauseTemplate:
+  """
+  A rule compiled for instantiation. The variables of the rule are numbered
+  slots of a frame, the tuple of the fresh variables of an instance, and the
+  head and body are built from a frame by functions made once, the terms
+  without variables being shared by every instance. Building the head and
+  the body separately lets a caller build the body only once the head has
+  unified.
+  """
+  
+  def __init__(self, terms, body, variables):
+    variables = list(variables)
+    slots = {}
+    for i in xrange(len(variables)):
+      slots[variables[i]] = i
+    self._names = [var.name for var in variables]
+    self._head = _compile_frame_builder(terms, slots)
+    self._body = _compile_frame_builder(body, slots)
+  
+  def new_frame(self):
+    """
+    Returns a frame of new fresh variables, numbered like those of
+    Var.get_unique.
+    """
+    first = Var.reserve(len(self._names))
+    return tuple([FreshVar(first + i, self._names[i])
+                  for i in xrange(len(self._names))])
+  
+  def head(self, frame):
+    return self._head(frame)
+  
+  def body(self, frame):
+    return self._body(frame)
+
+
+def _compile_frame_builder(terms, slots):
+  build = _compile_terms(terms, slots)
+  if build == None:
+    terms = tuple(terms)
+    return lambda frame: terms
+  return build
+
+def _compile_terms(terms, slots):
+  # returns a function building the tuple of terms from a frame, or None if 
+  # no term has a variable of the rule.
+  builders = [_compile_term(term, slots) for term in terms]
+  constant = True
+  for i in xrange(len(builders)):
+    if builders[i] == None:
+      builders[i] = _constant(terms[i])
+    else:
+      constant = False
+  if constant:
+    return None
+  return lambda frame: tuple([build(frame) for build in builders])
+
+def _compile_term(term, slots):
+  # returns a function building term from a frame, or None if it has no 
+  # variable of the rule. Like Term.apply_bindings, the variables within
+  # functions are replaced as well.
+  if isinstance(term, Var):
+    if slots.has_key(term):
+      return operator.itemgetter(slots[term])
+  elif isinstance(term, TupleList):
+    build_items = _compile_terms(term.items[term.offset:] + (term.tail,), 
+                                 slots)
+    if build_items != None:
+      predicate = term.predicate
+      def build_list(frame):
+        items = build_items(frame)
+        return TupleList(predicate, items[:-1], 0, items[-1])
+      return build_list
+  elif isinstance(term, (Pred, Function)) and not term.ground:
+    build_terms = _compile_terms(term.terms, slots)
+    if build_terms != None:
+      if isinstance(term, Function):
+        function = term.function
+        return lambda frame: Function(function, *build_terms(frame))
+      predicate = term.predicate
+      return lambda frame: predicate(*build_terms(frame))
+  return None
+
+def _constant(term):
+  return lambda frame: term
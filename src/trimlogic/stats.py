@@ -0,0 +1,194 @@
+"""
+An opt-in collector of statistics on the resolution engines and the FOIL
+search.
+
+No statistics are collected unless a StatsCollector is enabled, the code
+being instrumented only testing whether the module's collector is None. While
+one is enabled it counts, for every predicate, the calls made to it, the
+clause heads or facts the calls unified with, the solutions the calls
+generated and the time spent in the predicate's _resolve. FOIL adds to it the
+number of candidate literals generated, suppressed as duplicates, scored and
+given up, the sizes of the examples at every level of extension, the time
+spent learning each clause and the time spent on named phases such as 
+pruning covered examples.
+
+A solution of a call is counted by a goal added after the body of every
+clause the call resolves with, so with a collector enabled the query limits
+also count those goals as resolution steps.
+"""
+import time, json
+from trimlogic import trace
+from trimlogic.term import Pred
+
+# The enabled collector, if any.
+collector = None
+
+def enable(new_collector=None):
+  """
+  Enables a collector, a new StatsCollector if none is given, and returns it.
+  """
+  global collector
+  if new_collector == None:
+    new_collector = StatsCollector()
+  collector = new_collector
+  return collector
+
+def disable():
+  """
+  Disables the enabled collector and returns it.
+  """
+  global collector
+  old_collector, collector = collector, None
+  return old_collector
+
+# the positions of the counters of a predicate.
+CALLS, SOLUTIONS, UNIFICATIONS, SECONDS = range(4)
+
+_END = object()
+
+
+class StatsCollector:
+  """
+  Statistics on the calls to each predicate, the FOIL search and its phases.
+  """
+
+  def __init__(self):
+    self._predicates = {}
+    self.counters = {}
+    self.extensions = {}
+    self.timings = {}
+    self.clauses = []
+
+  def _get_predicate(self, predicate):
+    try:
+      return self._predicates[predicate]
+    except KeyError:
+      counters = [0, 0, 0, 0.0]
+      entry = self._predicates[predicate] = (counters,
+                                             _Exit(predicate, counters)())
+      return entry
+
+  def observe_bodies(self, predicate, bodies):
+    """
+    Counts a call to predicate and returns its alternatives, the bodies of
+    the clauses it resolves with, followed by the goal counting a solution.
+    """
+    if isinstance(predicate, (_Exit, trace._Exit)):
+      return bodies
+    counters, exit = self._get_predicate(predicate)
+    counters[CALLS] += 1
+    return self._bodies(counters, exit, bodies)
+
+  def _bodies(self, counters, exit, bodies):
+    while True:
+      started = time.time()
+      body = next(bodies, _END)
+      counters[SECONDS] += time.time() - started
+      if body is _END:
+        return
+      counters[UNIFICATIONS] += 1
+      yield tuple(body) + (exit,)
+
+  def observe_resolvents(self, predicate, resolvents):
+    """
+    Like observe_bodies for the (unifier, body, variables) resolvents
+    generated by the _resolve of predicate.
+    """
+    if isinstance(predicate, (_Exit, trace._Exit)):
+      return resolvents
+    counters, exit = self._get_predicate(predicate)
+    counters[CALLS] += 1
+    return self._resolvents(counters, exit, resolvents)
+
+  def _resolvents(self, counters, exit, resolvents):
+    while True:
+      started = time.time()
+      resolvent = next(resolvents, _END)
+      counters[SECONDS] += time.time() - started
+      if resolvent is _END:
+        return
+      counters[UNIFICATIONS] += 1
+      mgu, body, variables = resolvent
+      yield (mgu, list(body) + [exit], variables)
+
+  def count(self, name, n=1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def record_extension(self, level, size):
+    """
+    Records that an example was extended to level into size examples.
+    """
+    try:
+      entry = self.extensions[level]
+    except KeyError:
+      entry = self.extensions[level] = {'extensions': 0, 'examples': 0,
+                                        'largest': 0}
+    entry['extensions'] += 1
+    entry['examples'] += size
+    if size > entry['largest']:
+      entry['largest'] = size
+
+  def add_time(self, phase, seconds):
+    try:
+      entry = self.timings[phase]
+    except KeyError:
+      entry = self.timings[phase] = {'calls': 0, 'seconds': 0.0}
+    entry['calls'] += 1
+    entry['seconds'] += seconds
+
+  def record_clause(self, clause, seconds):
+    self.clauses.append({'clause': str(clause), 'seconds': seconds})
+
+  def as_dict(self):
+    """
+    Returns the statistics as a dict of plain values. The statistics of the
+    predicates are keyed by name, those of predicates of the same name being
+    summed.
+    """
+    predicates = {}
+    for predicate, (counters, exit) in self._predicates.iteritems():
+      entry = predicates.setdefault(str(predicate),
+                                    {'calls': 0, 'solutions': 0,
+                                     'unifications': 0, 'seconds': 0.0})
+      entry['calls'] += counters[CALLS]
+      entry['solutions'] += counters[SOLUTIONS]
+      entry['unifications'] += counters[UNIFICATIONS]
+      entry['seconds'] += counters[SECONDS]
+    extensions = {}
+    for level, entry in self.extensions.iteritems():
+      extensions[str(level)] = dict(entry)
+    timings = {}
+    for phase, entry in self.timings.iteritems():
+      timings[phase] = dict(entry)
+    return {'predicates': predicates, 'foil': dict(self.counters),
+            'extensions': extensions, 'timings': timings,
+            'clauses': [dict(entry) for entry in self.clauses]}
+
+  def to_json(self, **options):
+    """
+    Returns the statistics of as_dict as a JSON document. The options are
+    passed on to json.dumps.
+    """
+    return json.dumps(self.as_dict(), **options)
+
+
+class _Exit:
+  """
+  The predicate of the goal following the body of a clause, which counts a
+  solution of the call that resolved with the clause.
+  """
+
+  def __init__(self, predicate, counters):
+    self.name = "exit(%s)" % predicate
+    self.counters = counters
+
+  def _resolve(self, terms):
+    self.counters[SOLUTIONS] += 1
+    yield ({}, [], set())
+
+  def __call__(self, *terms):
+    return Pred(self, *terms)
+
+  def __str__(self):
+    return self.name
+
@@ -1,15 +1,89 @@
 def plist(l, Tail=None):
-  if Tail == None: 
-    Tail = []
-  if l == []:
-    return Tail
-  return dot( l[0], plist(l[1:], Tail=Tail) )
+  """
+  Returns the list term of the elements of l followed by Tail, the empty list
+  if not given, see make_list.
+  """
+  from trimlogic.term import make_list
+  return make_list(dot, l, Tail)
 
 def __define_list_predicates():
   import operator
-  from trimlogic.term import VariableFactory, Term
+  from trimlogic.term import VariableFactory, Term, Var
+  from trimlogic.term import list_items, make_list
   from trimlogic.predicate import RuleBasedPredicate, ListPredicate
-  global dot, car, cdr, cons, append, reverse, components
+  global dot, car, cdr, cons, append, reverse, components, length
+  
+  class AppendPredicate(RuleBasedPredicate):
+    """
+    Answers a call whose first list is a proper list, or else whose last list
+    is, with a goal unifying the other lists with their values, taking the
+    rules only for other calls.
+    """
+    def _resolve(self, terms):
+      answers = None
+      if len(terms) == 3:
+        answers = self._answers(*terms)
+      if answers == None:
+        return RuleBasedPredicate._resolve(self, terms)
+      return answers
+    def _answers(self, front, back, whole):
+      items, tail = list_items(front)
+      if tail == []:
+        back_items, back_tail = list_items(back)
+        return iter([({}, [eql(whole, make_list(dot, items + back_items, 
+                                                back_tail))], set())])
+      items, tail = list_items(whole)
+      if tail == []:
+        return self._splits(front, back, whole, items)
+      return None
+    def _splits(self, front, back, whole, items):
+      # the tails of whole are shared, not copied.
+      rest = whole
+      for k in xrange(len(items) + 1):
+        yield ({}, [eql(front, make_list(dot, items[:k])), eql(back, rest)], 
+               set())
+        if k < len(items):
+          rest = rest.terms[1]
+  
+  class ReversePredicate(RuleBasedPredicate):
+    """
+    Answers a call whose first list is a proper list with a goal unifying the
+    second with its reverse, taking the rules only for other calls.
+    """
+    def _resolve(self, terms):
+      if len(terms) == 2:
+        items, tail = list_items(terms[0])
+        if tail == []:
+          items.reverse()
+          return iter([({}, [eql(terms[1], make_list(dot, items))], set())])
+      return RuleBasedPredicate._resolve(self, terms)
+  
+  class LengthPredicate(RuleBasedPredicate):
+    """
+    length(List, N) holds if List has N elements. A partial list is extended
+    with new variables to N elements, or to any number of them in turn if N
+    is not bound.
+    """
+    ELEMENT = Var('E')
+    def __init__(self):
+      RuleBasedPredicate.__init__(self, 'length', (dot, int))
+    def _resolve(self, terms):
+      l, n = terms
+      items, tail = list_items(l)
+      if tail == []:
+        yield ({}, [eql(n, len(items))], set())
+      elif isinstance(tail, Var):
+        if isinstance(n, (int, long)):
+          if n >= len(items):
+            yield ({}, [eql(tail, self._variables(n - len(items)))], set())
+        elif isinstance(n, Var):
+          k = 0
+          while True:
+            yield ({}, [eql(tail, self._variables(k)), eql(n, len(items) + k)],
+                   set())
+            k += 1
+    def _variables(self, k):
+      return make_list(dot, [Var.get_unique(self.ELEMENT) for i in xrange(k)])
   
   v = VariableFactory()
   dot = ListPredicate('.')
@@ -28,16 +102,18 @@ def __define_list_predicates():
   components.add_rule( Head=( v.X, v.H, v.T ), Body=( car(v.X, v.H), cdr(v.X, v.T ) ) )
   components.param_orderings = {(0, 2):operator.gt}
   
-  append = RuleBasedPredicate('append')
+  append = AppendPredicate('append')
   append.add_rule( Head=( [], v.L, v.L ) )
   append.add_rule( Head=( dot(v.X, v.A), v.B, dot(v.X, v.C) ), 
                   Body=( append(v.A, v.B, v.C), ) )
   
-  reverse = RuleBasedPredicate('reverse')
+  reverse = ReversePredicate('reverse')
   reverse.add_rule( Head=( [], [] ) )
   reverse.add_rule( Head=( dot(v.H, v.T), v.Rev ), 
                    Body=( reverse(v.T, v.Trev), append(v.Trev, plist([v.H]), v.Rev) ) )
   
+  length = LengthPredicate()
+  
 def __define_arithmetic_predicates():
   from trimlogic.predicate import IsPredicate
   global est
@@ -0,0 +1,276 @@
+from trimlogic import index
+from trimlogic.term import Var, Pred, Function, TupleList, find_variables
+
+_VAR, _PRED, _FUNCTION, _LIST = object(), object(), object(), object()
+_TUPLE_LIST, _GROUND = object(), object()
+
+
+def variant_key(terms):
+  """
+  Returns a hashable key which is the same for two sequences of terms exactly
+  when they are variants, that is equal up to a consistent renaming of their
+  variables. Variables are numbered in order of first occurrence.
+  """
+  numbering = {}
+  def key(term):
+    if isinstance(term, Var):
+      if not numbering.has_key(term):
+        numbering[term] = len(numbering)
+      return (_VAR, numbering[term])
+    if isinstance(term, Pred):
+      if term.ground:
+        # an interned term is its own key, along with its structural hash as
+        # interned lists hash like any other list.
+        return (_GROUND, term._hash, term)
+      if isinstance(term, TupleList):
+        return (_TUPLE_LIST, tuple(map(key, term.items[term.offset:])), 
+                key(term.tail))
+      return (_PRED, term.predicate, tuple(map(key, term.terms)))
+    if isinstance(term, Function):
+      return (_FUNCTION, term.function, tuple(map(key, term.terms)))
+    if isinstance(term, (list, tuple)):
+      return (_LIST, tuple(map(key, term)))
+    return term
+  return tuple(map(key, terms))
+
+def match(pattern, instance, bindings=None):
+  """
+  One way unification, returning the bindings for the variables of pattern
+  which make it equal to instance, or None if there are none. Variables of
+  instance are treated as constants.
+  """
+  if bindings == None:
+    bindings = {}
+  stack = [(pattern, instance)]
+  while stack:
+    pattern, instance = stack.pop()
+    if isinstance(pattern, Var):
+      if bindings.has_key(pattern):
+        bound = bindings[pattern]
+        if not (bound is instance or bound == instance):
+          return None
+      else:
+        bindings[pattern] = instance
+    elif isinstance(pattern, Pred):
+      if (not isinstance(instance, Pred)
+          or pattern.predicate != instance.predicate
+          or len(pattern.terms) != len(instance.terms)):
+        return None
+      stack.extend(zip(pattern.terms, instance.terms))
+    elif isinstance(pattern, (list, tuple)):
+      if (not isinstance(instance, (list, tuple))
+          or len(pattern) != len(instance)):
+        return None
+      stack.extend(zip(pattern, instance))
+    elif isinstance(instance, Var) or not pattern == instance:
+      return None
+  return bindings
+
+
+class AnswerTable:
+  """
+  The answers found so far for one call variant of a tabled predicate. A table
+  is complete once every answer has been found.
+  """
+
+  def __init__(self):
+    self.answers = []
+    self.complete = False
+    self.ground = True
+    self.evaluating = False
+    self.position = None
+    self.leader = None
+    self._variants = set()
+
+  def add(self, answer):
+    """
+    Adds an answer, a tuple of the call's arguments under some solution, and
+    returns True if it is not a variant of an answer already in the table.
+    """
+    key = variant_key(answer)
+    if key in self._variants:
+      return False
+    self._variants.add(key)
+    self.answers.append(answer)
+    if self.ground and find_variables(list(answer)):
+      self.ground = False
+    return True
+
+  def __len__(self):
+    return len(self.answers)
+
+
+# the answer tables of every tabled call, keyed by predicate and call variant,
+# and the generation of the clauses and facts they were computed from.
+_tables = {}
+_generation = [None]
+# the tables being evaluated, the oldest first.
+_stack = []
+# tables whose evaluation finished while depending on a table still being
+# evaluated, they are completed along with that table.
+_pending = []
+# the number of answers added to any table, used to detect a fixpoint.
+_added = [0]
+# the number of calls which consumed the answers of a table still being
+# evaluated. An evaluation making no such call has reached its fixpoint.
+_consumed = [0]
+
+def abolish_tables():
+  """
+  Discards every answer table.
+  """
+  if _stack:
+    raise RuntimeError("Answer tables can not be abolished during evaluation.")
+  _tables.clear()
+  del _pending[:]
+  _generation[0] = None
+
+def get_table(predicate, terms, engine=None):
+  """
+  Returns the answer table of a call to a tabled predicate, or None if the call
+  has not been evaluated.
+  """
+  return _tables.get((predicate, engine, variant_key(terms)))
+
+def resolve_tabled(predicate, terms, engine=None):
+  """
+  Answers a call to a tabled predicate from the answer table of its variant,
+  which is computed the first time the variant is called. Each answer is
+  generated as a unifier with no new goals, in the form of
+  RuleBasedPredicate._resolve.
+
+  Tables are evaluated by iterating to a fixpoint. A call to a variant whose
+  table is still being evaluated, a recursive call, consumes the answers found
+  so far rather than evaluating the clauses again, so left recursion and
+  cycles in the data terminate. The evaluation of the oldest table such a call
+  depends on, the leader, is repeated until it adds no answers to any table,
+  after which the leader and the tables depending on it are complete. Complete
+  tables are reused by later calls until the clauses or facts of any predicate
+  change.
+
+  @param engine: The engine the clause bodies are proved with, see 
+      fol_bc_ask. The tables of different engines are kept apart. Defaults
+      to the trail engine, which answers partially bound calls the dict
+      engine fails.
+  @type engine: str
+  """
+  terms = tuple(terms)
+  table, answers = _answers(predicate, terms, engine)
+  return _consume(terms, answers, table.ground)
+
+def answer_table(predicate, terms, engine=None):
+  """
+  Returns the AnswerTable of a call to a predicate defined by rules, computed
+  like the table of resolve_tabled whether or not the predicate is tabled.
+  The table is complete unless it is asked for while a table is evaluated.
+  """
+  return _answers(predicate, tuple(terms), engine)[0]
+
+def _answers(predicate, terms, engine):
+  # returns the table of the call and the answers the call consumes.
+  if not _stack and _generation[0] != index.generation:
+    _tables.clear()
+    del _pending[:]
+    _generation[0] = index.generation
+  key = (predicate, engine, variant_key(terms))
+  table = _tables.get(key)
+  if table == None:
+    table = _tables[key] = AnswerTable()
+  if table.complete:
+    return table, table.answers
+  if table.evaluating:
+    caller = _stack[-1]
+    caller.leader = min(caller.leader, table.position)
+    _consumed[0] += 1
+    return table, table.answers[:]
+  _evaluate(predicate, terms, table, engine)
+  return table, table.answers
+
+def _consume(terms, answers, ground):
+  for answer in answers:
+    if not ground:
+      answer = _rename(answer)
+    mgu = match(terms, answer)
+    if mgu != None:
+      yield (mgu, [], ())
+
+def _rename(answer):
+  renaming = {}
+  for var in find_variables(list(answer)):
+    if not renaming.has_key(var):
+      renaming[var] = Var.get_unique(var)
+  return tuple([_apply(term, renaming) for term in answer])
+
+def _apply(term, bindings):
+  if isinstance(term, (Var, Pred, Function)):
+    return term.apply_bindings(bindings)
+  return term
+
+def _prove_body(body, substitutions, engine=None):
+  """
+  Generates the answers of the body of a clause, followed by None if a cut in
+  the body is reached, like fol_bc_ask does. The body is proved with the trail
+  engine unless another engine is given, as the trail engine binds partially
+  instantiated calls correctly whichever engine the tabled call came from. 
+  With the trail engine, the cut commits to the first answer of the goals
+  before it.
+  """
+  from trimlogic.trail import trail_bc_ask
+  from trimlogic.compiler import is_cut
+  if engine not in (None, 'trail'):
+    from trimlogic.algorithm import fol_bc_ask
+    for answer in fol_bc_ask(body, substitutions, engine):
+      yield answer
+    return
+  for i in xrange(len(body)):
+    if is_cut(body[i]):
+      for answer in trail_bc_ask(body[:i], substitutions):
+        for answer in _prove_body(body[i + 1:], answer):
+          if answer != None:
+            yield answer
+        yield None
+        return
+      return
+  for answer in trail_bc_ask(body, substitutions):
+    yield answer
+
+def _evaluate(predicate, terms, table, engine=None):
+  table.evaluating = True
+  table.position = table.leader = len(_stack)
+  pending = len(_pending)
+  _stack.append(table)
+  # the only answer of a ground call is the call itself, so its evaluation
+  # stops at the first proof.
+  ground = not find_variables(list(terms))
+  try:
+    while True:
+      added, consumed = _added[0], _consumed[0]
+      cut = False
+      for mgu, body, variables in predicate._resolve_rules(terms):
+        for answer in _prove_body(body, mgu, engine):
+          if answer == None:
+            # a cut in the clause, the clauses after it are not tried.
+            cut = True
+            break
+          if table.add(tuple([_apply(term, answer) for term in terms])):
+            _added[0] += 1
+          if ground:
+            break
+        if cut or (ground and table.answers):
+          break
+      # repeated only while new answers may give the calls which consumed
+      # an incomplete table more answers.
+      if (ground and table.answers or _added[0] == added 
+          or _consumed[0] == consumed):
+        break
+  finally:
+    _stack.pop()
+    table.evaluating = False
+  if table.leader == table.position:
+    table.complete = True
+    for dependent in _pending[pending:]:
+      dependent.complete = True
+    del _pending[pending:]
+  else:
+    _stack[-1].leader = min(_stack[-1].leader, table.leader)
+    _pending.append(table)
@@ -1,3 +1,28 @@
+import weakref
+
+# The TermFactory interning the compound terms built by predicates, if hash
+# consing is enabled.
+_factory = None
+
+def enable_hash_consing(new_factory=None):
+  """
+  Makes predicates build their terms through a factory, a new TermFactory if
+  none is given, and returns it.
+  """
+  global _factory
+  if new_factory == None:
+    new_factory = TermFactory()
+  _factory = new_factory
+  return _factory
+
+def disable_hash_consing():
+  """
+  Stops interning terms and returns the factory which interned them.
+  """
+  global _factory
+  old_factory, _factory = _factory, None
+  return old_factory
+
 def find_variables(terms, variables=None):
   l = None
   if not(isinstance(terms, list) or isinstance(terms, tuple)):
@@ -22,6 +47,9 @@ def find_variables(terms, variables=None):
 
 class Term:
   
+  # True if the term is known to be ground, as interned terms are.
+  ground = False
+  
   def apply_bindings(self, bindings):
     return self
 
@@ -70,6 +98,187 @@ class ListPred(Pred):
     return isinstance(other, ListPred) and self.terms[0] == other.terms[0] and self.terms[1] == other.terms[1]
   
 
+class TupleList(ListPred):
+  """
+  A list term holding its elements in a tuple. It is the list cell whose 
+  head is the element at offset and whose tail is the TupleList of the 
+  elements after it, or the tail of the list after the last element. The
+  cells are views of the same tuple made when their terms are first asked
+  for, so taking the head or tail of a list copies nothing, and a TupleList
+  unifies and compares with the cells of dot like the list they make.
+  """
+  
+  def __init__(self, predicate, items, offset=0, tail=None):
+    if tail == None: tail = []
+    self.predicate = predicate
+    self.items, self.offset, self.tail = items, offset, tail
+  
+  def __getattr__(self, name):
+    # the terms and variables of a view are made on demand.
+    if name == 'terms':
+      offset = self.offset + 1
+      if offset < len(self.items):
+        rest = TupleList(self.predicate, self.items, offset, self.tail)
+        if self.__dict__.get('variables') == _NO_VARIABLES:
+          rest.variables = _NO_VARIABLES
+      else:
+        rest = self.tail
+      self.terms = (self.items[self.offset], rest)
+      return self.terms
+    if name == 'variables':
+      self.variables = set(find_variables(self.elements() + [self.tail]))
+      if not self.variables:
+        self.variables = _NO_VARIABLES
+      return self.variables
+    raise AttributeError(name)
+  
+  def __len__(self):
+    return len(self.items) - self.offset
+  
+  def elements(self):
+    """
+    Returns the elements before the tail as a list.
+    """
+    return list(self.items[self.offset:])
+  
+  def view(self, offset):
+    """
+    Returns the list of the elements from offset on, counted from the first
+    element of this list, followed by the tail.
+    """
+    offset += self.offset
+    if offset < len(self.items):
+      return TupleList(self.predicate, self.items, offset, self.tail)
+    return self.tail
+  
+  def pairs(self, other):
+    """
+    Returns the pairs of terms which are equal exactly when this list and 
+    another TupleList are: their elements in order, then what is left of
+    the longer list and the tail of the shorter.
+    """
+    n, m = len(self), len(other)
+    pairs = zip(self.items[self.offset:], other.items[other.offset:])
+    if n == m:
+      pairs.append((self.tail, other.tail))
+    elif n < m:
+      pairs.append((self.tail, other.view(n)))
+    else:
+      pairs.append((self.view(m), other.tail))
+    return pairs
+  
+  def __str__(self):
+    items, tail = list_items(self)
+    parts = [str(item) for item in items]
+    if isinstance(tail, Var):
+      parts.append("|" + str(tail))
+    elif tail != []:
+      parts.append("." + str(tail))
+    return "plist([" + ", ".join(parts) + "])"
+  
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, ListPred):
+      return False
+    items, tail = list_items(self)
+    other_items, other_tail = list_items(other)
+    return items == other_items and tail == other_tail
+  
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  
+  def apply_bindings(self, bindings):
+    if not self.variables:
+      return self
+    items = []
+    for item in self.items[self.offset:]:
+      if isinstance(item, Term): items.append(item.apply_bindings(bindings))
+      else: items.append(item)
+    tail = self.tail
+    if isinstance(tail, Term): tail = tail.apply_bindings(bindings)
+    return TupleList(self.predicate, tuple(items), 0, tail)
+  
+  
+def list_items(term):
+  """
+  Returns the elements of a list term, made of TupleList and other list
+  cells, and the term ending it, which is the empty list for a proper list.
+  """
+  items = []
+  while isinstance(term, ListPred):
+    if isinstance(term, TupleList):
+      items.extend(term.items[term.offset:])
+      term = term.tail
+    else:
+      items.append(term.terms[0])
+      term = term.terms[1]
+  return items, term
+
+def make_list(predicate, items, tail=None):
+  """
+  Returns the list term of the given elements followed by tail, the empty
+  list if not given. The list is a TupleList, or a chain of the cells made by
+  predicate if hash consing is enabled, so that it is interned.
+  """
+  if tail == None: tail = []
+  if len(items) == 0:
+    return tail
+  if _factory != None:
+    for item in reversed(items):
+      tail = predicate(item, tail)
+    return tail
+  return TupleList(predicate, tuple(items), 0, tail)
+
+
+class InternedPred(Pred):
+  """
+  A ground compound term interned by a TermFactory. Its hash is structural
+  and computed once, and as a factory never makes two interned terms which
+  are structurally equal, comparing two terms of the same factory is an 
+  identity check.
+  """
+  
+  ground = True
+  
+  def __hash__(self):
+    return self._hash
+  
+  def __eq__(self, other):
+    if self is other:
+      return True
+    return (isinstance(other, InternedPred) and self._hash == other._hash
+            and self.predicate == other.predicate and self.terms == other.terms)
+  
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  
+  def apply_bindings(self, bindings):
+    return self
+  
+  
+class InternedListPred(ListPred):
+  """
+  An interned list cell, see InternedPred. It is still equal to a ListPred
+  holding the same elements, and so hashes like one rather than by its
+  structural hash.
+  """
+  
+  ground = True
+  
+  def __hash__(self):
+    return Pred.__hash__(self)
+  
+  def __eq__(self, other):
+    return self is other or ListPred.__eq__(self, other)
+  
+  def __ne__(self, other):
+    return not self.__eq__(other)
+  
+  def apply_bindings(self, bindings):
+    return self
+  
+  
 class Function(Term):
   
   def __init__(self, function, *terms):
@@ -110,6 +319,8 @@ class Atom(Term):
 class Var(Term):
   
   unique_count = 0
+  # the type of the values the variable takes, if known.
+  type = None
   
   def __init__(self, name):
     self.name = name
@@ -123,7 +334,10 @@ class Var(Term):
     return str(self)
   
   def __eq__(self, other):
-    return isinstance(other, Var) and self.name == other.name
+    # the hashes are compared first so that the name of a FreshVar is not 
+    # made for the comparison.
+    return (isinstance(other, Var) and self._hash_value == other._hash_value
+            and self.name == other.name)
   
   def __hash__(self):
     return self._hash_value
@@ -138,6 +352,41 @@ class Var(Term):
   
   get_unique = staticmethod(get_unique)
   
+  def reserve(count):
+    """
+    Reserves count numbers for unique variables and returns the first.
+    """
+    first = Var.unique_count + 1
+    Var.unique_count += count
+    return first
+  
+  reserve = staticmethod(reserve)
+  
+  
+class FreshVar(Var):
+  """
+  A variable of a clause instance, numbered like the variables of 
+  Var.get_unique, see Var.reserve. It hashes by its number and is equal to
+  the fresh variables of the same number, and its name, which is that 
+  Var.get_unique would give it, is only made when it is asked for.
+  """
+  
+  def __init__(self, number, base_name):
+    self.number, self.base_name = number, base_name
+    self._hash_value = number
+    self.scope = None
+  
+  def __getattr__(self, name):
+    if name == 'name':
+      self.name = '@_' + str(self.number) + '_' + self.base_name
+      return self.name
+    raise AttributeError(name)
+  
+  def __eq__(self, other):
+    if isinstance(other, FreshVar):
+      return self.number == other.number
+    return Var.__eq__(self, other)
+  
   
 class VariableFactory:
   
@@ -165,19 +414,118 @@ class UniqueVariableFactory:
       self.variable_map[prefix] = 0
     return str(self.variable_map[prefix])
   
-  def next_variable(self, prefix = "VAR_"):
+  def next_variable(self, prefix = "VAR_", type=None):
     count = self._next_count(prefix)
     var = Var(prefix + str(count))
+    if type != None:
+      var.type = type
     return var
   
-  def next_variable_sequence(self, length, prefix="VAR_"):
-    return map(lambda x: self.next_variable(prefix), range(length))
+  def next_variable_sequence(self, length, prefix="VAR_", types=None):
+    if types == None:
+      types = [None] * length
+    return map(lambda x: self.next_variable(prefix, types[x]), range(length))
   
   def reset(self):
     self.variable_map = {}
   
+
+class TermFactory:
+  """
+  Interns ground compound terms, so that structurally equal ground terms 
+  made by the same factory are a single object. A term is interned if its
+  arguments are interned terms, the empty list or hashable constants, and
+  made as usual otherwise. The interned terms are held weakly, a term being
+  dropped once nothing else refers to it.
+  """
+  
+  _INTERNED = {Pred: InternedPred, ListPred: InternedListPred}
+  
+  def __init__(self):
+    self._terms = weakref.WeakValueDictionary()
+  
+  def make(self, cls, predicate, terms):
+    """
+    Returns the term of class cls, Pred or ListPred, with the given predicate
+    and arguments, the interned one if the term is ground.
+    """
+    key = [cls, predicate]
+    for term in terms:
+      if isinstance(term, Pred):
+        if not term.ground:
+          return cls(predicate, *terms)
+        # keyed by its structural hash, as interned lists hash like lists.
+        term = (term._hash, term)
+      elif isinstance(term, (Var, Function, tuple)):
+        return cls(predicate, *terms)
+      elif isinstance(term, list):
+        if term:
+          return cls(predicate, *terms)
+        term = _EMPTY_LIST
+      else:
+        # 1, 1.0 and True are equal and hash alike, but are not the same
+        # constant.
+        term = (type(term), term)
+      key.append(term)
+    key = tuple(key)
+    try:
+      return self._terms[key]
+    except KeyError:
+      pass
+    except TypeError:
+      # an argument is not hashable.
+      return cls(predicate, *terms)
+    interned = self._INTERNED[cls](predicate, *terms)
+    interned._hash = hash(key)
+    interned.variables = _NO_VARIABLES
+    self._terms[key] = interned
+    return interned
+  
+  def intern(self, term):
+    """
+    Returns the interned term structurally equal to term if it is ground, and
+    term itself otherwise.
+    """
+    result = []
+    stack = [(_VISIT, term, result)]
+    while stack:
+      action, term, out = stack.pop()
+      if action is _BUILD:
+        term, args = term
+        cls = term.__class__
+        if cls is TupleList:
+          # interned lists are chains of interned cells.
+          cls = ListPred
+        interned = self.make(cls, term.predicate, args)
+        if not interned.ground:
+          interned = term
+        out.append(interned)
+      elif (isinstance(term, Pred) and not term.ground 
+            and (self._INTERNED.has_key(term.__class__) 
+                 or isinstance(term, TupleList))):
+        args = []
+        stack.append((_BUILD, (term, args), out))
+        for child in reversed(term.terms):
+          stack.append((_VISIT, child, args))
+      else:
+        out.append(term)
+    return result[0]
+  
+  def __len__(self):
+    return len(self._terms)
+  
+_VISIT, _BUILD, _EMPTY_LIST = object(), object(), object()
+_NO_VARIABLES = frozenset()
+
 def pred(predicate, *terms):
+  if _factory != None:
+    return _factory.make(Pred, predicate, terms)
   return Pred(predicate, *terms)
 
+def listpred(predicate, *terms):
+  if _factory != None:
+    return _factory.make(ListPred, predicate, terms)
+  return ListPred(predicate, *terms)
+
 def func(function, *terms):
   return Function(function, *terms)
@@ -7,6 +7,11 @@ from trimlogic.term import *
 from trimlogic.predicate import *
 from trimlogic.algorithm import *
 from trimlogic.stdlib import *
+from trimlogic.facttable import FactTablePredicate
+from trimlogic.trail import BindingStore
+from trimlogic.datalog import materialize
+from trimlogic import stats, trace
+import json
 
 class PrologTestCase(unittest.TestCase):
   def assertHaveSameElements(self, expected, given):
@@ -44,6 +49,729 @@ class AlgPredicatesTestCase(PrologTestCase):
     self.assertHaveSameElements( ({v.X : 1},),
                                   list(fol_bc_ask([eql(1,v.X)], {})) )
     
+class ClauseIndexTestCase(PrologTestCase):
+  def testIndexedLookup(self):
+    v = VariableFactory()
+    p = RuleBasedPredicate('p')
+    p.add_rule( Head=( 'a', 1 ) )
+    p.add_rule( Head=( 'b', v.X ) )
+    p.add_rule( Head=( 'c', 2 ) )
+    p.add_rule( Head=( 'd', 1 ) )
+    self.assertEquals( [0, 1, 3], p.rules.lookup((v.Y, 1)) )
+    self.assertEquals( [1], p.rules.lookup(('b', v.Y)) )
+    self.assertEquals( [1], p.rules.lookup((v.Y, 3)) )
+    self.assertEquals( None, p.rules.lookup((v.Z, v.Y)) )
+    self.assertHaveSameElements( ({v.Y : 'a'}, {v.Y : 'b'}, {v.Y : 'd'}),
+                                 list(fol_bc_ask([p(v.Y, 1)], {})) )
+  def testTupleArguments(self):
+    v = VariableFactory()
+    p = RuleBasedPredicate('p')
+    p.add_rule( Head=( (2, 1), 'a' ) )
+    p.add_rule( Head=( (2, 3), 'b' ) )
+    p.add_rule( Head=( 3, 'c' ) )
+    self.assertEquals( [0, 1], p.rules.lookup(((v.X, 1), v.Y)) )
+    for engine in ['dict', 'trail']:
+      self.assertHaveSameElements( ({v.X : 2, v.Y : 'a'},),
+                                   list(fol_bc_ask([p((v.X, 1), v.Y)], {},
+                                                   engine)) )
+  def testIndexFollowsMutation(self):
+    v = VariableFactory()
+    p = RuleBasedPredicate('p')
+    p.add_rule( Head=( 'a', 1 ) )
+    p.add_rule( Head=( 'b', 2 ) )
+    self.assertHaveSameElements( ({v.Y : 'b'},),
+                                 list(fol_bc_ask([p(v.Y, 2)], {})) )
+    del p.rules[0]
+    self.assertHaveSameElements( ({v.Y : 'b'},),
+                                 list(fol_bc_ask([p(v.Y, 2)], {})) )
+    p.rules = []
+    p.add_rule( Head=( 'c', 2 ) )
+    self.assertHaveSameElements( ({v.Y : 'c'},),
+                                 list(fol_bc_ask([p(v.Y, 2)], {})) )
+
+class FactTableTestCase(PrologTestCase):
+  def testMatchesRules(self):
+    v = VariableFactory()
+    facts = [('a', 'b'), ('a', 'c'), ('b', 'c'), ('c', 'c')]
+    p = RuleBasedPredicate('p')
+    map(lambda x: p.add_rule( Head=x ), facts)
+    q = FactTablePredicate('q', facts=facts)
+    for X, Y in [(v.X, v.Y), (v.X, 'c'), ('b', 'c'), ('c', 'b'), ('d', v.Y)]:
+      self.assertHaveSameElements( list(fol_bc_ask([p(X, Y)], {})),
+                                   list(fol_bc_ask([q(X, Y)], {})) )
+    self.assertHaveSameElements( ({v.X : 'c'},),
+                                 list(fol_bc_ask([q(v.X, v.X)], {})) )
+  def testFactsAreASet(self):
+    q = FactTablePredicate('q')
+    q.add_facts([(1, 2), (2, 3), (1, 2)])
+    self.assertEquals( 2, len(q) )
+    self.assertTrue( (2, 3) in q )
+    self.assertFalse( (3, 2) in q )
+    self.assertEquals( [(1, 2), (2, 3)], [rule.terms for rule in q.rules] )
+    # checking for duplicates indexes no column but the first.
+    self.assertEquals( None, q._indexes[1] )
+  def testRejectsRules(self):
+    v = VariableFactory()
+    q = FactTablePredicate('q')
+    self.assertRaises( ValueError, q.add_rule, (v.X,), (q(v.X),) )
+    self.assertRaises( ValueError, q.add_fact, (v.X,) )
+    self.assertRaises( ValueError, q.add_fact, ([1, 2],) )
+    self.assertRaises( ValueError, q.add_fact, ((1, v.X),) )
+    q.add_fact( ((1, 2),) )
+    self.assertEquals( 1, len(q) )
+  def testRulesAreCached(self):
+    q = FactTablePredicate('q', facts=[(1, 2)])
+    rules = q.rules
+    self.assert_( q.rules is rules )
+    q.add_fact( (2, 3) )
+    self.assertEquals( [(1, 2), (2, 3)], [rule.terms for rule in q.rules] )
+
+class TrailEngineTestCase(PrologTestCase):
+  def testBindingStore(self):
+    v = VariableFactory()
+    store = BindingStore()
+    mark = store.mark()
+    self.assertTrue( store.unify((v.X, cons(v.Y, 2, v.Z)), (v.Y, cons(1, v.W, v.X))) )
+    self.assertEquals( 1, store.resolve(v.Z) )
+    self.assertEquals( 2, store.resolve(v.W) )
+    self.assertFalse( store.unify(v.X, 3) )
+    self.assertEquals( 1, store.resolve(v.X) )
+    store.undo(mark)
+    self.assertEquals( v.X, store.resolve(v.X) )
+  def testCutNeg(self):
+    v = VariableFactory()
+    a = RuleBasedPredicate('a')
+    b = RuleBasedPredicate('b')
+    c = RuleBasedPredicate('c')
+    a.add_rule( Head=( v.X, v.Y ),
+               Body=( b(v.X), cut, c(v.Y) ) )
+    a.add_rule( Head=( 4, 4 ) )
+    b.add_rule( Head=( 1, ) )
+    b.add_rule( Head=( 2, ) )
+    c.add_rule( Head=( 1, ) )
+    c.add_rule( Head=( 2, ) )
+    self.assertHaveSameElements( ({v.Q : 1, v.R : 1},
+                                  {v.Q : 1, v.R : 2}), 
+                                  list(fol_bc_ask([a(v.Q, v.R)], {}, 'trail')) )
+    self.assertHaveSameElements( ({v.Q : 1}, {v.Q : 2}), 
+                                  list(fol_bc_ask([c(v.Q), neg(b(3))], {}, 'trail')) )
+    self.assertHaveSameElements( (), list(fol_bc_ask([neg(b(1))], {}, 'trail')) )
+  def testSameAnswers(self):
+    v = VariableFactory()
+    queries = [ [eql(1, v.X)],
+                [eql(v.X, v.Y), eql(v.Y, 2)],
+                [car(plist([1, 2, 3]), v.X)],
+                [cdr(plist([1, 2, 3]), v.X)],
+                [cons(1, plist([2]), v.X)],
+                [components(v.L, v.H, v.T), eql(v.L, plist([1, 2]))],
+                [is_integer(1)],
+                [est(v.X, func(int.__add__, 1, 2))] ]
+    for query in queries:
+      self.assertHaveSameElements( list(fol_bc_ask(query, {})),
+                                   list(fol_bc_ask(query, {}, 'trail')) )
+    self.assertHaveSameElements( ({v.X : plist([3, 2, 1])},),
+                                 list(fol_bc_ask([reverse(plist([1, 2, 3]), v.X)], 
+                                                 {}, 'trail')) )
+  def testDeepProofs(self):
+    v = VariableFactory()
+    n = 3000
+    linkedto = RuleBasedPredicate('linked-to')
+    for i in xrange(n):
+      linkedto.add_rule( Head=( i, i + 1 ) )
+    canreach = RuleBasedPredicate('can-reach')
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.X, v.Y), ) )
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.X, v.Z), canreach(v.Z, v.Y) ) )
+    self.assertHaveSameElements( ({},),
+                                 list(fol_bc_ask([canreach(0, n)], {}, 'trail')) )
+    member = RuleBasedPredicate('member')
+    member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+    member.add_rule( Head=( v.X, dot(v.H, v.T) ),
+                    Body=( member(v.X, v.T), ) )
+    l = []
+    for i in xrange(n, 0, -1):
+      l = dot(i, l)
+    self.assertEquals( n, len(list(fol_bc_ask([member(v.X, l)], {}, 'trail'))) )
+    answers = list(fol_bc_ask([append(l, plist([0]), v.X), 
+                               member(0, v.X)], {}, 'trail'))
+    self.assertEquals( 1, len(answers) )
+
+class TablingTestCase(PrologTestCase):
+  def answerSet(self, goals, var, engine=None):
+    return set([answer[var] for answer in fol_bc_ask(goals, {}, engine)])
+  def testCyclicGraph(self):
+    v = VariableFactory()
+    linkedto = RuleBasedPredicate('linked-to')
+    for edge in [(1, 2), (2, 3), (3, 1), (3, 4)]:
+      linkedto.add_rule( Head=edge )
+    canreach = RuleBasedPredicate('can-reach', tabled=True)
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.X, v.Y), ) )
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.Z, v.Y), canreach(v.X, v.Z) ) )
+    for engine in ('dict', 'trail'):
+      self.assertEquals( set([1, 2, 3]),
+                         self.answerSet([canreach(v.X, 1)], v.X, engine) )
+      self.assertEquals( set([1, 2, 3]),
+                         self.answerSet([canreach(v.X, 4)], v.X, engine) )
+      self.assertEquals( 12, len(list(fol_bc_ask([canreach(v.X, v.Y)], {},
+                                                 engine))) )
+  def testSameAnswers(self):
+    v = VariableFactory()
+    father = RuleBasedPredicate('father')
+    for pair in [('a', 'b'), ('b', 'c'), ('c', 'd'), ('a', 'e'), ('e', 'f')]:
+      father.add_rule( Head=pair )
+    for tabled in (False, True):
+      ancestor = RuleBasedPredicate('ancestor', tabled=tabled)
+      ancestor.add_rule( Head=( v.X, v.Y ),
+                        Body=( father(v.X, v.Y), ) )
+      ancestor.add_rule( Head=( v.X, v.Y ),
+                        Body=( father(v.Z, v.Y), ancestor(v.X, v.Z) ) )
+      self.assertEquals( set(['a', 'b', 'c']),
+                         self.answerSet([ancestor(v.X, 'd')], v.X) )
+      self.assertEquals( set(['a', 'e']),
+                         self.answerSet([ancestor(v.X, 'f')], v.X) )
+    # the table is recomputed once the facts change.
+    father.add_rule( Head=( 'f', 'g' ) )
+    self.assertEquals( set(['a', 'e', 'f']),
+                       self.answerSet([ancestor(v.X, 'g')], v.X) )
+
+  def testBoundFirstArgument(self):
+    v = VariableFactory()
+    linkedto = RuleBasedPredicate('linked-to')
+    for edge in [(1, 2), (2, 3), (3, 4)]:
+      linkedto.add_rule( Head=edge )
+    canreach = RuleBasedPredicate('can-reach', tabled=True)
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.X, v.Y), ) )
+    canreach.add_rule( Head=( v.X, v.Y ),
+                      Body=( linkedto(v.X, v.Z), canreach(v.Z, v.Y) ) )
+    for engine in ('dict', 'trail'):
+      self.assertEquals( set([2, 3, 4]),
+                         self.answerSet([canreach(1, v.Y)], v.Y, engine) )
+  def testMutableRules(self):
+    v = VariableFactory()
+    p = RuleBasedPredicate('p', tabled=True)
+    p.add_rule( Head=( 1, ) )
+    self.failIf( p._has_mutable_rules() )
+    rule = MutableRule(p, (v.X,), [p(v.X)])
+    p.rules.append(rule)
+    self.assert_( p._has_mutable_rules() )
+    p.rules.remove(rule)
+    self.failIf( p._has_mutable_rules() )
+    p.rules = [rule]
+    self.assert_( p._has_mutable_rules() )
+
+class DatalogTestCase(PrologTestCase):
+  def testMaterialize(self):
+    v = VariableFactory()
+    father = FactTablePredicate('father', facts=[('a', 'b'), ('b', 'c'), 
+                                                 ('c', 'd'), ('a', 'e')])
+    mother = RuleBasedPredicate('mother')
+    mother.add_rule( Head=( 'f', 'a' ) )
+    parent = RuleBasedPredicate('parent')
+    parent.add_rule( Head=( v.X, v.Y ), Body=( father(v.X, v.Y), ) )
+    parent.add_rule( Head=( v.X, v.Y ), Body=( mother(v.X, v.Y), ) )
+    ancestor = RuleBasedPredicate('ancestor')
+    ancestor.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Y), ) )
+    ancestor.add_rule( Head=( v.X, v.Y ), 
+                      Body=( ancestor(v.X, v.Z), ancestor(v.Z, v.Y) ) )
+    kb = KnowledgeBase()
+    kb.add_all([father, mother, parent, ancestor])
+    tables = materialize(kb)
+    self.assertEquals( set([parent, ancestor]), set(tables.keys()) )
+    self.assertEquals( 5, len(tables[parent]) )
+    self.assertEquals( 12, len(tables[ancestor]) )
+    # the left recursive rule would not terminate top-down.
+    table = tables[ancestor]
+    self.assertEquals( set(['a', 'b', 'c', 'd', 'e']), 
+                       set([answer[v.Y] for answer 
+                            in fol_bc_ask([table('f', v.Y)], {}, 'trail')]) )
+  def testCyclesAndBuiltins(self):
+    v = VariableFactory()
+    linkedto = RuleBasedPredicate('linked-to')
+    for edge in [(1, 2), (2, 3), (3, 1), (3, 4)]:
+      linkedto.add_rule( Head=edge )
+    canreach = RuleBasedPredicate('can-reach')
+    canreach.add_rule( Head=( v.X, v.Y ), Body=( linkedto(v.X, v.Y), ) )
+    canreach.add_rule( Head=( v.X, v.Y ), 
+                      Body=( linkedto(v.X, v.Z), canreach(v.Z, v.Y) ) )
+    cycle = RuleBasedPredicate('cycle')
+    cycle.add_rule( Head=( v.X, ), Body=( canreach(v.X, v.Y), eql(v.X, v.Y) ) )
+    tables = materialize(None, [canreach, cycle])
+    self.assertEquals( 12, len(tables[canreach]) )
+    self.assertEquals( [(1,), (2,), (3,)], sorted(tables[cycle]) )
+    cycle.add_rule( Head=( v.X, ), Body=( canreach(v.Y, v.Y), ) )
+    self.assertRaises( ValueError, materialize, None, [cycle] )
+
+  def testTopDownLiterals(self):
+    v = VariableFactory()
+    node = RuleBasedPredicate('node')
+    node.add_rule( Head=( 1, ) )
+    node.add_rule( Head=( 2, ) )
+    # a fact with a variable is not a Datalog relation, it is proved top-down
+    # with the node bound.
+    label = RuleBasedPredicate('label')
+    label.add_rule( Head=( 1, 'one' ) )
+    label.add_rule( Head=( 2, 'two' ) )
+    label.add_rule( Head=( v.X, 'any' ) )
+    named = RuleBasedPredicate('named')
+    named.add_rule( Head=( v.X, v.L ), Body=( node(v.X), label(v.X, v.L) ) )
+    tables = materialize(None, [named])
+    self.assertEquals( [(1, 'any'), (1, 'one'), (2, 'any'), (2, 'two')], 
+                       sorted(tables[named]) )
+
+class CompilerTestCase(PrologTestCase):
+  def answers(self, answers):
+    return sorted([sorted(answer.items()) for answer in answers])
+  def assertSameAnswers(self, predicate, people):
+    v = VariableFactory()
+    compiled = predicate.compile()
+    for x in [v.X] + people:
+      for y in [v.Y] + people:
+        self.assertEquals( 
+            self.answers(fol_bc_ask([predicate(x, y)], {}, 'trail')),
+            self.answers(compiled.ask(x, y)) )
+  def testSameAnswers(self):
+    v = VariableFactory()
+    parents = [('a', 'b'), ('b', 'c'), ('c', 'd'), ('a', 'e'), ('e', 'f')]
+    parent = FactTablePredicate('parent', facts=parents)
+    father = RuleBasedPredicate('father')
+    for pair in parents[:3]:
+      father.add_rule( Head=pair )
+    ancestor = RuleBasedPredicate('ancestor')
+    ancestor.add_rule( Head=( v.X, v.Y ), Body=( father(v.X, v.Y), ) )
+    ancestor.add_rule( Head=( v.X, v.Y ), 
+                      Body=( parent(v.X, v.Z), ancestor(v.Z, v.Y) ) )
+    sibling = RuleBasedPredicate('sibling')
+    sibling.add_rule( Head=( v.X, v.Y ), 
+                     Body=( parent(v.Z, v.X), parent(v.Z, v.Y) ) )
+    people = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+    self.assertSameAnswers(ancestor, people)
+    self.assertSameAnswers(sibling, people)
+    self.assert_( ancestor.compile().holds('a', 'd') )
+    # the functions are compiled again once the facts change.
+    compiled = ancestor.compile()
+    self.failIf( compiled.holds('a', 'g') )
+    father.add_rule( Head=( 'd', 'g' ) )
+    self.assert_( compiled.holds('a', 'g') )
+  def testCut(self):
+    v = VariableFactory()
+    parent = FactTablePredicate('parent', facts=[('a', 'b'), ('a', 'c'),
+                                                 ('b', 'd')])
+    child = RuleBasedPredicate('first-child')
+    child.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Y), cut ) )
+    child.add_rule( Head=( v.X, 'none' ), Body=( parent(v.X, v.Y), ) )
+    child.add_rule( Head=( 'd', 'none' ) )
+    self.assertSameAnswers(child, ['a', 'b', 'c', 'd', 'none'])
+    self.assertEquals( [{v.Y: 'b'}], list(child.compile().ask('a', v.Y)) )
+    self.assertEquals( [{v.Y: 'none'}], list(child.compile().ask('d', v.Y)) )
+  def testNotCompilable(self):
+    v = VariableFactory()
+    parent = FactTablePredicate('parent', facts=[('a', 'b')])
+    unsafe = RuleBasedPredicate('unsafe')
+    unsafe.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Z), ) )
+    self.assertRaises( ValueError, unsafe.compile )
+    compound = RuleBasedPredicate('compound')
+    compound.add_rule( Head=( v.X, ), Body=( parent(v.X, dot(v.Y, v.Z)), ) )
+    self.assertRaises( ValueError, compound.compile )
+
+class AskManyTestCase(PrologTestCase):
+  def holds(self, predicate, values, engine):
+    for answer in fol_bc_ask([predicate(*values)], {}, engine):
+      return answer != None
+    return False
+  def assertSameAnswers(self, predicate, tuples):
+    for engine in ['dict', 'trail']:
+      expected = [self.holds(predicate, values, engine) for values in tuples]
+      self.assertEquals( expected, ask_many(predicate, tuples, engine) )
+      self.assertEquals( expected, ask_many(predicate, tuples, engine, 2) )
+  def testDatalog(self):
+    v = VariableFactory()
+    parent = FactTablePredicate('parent', facts=[('a', 'b'), ('b', 'c'), 
+                                                 ('c', 'd'), ('a', 'e')])
+    ancestor = RuleBasedPredicate('ancestor')
+    ancestor.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Y), ) )
+    ancestor.add_rule( Head=( v.X, v.Y ), 
+                       Body=( parent(v.X, v.Z), ancestor(v.Z, v.Y) ) )
+    people = ['a', 'b', 'c', 'd', 'e']
+    tuples = [(x, y) for x in people for y in people]
+    tuples.extend([(v.X, 'a'), ('a', v.Y), (v.X, v.X), (v.X, v.Y)])
+    self.assertSameAnswers(ancestor, tuples)
+    self.assertSameAnswers(parent, tuples)
+  def testTopDown(self):
+    v = VariableFactory()
+    member = RuleBasedPredicate('member')
+    member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+    member.add_rule( Head=( v.X, dot(v.H, v.T) ),
+                    Body=( member(v.X, v.T), ) )
+    numbers = plist([1, 2, 3])
+    tuples = [(1, numbers), (4, numbers), (v.X, numbers), (1, numbers),
+              (v.X, plist([])), (3, dot(v.X, v.Y))]
+    self.assertSameAnswers(member, tuples)
+    self.assertSameAnswers(eql, [(1, 1), (1, 2), (v.X, 2), (v.X, v.X)])
+  def testInputModes(self):
+    from trimlogic.tabling import get_table
+    v = VariableFactory()
+    member = RuleBasedPredicate('member', modes=(OUTPUT, INPUT))
+    member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+    member.add_rule( Head=( v.X, dot(v.H, v.T) ),
+                    Body=( member(v.X, v.T), ) )
+    numbers = plist([1, 2, 3])
+    tuples = [(1, numbers), (4, numbers), (v.X, numbers), (3, numbers),
+              (v.X, plist([])), (3, dot(v.X, v.Y))]
+    self.assertSameAnswers(member, tuples)
+    # the tuples binding the list share the call which only binds it.
+    table = get_table(member, (v.Y, numbers), 'trail')
+    self.assertEquals( [(1,), (2,), (3,)], 
+                       sorted([answer[:1] for answer in table.answers]) )
+    self.assertEquals( None, get_table(member, (1, numbers), 'trail') )
+    self.assertNotEquals( None, get_table(member, (1, numbers), 'dict') )
+  def testClauseChanges(self):
+    import trimlogic.algorithm
+    v = VariableFactory()
+    parent = RuleBasedPredicate('parent')
+    parent.add_rule( Head=( 'a', 'b' ) )
+    ancestor = RuleBasedPredicate('ancestor')
+    ancestor.add_rule( Head=( v.X, v.Y ), Body=( parent(v.X, v.Y), ) )
+    ancestor.add_rule( Head=( v.X, v.Y ), 
+                       Body=( parent(v.X, v.Z), ancestor(v.Z, v.Y) ) )
+    tuples = [('a', 'b'), ('a', 'c'), ('b', 'c')]
+    self.assertEquals( [True, False, False], 
+                       ask_many(ancestor, tuples, 'trail') )
+    self.assert_( trimlogic.algorithm._relations.has_key(ancestor) )
+    self.assertSameAnswers(ancestor, tuples)
+    parent.add_rule( Head=( 'b', 'c' ) )
+    self.assertEquals( [True, True, True], 
+                       ask_many(ancestor, tuples, 'trail') )
+    self.assertSameAnswers(ancestor, tuples)
+    ancestor.rules = ancestor.rules[:1]
+    self.assertEquals( [True, False, True], 
+                       ask_many(ancestor, tuples, 'trail') )
+    self.assertSameAnswers(ancestor, tuples)
+
+class QueryLimitsTestCase(PrologTestCase):
+  def setUp(self):
+    v = VariableFactory()
+    self.loop = RuleBasedPredicate('loop')
+    self.loop.add_rule( Head=( v.X, ), Body=( self.loop(v.X), ) )
+    self.member = RuleBasedPredicate('member')
+    self.member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+    self.member.add_rule( Head=( v.X, dot(v.H, v.T) ),
+                         Body=( self.member(v.X, v.T), ) )
+  def exceeded(self, goal, limits, engine):
+    try:
+      for answer in fol_bc_ask([goal], {}, engine, limits):
+        pass
+    except QueryLimitExceeded, e:
+      return e
+    self.fail("%s did not exceed its limits." % goal)
+  def testLimits(self):
+    v = VariableFactory()
+    for engine in ['dict', 'trail']:
+      e = self.exceeded(self.loop(1), QueryLimits(depth=50), engine)
+      self.assertEquals( 'depth', e.limit )
+      self.assertEquals( 50, e.stats['depth'] )
+      e = self.exceeded(self.loop(1), QueryLimits(steps=20), engine)
+      self.assertEquals( 'steps', e.limit )
+      self.assertEquals( 20, e.stats['steps'] )
+      e = self.exceeded(self.loop(1), QueryLimits(seconds=0.01), engine)
+      self.assertEquals( 'seconds', e.limit )
+      e = self.exceeded(self.member(v.X, plist([1, 2, 3])), 
+                        QueryLimits(answers=2), engine)
+      self.assertEquals( 'answers', e.limit )
+      self.assertEquals( 2, e.stats['answers'] )
+      limits = QueryLimits(depth=10, steps=100, answers=3)
+      self.assertEquals( 3, len(list(fol_bc_ask(
+          [self.member(v.X, plist([1, 2, 3]))], {}, engine, limits))) )
+
+class StatsTestCase(PrologTestCase):
+  def tearDown(self):
+    stats.disable()
+  def testPredicateStats(self):
+    v = VariableFactory()
+    parent = FactTablePredicate('parent', facts=[('a', 'b'), ('b', 'c'), 
+                                                 ('a', 'd')])
+    grandparent = RuleBasedPredicate('grandparent')
+    grandparent.add_rule( Head=( v.X, v.Y ), 
+                          Body=( parent(v.X, v.Z), parent(v.Z, v.Y) ) )
+    for engine in ['dict', 'trail']:
+      collector = stats.enable()
+      answers = list(fol_bc_ask([grandparent('a', v.Y)], {}, engine))
+      self.assertEquals( [{v.Y: 'c'}], answers )
+      self.assertEquals( collector, stats.disable() )
+      summary = json.loads(collector.to_json())
+      self.assertEquals( {'calls': 1, 'unifications': 1, 'solutions': 1}, 
+                         dict([(key, value) for key, value 
+                               in summary['predicates']['grandparent'].items()
+                               if key != 'seconds']) )
+      self.assertEquals( 3, summary['predicates']['parent']['calls'] )
+      self.assertEquals( 3, summary['predicates']['parent']['solutions'] )
+    # nothing is counted once the collector is disabled.
+    list(fol_bc_ask([grandparent('a', v.Y)], {}))
+    self.assertEquals( 3, collector.as_dict()['predicates']['parent']['calls'] )
+
+class BenchmarkTestCase(PrologTestCase):
+  def testGenerators(self):
+    from trimlogic.benchmark import generators
+    father, mother, people = generators.family_tree(3)
+    self.assertEquals( 14, len(people) )
+    self.assertEquals( 6, len(father) )
+    self.assertEquals( 6, len(mother) )
+    dag = generators.random_dag(30, seed=1)
+    self.assertEquals( 30, len(set(dag)) )
+    self.assertEquals( dag, generators.random_dag(30, seed=1) )
+    self.assert_( [i < j for i, j in dag] == [True] * 30 )
+    cyclic = generators.cyclic_graph(30)
+    self.assert_( (0, 0) in generators.closure(cyclic) )
+    self.failIf( (0, 0) in generators.closure(dag) )
+    path = generators.path_predicate(generators.edge_table(cyclic))
+    v = VariableFactory()
+    self.assertEquals( 16, len(list(fol_bc_ask([path(0, v.Y)], {}, 'trail'))) )
+    relation = generators.closure(set(list(father) + list(mother)))
+    positive, negative = generators.noisy_examples(relation, people, 8, 8)
+    self.assert_( set(positive) <= relation )
+    self.failIf( set(negative) & relation )
+    positive, negative = generators.noisy_examples(relation, people, 8, 8, 
+                                                   0.25)
+    self.assertEquals( 2, len(set(positive) - relation) )
+    self.assertEquals( 2, len(set(negative) & relation) )
+  def testRunner(self):
+    import tempfile, os
+    from trimlogic.benchmark import runner
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+      runner.main(['--queries', '10', '--generations', '2', 
+                   '--output', path])
+      report = json.load(open(path))
+    finally:
+      os.remove(path)
+    benchmarks = [result['benchmark'] for result in report['results']]
+    self.assertEquals( ['dag_path', 'cyclic_path', 'dag_path_ask_many', 
+                        'member', 'append', 'reverse', 'foil_ancestor',
+                        'parallel_search'],
+                       benchmarks )
+    self.assert_( report['results'][-1]['same_literals'] )
+    self.assertEquals( 10, report['results'][3]['answers'] )
+    self.assert_( report['results'][-2]['complete'] )
+
+class TraceTestCase(PrologTestCase):
+  def setUp(self):
+    self.events = []
+    trace.subscribe(self.record)
+  def tearDown(self):
+    if self.record in trace._subscribers:
+      trace.unsubscribe(self.record)
+  def record(self, event, details):
+    self.events.append((event, details))
+  def testPorts(self):
+    v = VariableFactory()
+    parent = FactTablePredicate('parent', facts=[('a', 'b'), ('b', 'c'), 
+                                                 ('a', 'd')])
+    grandparent = RuleBasedPredicate('grandparent')
+    grandparent.add_rule( Head=( v.X, v.Y ), 
+                          Body=( parent(v.X, v.Z), parent(v.Z, v.Y) ) )
+    expected = [('call', 'grandparent', 1), ('call', 'parent', 2), 
+                ('exit', 'parent(a, b)', 2), ('call', 'parent', 4), 
+                ('exit', 'parent(b, c)', 4), ('exit', 'grandparent(a, c)', 1),
+                ('redo', 'parent', 4), ('fail', 'parent', 4),
+                ('redo', 'parent', 2), ('exit', 'parent(a, d)', 2),
+                ('call', 'parent', 4), ('fail', 'parent', 4),
+                ('redo', 'parent', 2), ('fail', 'parent', 2),
+                ('redo', 'grandparent', 1), ('fail', 'grandparent', 1)]
+    for engine in ['dict', 'trail']:
+      del self.events[:]
+      answers = list(fol_bc_ask([grandparent('a', v.Y)], {}, engine))
+      self.assertEquals( [{v.Y: 'c'}], answers )
+      ports = []
+      for event, details in self.events:
+        if event == trace.EXIT:
+          ports.append((event, str(details['goal']), details['depth']))
+        elif event in trace.PORTS:
+          ports.append((event, str(details['goal'].predicate), 
+                        details['depth']))
+      self.assertEquals( expected, ports )
+    # nothing is traced once the subscriber is detached.
+    trace.unsubscribe(self.record)
+    self.failIf( trace.enabled )
+    del self.events[:]
+    list(fol_bc_ask([grandparent('a', v.Y)], {}))
+    self.assertEquals( [], self.events )
+  def testLoggingSubscriber(self):
+    v = VariableFactory()
+    messages = []
+    class Handler(logging.Handler):
+      def emit(self, record):
+        messages.append(record.getMessage())
+    handler = Handler()
+    logger = logging.getLogger('trimlogic.algorithm')
+    old_level, old_propagate = logger.level, logger.propagate
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    subscriber = trace.log_events()
+    try:
+      list(fol_bc_ask([eql(v.X, 'a')], {}, 'trail'))
+    finally:
+      trace.unsubscribe(subscriber)
+      logger.removeHandler(handler)
+      logger.setLevel(old_level)
+      logger.propagate = old_propagate
+    self.assertEquals( "call eql(X, a) at depth 1", messages[0] )
+    self.assert_( "exit eql(a, a) at depth 1" in messages )
+
+class HashConsingTestCase(PrologTestCase):
+  def tearDown(self):
+    disable_hash_consing()
+  def testInterning(self):
+    v = VariableFactory()
+    f = RuleBasedPredicate('f')
+    factory = enable_hash_consing()
+    self.assert_( f('a', f('b')) is f('a', f('b')) )
+    self.assert_( plist([1, 2, 3]) is plist([1, 2, 3]) )
+    self.assert_( plist([1, 2, 3]).ground )
+    self.assertEquals( hash(f('a', 1)), hash(f('a', 1)) )
+    self.assertNotEquals( f('a'), f('b') )
+    term = f('a', plist([1, 2]))
+    self.assert_( term.apply_bindings({v.X: 'b'}) is term )
+    self.assertEquals( [], find_variables(term) )
+    # terms with variables are not interned, their instances are.
+    self.failIf( f(v.X).ground )
+    self.failIf( f(v.X) is f(v.X) )
+    self.assert_( f(v.X).apply_bindings({v.X: 'a'}) is f('a') )
+    self.failIf( f([1]).ground )
+    # an interned list still equals the same list made without interning.
+    self.assertEquals( plist([1, 2]), dot(1, dot(2, [])) )
+    self.assertEquals( plist([1, 2]), ListPred(dot, 1, ListPred(dot, 2, [])) )
+    self.assertEquals( hash(plist([1, 2])), 
+                       hash(ListPred(dot, 1, ListPred(dot, 2, []))) )
+    # equal constants of different types are different terms.
+    self.failIf( f(True) is f(1) )
+    self.assert_( f(True).terms[0] is True )
+    self.assert_( isinstance(f(1.0).terms[0], float) )
+    disable_hash_consing()
+    self.failIf( f('a') is f('a') )
+    self.assert_( factory.intern(f('a', plist([1, 2]))) is term )
+    self.failIf( factory.intern(f(v.X)).ground )
+  def testAnswers(self):
+    v = VariableFactory()
+    member = RuleBasedPredicate('member')
+    member.add_rule( Head=( v.X, dot(v.X, v.T) ) )
+    member.add_rule( Head=( v.X, dot(v.H, v.T) ), Body=( member(v.X, v.T), ) )
+    queries = [[append(v.X, v.Y, plist([1, 2, 3]))], 
+               [reverse(plist([1, 2, 3]), v.X)], 
+               [member(v.X, plist(['a', 'b']))]]
+    for engine in ['dict', 'trail']:
+      expected = [list(fol_bc_ask(goals, {}, engine)) for goals in queries]
+      enable_hash_consing()
+      interned = [list(fol_bc_ask(goals, {}, engine)) for goals in queries]
+      disable_hash_consing()
+      self.assertEquals( expected, interned )
+    # the answers share the interned terms of the query.
+    enable_hash_consing()
+    for answer in fol_bc_ask([append(v.X, v.Y, plist([1, 2, 3]))], {}, 
+                             'trail'):
+      self.assert_( answer[v.Y] is plist([1, 2, 3]) )
+      break
+
+class TupleListTestCase(PrologTestCase):
+  def testViews(self):
+    v = VariableFactory()
+    l = plist([1, 2, 3])
+    self.assert_( isinstance(l, TupleList) )
+    head, tail = l.terms
+    self.assertEquals( 1, head )
+    self.assert_( tail.items is l.items )
+    self.assertEquals( dot(1, dot(2, dot(3, []))), l )
+    self.assertEquals( l, dot(1, dot(2, dot(3, []))) )
+    self.assertEquals( plist([2, 3]), tail )
+    self.assertNotEquals( plist([1, 2]), l )
+    self.assertEquals( "plist([1, 2, 3])", str(l) )
+    self.assertEquals( "plist([1, |T])", str(plist([1], v.T)) )
+    self.assertEquals( ([1, 2, 3], v.T), 
+                       list_items(dot(1, plist([2, 3], v.T))) )
+    self.assert_( l.apply_bindings({v.X: 1}) is l )
+    self.assertEquals( plist([1, 2]), 
+                       plist([v.X, 2]).apply_bindings({v.X: 1}) )
+    self.assertEquals( [v.X], find_variables(plist([1, v.X])) )
+  def testUnification(self):
+    v = VariableFactory()
+    for engine in ['dict', 'trail']:
+      self.assertEquals( [{v.X: 1}], 
+                         list(fol_bc_ask([car(plist([1, 2]), v.X)], {}, 
+                                         engine)) )
+      self.assertEquals( [{v.X: plist([2])}], 
+                         list(fol_bc_ask([cdr(plist([1, 2]), v.X)], {}, 
+                                         engine)) )
+    self.assertEquals( [{v.X: 3, v.T: plist([4])}], 
+                       list(fol_bc_ask([eql(plist([1, 2, v.X], v.T), 
+                                            plist([1, 2, 3, 4]))], {}, 
+                                       'trail')) )
+  def testListPredicates(self):
+    v = VariableFactory()
+    for engine in ['dict', 'trail']:
+      self.assertEquals( [{v.X: plist([1, 2, 3])}], 
+                         list(fol_bc_ask([append(plist([1]), plist([2, 3]), 
+                                                 v.X)], {}, engine)) )
+      self.assertEquals( [{v.X: plist([1, 2, 3])}], 
+                         list(fol_bc_ask([append(dot(1, []), plist([2, 3]), 
+                                                 v.X)], {}, engine)) )
+      self.assertEquals( [{v.X: [], v.Y: plist([1, 2])}, 
+                          {v.X: plist([1]), v.Y: plist([2])},
+                          {v.X: plist([1, 2]), v.Y: []}],
+                         list(fol_bc_ask([append(v.X, v.Y, plist([1, 2]))], 
+                                         {}, engine)) )
+      self.assertEquals( [{v.X: plist([3, 2, 1])}], 
+                         list(fol_bc_ask([reverse(plist([1, 2, 3]), v.X)], 
+                                         {}, engine)) )
+      self.assertEquals( [{v.N: 3}], 
+                         list(fol_bc_ask([length(plist([1, 2, 3]), v.N)], 
+                                         {}, engine)) )
+    answers = list(fol_bc_ask([length(plist([1], v.T), 3)], {}, 'trail'))
+    self.assertEquals( 1, len(answers) )
+    self.assertEquals( 2, len(list_items(answers[0][v.T])[0]) )
+    answers = fol_bc_ask([length(v.L, v.N)], {}, 'trail')
+    self.assertEquals( [0, 1, 2], [answers.next()[v.N] for i in xrange(3)] )
+
+class ClauseTemplateTestCase(PrologTestCase):
+  def testInstantiate(self):
+    v = VariableFactory()
+    p, q, f = [RuleBasedPredicate(name) for name in ('p', 'q', 'f')]
+    p.add_rule( Head=( v.X, f(v.X, 'a'), f('b') ), 
+                Body=( q(v.X, v.Y), q(plist([1]), v.Y) ) )
+    rule = p.rules[0]
+    instance, other = rule.instantiate(), rule.instantiate()
+    self.assertEquals( 2, len(instance.variables) )
+    self.failIf( instance.variables & rule.variables )
+    self.failIf( instance.variables & other.variables )
+    X = instance.terms[0]
+    self.assert_( isinstance(X, FreshVar) )
+    self.assertEquals( X, instance.terms[1].terms[0] )
+    self.assertEquals( X, instance.body[0].terms[0] )
+    self.assertEquals( '@_%s_X' % X.number, str(X) )
+    self.assertEquals( X, FreshVar(X.number, 'X') )
+    self.assertNotEquals( X, v.X )
+    # the terms without variables are shared by the instances.
+    self.assert_( instance.terms[2] is other.terms[2] )
+    self.assert_( instance.body[1].terms[0] is rule.body[1].terms[0] )
+    rule = MutableRule(p, (v.X,), [q(v.X, v.X)])
+    self.assertEquals( 1, len(rule.instantiate().body) )
+    rule.body.append(q(v.X, 'a'))
+    instance = rule.instantiate()
+    self.assertEquals( 2, len(instance.body) )
+    self.assertEquals( instance.terms[0], instance.body[1].terms[0] )
+  def testAnswers(self):
+    v = VariableFactory()
+    p, f = RuleBasedPredicate('p'), RuleBasedPredicate('f')
+    p.add_rule( Head=( f(v.Y, 1), ) )
+    for engine in ['dict', 'trail']:
+      answers = list(fol_bc_ask([p(f(v.A, v.B))], {}, engine))
+      self.assertEquals( 1, len(answers) )
+      self.assertEquals( 1, answers[0][v.B] )
+      self.assert_( str(answers[0][v.A]).startswith('@_') )
+
 class ListTestCase(PrologTestCase):
   def testBasicPredicates(self):
     v = VariableFactory()
@@ -0,0 +1,496 @@
+import unittest
+from trimlogic.test.helper import FoilTestCase
+from trimlogic.predicate import RuleBasedPredicate, MutableRule
+from trimlogic.facttable import FactTablePredicate
+from trimlogic.foil import TrainingSet, find_gainful_and_determinate_literals
+from trimlogic.foil import bounded_probe, cached_probe, LiteralSet
+from trimlogic.foil import gen_variablization_space, variablization
+from trimlogic.foil import is_type_compatible, LiteralBeam, Budget, foil
+from trimlogic.foil import RuleCoverage, predicate_rules_postprocessing_compact
+from trimlogic.foil import has_independent_coverage, extend_clause
+from trimlogic.predicate import INPUT, OUTPUT
+from trimlogic.term import Term, Atom
+from trimlogic.stdlib import dot, eql, neg
+from trimlogic.term import VariableFactory, UniqueVariableFactory
+from trimlogic.algorithm import QueryLimits, fol_bc_ask
+from trimlogic import stats, trace
+
+
+class Person(Atom):
+  pass
+
+
+class City(Atom):
+  pass
+
+
+class TrainingSetTestCase(FoilTestCase):
+
+  def setUp(self):
+    self.v = VariableFactory()
+    self.parents = [('frank', 'abe'), ('frank', 'alan'), ('alan', 'sean'),
+                    ('sean', 'jane'), ('george', 'bob'), ('george', 'tim'),
+                    ('bob', 'jan'), ('tim', 'tom')]
+    self.positive = [('frank', 'sean'), ('alan', 'jane'), ('george', 'jan'),
+                     ('george', 'tom')]
+    self.negative = [('frank', 'abe'), ('abe', 'frank'), ('tom', 'george'),
+                     ('sean', 'alan'), ('jane', 'jan')]
+    self.grandparent = RuleBasedPredicate('grandparent')
+
+  def createTrainingSet(self):
+    v = self.v
+    # the trail engine is used as it answers partially bound calls to rules.
+    return TrainingSet(self.grandparent, [v.X, v.Y], map(list, self.positive),
+                       map(list, self.negative), engine='trail')
+
+  def extendBoth(self, goals, variables, rules, table):
+    """
+    Extends the training sets of rules and table with the goals, the goals
+    being given for the parent predicate.
+    """
+    rule_goals = [goal(rules) for goal in goals]
+    table_goals = [goal(table) for goal in goals]
+    return ((rules.training_set.extend(rule_goals, variables),
+             table.training_set.extend(table_goals, variables)))
+
+  def testJoinExtension(self):
+    v = self.v
+    rules = RuleBasedPredicate('parent')
+    for pair in self.parents:
+      rules.add_rule( Head=pair )
+    table = FactTablePredicate('parent', facts=self.parents)
+    rules.training_set = self.createTrainingSet()
+    table.training_set = self.createTrainingSet()
+    steps = [ ([lambda p: p(v.X, v.Z)], [v.Z]),
+              ([lambda p: p(v.X, v.Z), lambda p: p(v.Z, v.Y)], []),
+              ([lambda p: p(v.X, v.Z), lambda p: p(v.Z, v.Y),
+                lambda p: p(v.W, v.Y)], [v.W]) ]
+    for goals, variables in steps:
+      counts = self.extendBoth(goals, variables, rules, table)
+      self.assertEquals( counts[0], counts[1] )
+      for name in ('positive_examples', 'negative_examples'):
+        rule_examples = getattr(rules.training_set, name)
+        table_examples = getattr(table.training_set, name)
+        self.assertEquals( len(rule_examples), len(table_examples) )
+        self.assertEquals( list(rule_examples), list(table_examples) )
+    self.assertEquals( 4, len(table.training_set.positive_examples) )
+    self.assertEquals( 0, len(table.training_set.negative_examples) )
+    table.training_set.rollback()
+    table.training_set.rollback()
+    self.assertEquals( 7, len(table.training_set.positive_examples) )
+
+  def testProbe(self):
+    v = self.v
+    rules = RuleBasedPredicate('parent')
+    for pair in self.parents:
+      rules.add_rule( Head=pair )
+    table = FactTablePredicate('parent', facts=self.parents)
+    for parent in (rules, table):
+      training_set = self.createTrainingSet()
+      for goals, variables, determinate in [ ([parent(v.X, v.Z)], [v.Z], False),
+                                             ([parent(v.Z, v.Y)], [v.Z], True),
+                                             ([parent(v.X, v.Y)], [], False) ]:
+        probe = training_set.probe(goals, variables)
+        self.assertEquals( 9, len(training_set.positive_examples)
+                               + len(training_set.negative_examples) )
+        s_pos, s_neg = training_set.extend(goals, variables)
+        self.assertEquals( (s_pos, s_neg,
+                            len(training_set.positive_examples),
+                            len(training_set.negative_examples),
+                            determinate), probe )
+        training_set.rollback()
+
+  def testBoundedProbe(self):
+    v = self.v
+    parent = FactTablePredicate('parent', facts=self.parents)
+    training_set = self.createTrainingSet()
+    goals = [parent(v.X, v.Z)]
+    self.assertEquals( (training_set.probe(goals, [v.Z]), True),
+                       bounded_probe(training_set, goals, [v.Z]) )
+    self.assertEquals( (None, True),
+                       bounded_probe(training_set, goals, [v.Z], 100.0) )
+    # no positive example is extended, whatever the threshold.
+    self.assertEquals( (None, False),
+                       bounded_probe(training_set, [parent(v.Y, v.X)], []) )
+    # a literal which completes the clause is never given up.
+    goals = [parent(v.X, v.Z), parent(v.Z, v.Y)]
+    self.assertEquals( (training_set.probe(goals, [v.Z]), True),
+                       bounded_probe(training_set, goals, [v.Z], 100.0) )
+
+  def testLiteralCache(self):
+    v = self.v
+    parent = FactTablePredicate('parent', facts=self.parents)
+    training_set = self.createTrainingSet()
+    cache = training_set.literal_cache
+    probe = cached_probe(training_set, [parent(v.X, v.Z)], [v.Z])
+    self.assertEquals( (0, 1), (cache.hits, cache.misses) )
+    # the same literal with its new variable renamed.
+    self.assertEquals( probe, 
+                       cached_probe(training_set, [parent(v.X, v.W)], [v.W]) )
+    self.assertEquals( (1, 1), (cache.hits, cache.misses) )
+    cached_probe(training_set, [parent(v.Z, v.X)], [v.Z])
+    self.assertEquals( (1, 2), (cache.hits, cache.misses) )
+    # a literal given up on is probed again with a lower threshold.
+    goals, variables = [parent(v.W, v.Z)], [v.W, v.Z]
+    self.assertEquals( (None, True), 
+                       cached_probe(training_set, goals, variables, 100.0) )
+    cached_probe(training_set, goals, variables, 200.0)
+    self.assertEquals( (2, 3), (cache.hits, cache.misses) )
+    self.assertEquals( training_set.probe(goals, variables),
+                       cached_probe(training_set, goals, variables)[0] )
+    self.assertEquals( (2, 4), (cache.hits, cache.misses) )
+    # pruning covered examples invalidates the cache.
+    self.grandparent.add_rule( Head=('frank', 'sean') )
+    training_set.positive_examples.prune_covered()
+    self.assertEquals( 3, len(training_set.positive_examples) )
+    cached_probe(training_set, [parent(v.X, v.Z)], [v.Z])
+    self.assertEquals( (2, 5, 1), 
+                       (cache.hits, cache.misses, cache.invalidations) )
+    self.assertEquals( 1, len(cache) )
+
+  def testVariablizationDuplicates(self):
+    v = self.v
+    table = FactTablePredicate('table', facts=[(1, 2, 3)])
+    variables = [v.X, v.Y]
+    for var in variables: var.depth = 0
+    seen = LiteralSet()
+    literals = list(gen_variablization_space(table, lambda l, n: True, 
+                                             variables, 
+                                             UniqueVariableFactory(), 
+                                             seen=seen))
+    # each argument is X, Y or a new variable, but not all are new.
+    self.assertEquals( 26, len(literals) )
+    self.assertEquals( 26, len(seen) )
+    self.assertEquals( 26, len(set([str(l) for l, n in literals])) )
+    self.assert_( seen.duplicates > 0 )
+    seen = LiteralSet()
+    literals = list(variablization(table, variables, UniqueVariableFactory(),
+                                   seen))
+    self.assertEquals( 12, len(literals) )
+    self.assertEquals( 6, seen.duplicates )
+
+  def testTypedVariablization(self):
+    v = self.v
+    variables = [v.X, v.Y]
+    # the factory makes a new variable each time.
+    variables[0].type, variables[1].type = Person, City
+    for var in variables: var.depth = 0
+    def literals(predicate):
+      return sorted([(str(literal), [var.type for var in new_variables])
+                     for literal, new_variables in 
+                     gen_variablization_space(predicate, lambda l, n: True,
+                                              variables, 
+                                              UniqueVariableFactory())])
+    lives_in = FactTablePredicate('lives_in', (Person, City))
+    self.assertEquals( [('lives_in(VAR_0, Y)', [Person]), 
+                        ('lives_in(X, VAR_1)', [City]), 
+                        ('lives_in(X, Y)', [])], 
+                       literals(lives_in) )
+    lives_in = FactTablePredicate('lives_in', (Person, City), 
+                                  modes=(INPUT, OUTPUT))
+    self.assertEquals( [('lives_in(X, VAR_1)', [City]), 
+                        ('lives_in(X, Y)', [])], 
+                       literals(lives_in) )
+    self.assertEquals( [('knows(X, VAR_1)', [Person]),
+                        ('knows(X, X)', [])],
+                       literals(FactTablePredicate('knows', (Person, Person),
+                                                   modes=(INPUT, OUTPUT))) )
+    self.assertRaises( ValueError, FactTablePredicate, 'knows', 
+                       (Person, Person), None, (INPUT,) )
+    self.assert_( is_type_compatible(Term, dot) )
+    self.assert_( is_type_compatible(Atom, Person) )
+    self.assert_( is_type_compatible(None, Person) )
+    self.failIf( is_type_compatible(City, Person) )
+    self.failIf( is_type_compatible(City, dot) )
+
+  def testLiteralBeam(self):
+    beam = LiteralBeam(2)
+    self.assertEquals( None, beam.get_threshold() )
+    beam.add(1.0, 'a', [])
+    beam.add(3.0, 'b', [])
+    self.assertEquals( 1.0, beam.get_threshold() )
+    # of literals with the same gain the first one is kept.
+    beam.add(3.0, 'c', [])
+    beam.add(1.0, 'd', [])
+    self.assertEquals( [(3.0, 'b', []), (3.0, 'c', [])], beam.get_literals() )
+    self.assertEquals( 3.0, beam.get_threshold() )
+
+  def testBudget(self):
+    parent = FactTablePredicate('parent', (str, str), facts=self.parents)
+    grandparent = RuleBasedPredicate('grandparent', (str, str))
+    self.failIf( foil(grandparent, self.positive, self.negative, [parent],
+                      engine='trail', budget=Budget(steps=1)) )
+    self.assertEquals( 0, len(grandparent.rules) )
+    self.failIf( foil(grandparent, self.positive, self.negative, [parent],
+                      engine='trail', budget=Budget(seconds=0)) )
+    self.assertEquals( 0, len(grandparent.rules) )
+    self.assert_( foil(grandparent, self.positive, self.negative, [parent],
+                       engine='trail', beam_width=2, 
+                       budget=Budget(seconds=60)) )
+    self.assertEquals( 1, len(grandparent.rules) )
+    self.assertAllFollow( grandparent, self.positive )
+
+  def testQueryLimits(self):
+    v = self.v
+    parent = FactTablePredicate('parent', (str, str), facts=self.parents)
+    # a background predicate which never answers a call.
+    spin = RuleBasedPredicate('spin', (str, str))
+    spin.add_rule( Head=(v.X, v.Y), Body=(spin(v.Y, v.X),) )
+    grandparent = RuleBasedPredicate('grandparent', (str, str))
+    self.assert_( foil(grandparent, self.positive, self.negative, 
+                       [spin, parent], engine='trail', 
+                       limits=QueryLimits(steps=100)) )
+    self.assertEquals( 1, len(grandparent.rules) )
+    self.assertAllFollow( grandparent, self.positive )
+    # an extension exceeding the limits leaves the training set as it was.
+    stuck = RuleBasedPredicate('stuck', (str, str))
+    stuck.add_rule( Head=(v.X, v.Y), Body=(parent(v.X, v.Y),) )
+    stuck.add_rule( Head=('tom', v.Y), Body=(spin('tom', v.Y),) )
+    training_set = TrainingSet(self.grandparent, [v.X, v.Y], 
+                               map(list, self.positive), 
+                               map(list, self.negative), engine='trail',
+                               limits=QueryLimits(steps=100))
+    body = []
+    self.failIf( extend_clause(training_set, body, stuck(v.X, v.Z), [v.Z]) )
+    self.assertEquals( [], body )
+    self.assertEquals( (4, 5), (len(training_set.positive_examples), 
+                                len(training_set.negative_examples)) )
+    self.assertEquals( [[v.X, v.Y]], training_set._variables )
+    self.assert_( extend_clause(training_set, body, parent(v.X, v.Z), [v.Z]) )
+    # an example whose proof exceeds the limits is not covered.
+    self.grandparent.add_rule( Head=(v.X, v.Y), Body=(spin(v.X, v.Y),) )
+    examples = training_set.positive_examples
+    examples.prune_covered(self.grandparent.rules[-1])
+    self.assertEquals( 0, examples.version )
+
+  def testStats(self):
+    parent = FactTablePredicate('parent', (str, str), facts=self.parents)
+    grandparent = RuleBasedPredicate('grandparent', (str, str))
+    collector = stats.enable()
+    try:
+      foil(grandparent, self.positive, self.negative, [parent], 
+           engine='trail')
+    finally:
+      stats.disable()
+    summary = collector.as_dict()
+    counters = summary['foil']
+    self.assert_( counters['literals_generated'] > 0 )
+    self.assertEquals( counters['literals_generated'], 
+                       counters['literals_scored'] 
+                       + counters.get('literals_pruned', 0) )
+    self.assertEquals( [str(grandparent.rules[0])], 
+                       [entry['clause'] for entry in summary['clauses']] )
+    for phase in ['foil_main', 'prune_covered', 'postprocessing']:
+      self.assert_( summary['timings'].has_key(phase) )
+    self.assert_( summary['extensions'].has_key('1') )
+    self.assert_( summary['predicates']['parent']['calls'] > 0 )
+
+  def testTrace(self):
+    parent = FactTablePredicate('parent', (str, str), facts=self.parents)
+    grandparent = RuleBasedPredicate('grandparent', (str, str))
+    events = []
+    def record(event, details):
+      events.append((event, details))
+    trace.subscribe(record)
+    try:
+      foil(grandparent, self.positive, self.negative, [parent], 
+           engine='trail')
+    finally:
+      trace.unsubscribe(record)
+    names = set([event for event, details in events])
+    for name in [trace.CALL, trace.EXIT, trace.EXTEND, trace.LITERAL_SCORED,
+                 trace.LITERAL_CHOSEN, trace.EXAMPLE_PRUNED]:
+      self.assert_( name in names )
+    learned = [details['rule'] for event, details in events
+               if event == trace.CLAUSE_LEARNED]
+    self.assertEquals( grandparent.rules, learned )
+
+  def testCompaction(self):
+    v = self.v
+    parent = FactTablePredicate('parent', facts=self.parents)
+    grandparent = self.grandparent
+    grandparent.add_rule( Head=(v.X, v.Y), 
+                          Body=(parent(v.X, v.Z), parent(v.Z, v.Y),
+                                parent(v.X, v.W)) )
+    grandparent.add_rule( Head=(v.X, v.Y), 
+                          Body=(parent(v.X, v.Z), parent(v.Z, v.Y)) )
+    coverage = RuleCoverage(grandparent, self.positive, self.negative)
+    first, second = grandparent.rules
+    self.assertEquals( (15, 0), coverage.get([first]) )
+    self.assertEquals( (15, 0), coverage.get([first, second]) )
+    self.assertEquals( (0, 0), coverage.get([]) )
+    predicate_rules_postprocessing_compact(grandparent, self.positive, 
+                                           self.negative)
+    self.assertEquals( 1, len(grandparent.rules) )
+    self.assertEquals( 2, len(grandparent.rules[0].body) )
+    self.assertAllFollow( grandparent, self.positive )
+
+  def testIndependentCoverage(self):
+    v = self.v
+    parent = FactTablePredicate('parent', facts=self.parents)
+    grandparent = self.grandparent
+    grandparent.add_rule( Head=(v.X, v.Y), 
+                          Body=(parent(v.X, v.Z), parent(v.Z, v.Y)) )
+    self.assert_( has_independent_coverage(grandparent.rules[-1]) )
+    # the predicate called through another predicate.
+    helper = RuleBasedPredicate('helper')
+    helper.add_rule( Head=(v.X, v.Y), Body=(grandparent(v.X, v.Y),) )
+    grandparent.add_rule( Head=(v.X, v.Y), 
+                          Body=(parent(v.X, v.Z), helper(v.Z, v.Y)) )
+    self.failIf( has_independent_coverage(grandparent.rules[-1]) )
+    # negation as failure is not monotone.
+    grandparent.add_rule( Head=(v.X, v.Y), 
+                          Body=(parent(v.X, v.Z), neg(parent(v.Z, v.Y))) )
+    self.failIf( has_independent_coverage(grandparent.rules[-1]) )
+
+  def testPruneCovered(self):
+    v = self.v
+    parent = FactTablePredicate('parent', facts=self.parents)
+    training_set = self.createTrainingSet()
+    examples = training_set.positive_examples
+    # a rule covering one example, proved for each example.
+    self.grandparent.add_rule( Head=('george', v.Y), 
+                               Body=(parent('george', v.Z), 
+                                     parent(v.Z, v.Y), eql(v.Y, 'jan')) )
+    examples.prune_covered(self.grandparent.rules[-1])
+    self.assertEquals( 3, len(examples) )
+    self.assertEquals( 1, examples.version )
+    # a join of fact tables, evaluated bottom-up.
+    self.grandparent.add_rule( Head=(v.X, v.Y), 
+                               Body=(parent(v.X, v.Z), parent(v.Z, v.Y)) )
+    examples.prune_covered(self.grandparent.rules[-1])
+    self.assertEquals( 0, len(examples) )
+    self.assertEquals( 2, examples.version )
+    ancestor = RuleBasedPredicate('ancestor')
+    training_set = TrainingSet(ancestor, [v.X, v.Y], 
+                               [['frank', 'jane'], ['frank', 'abe'],
+                                ['bob', 'jan'], ['george', 'jan']], [],
+                               engine='trail')
+    examples = training_set.positive_examples
+    ancestor.add_rule( Head=(v.X, v.Y), Body=(parent(v.X, v.Y),) )
+    examples.prune_covered(ancestor.rules[-1])
+    self.assertEquals( [['frank', 'jane'], ['george', 'jan']], 
+                       [ex.root.values for ex in examples._examples] )
+    # a recursive rule, the predicate being evaluated bottom-up.
+    ancestor.add_rule( Head=(v.X, v.Y), 
+                       Body=(parent(v.X, v.Z), ancestor(v.Z, v.Y)) )
+    examples.prune_covered(ancestor.rules[-1])
+    self.assertEquals( 0, len(examples) )
+    self.assertEquals( 2, examples.version )
+
+  def testPruneCoveredEngines(self):
+    v = self.v
+    edge = RuleBasedPredicate('edge')
+    for pair in [('a', 'b'), ('b', 'c'), ('c', 'd')]:
+      edge.add_rule( Head=pair )
+    examples = [['a', 'b'], ['a', 'c'], ['a', 'd'], ['b', 'd']]
+    # the dict engine proves no call binding only some arguments, so only the
+    # examples it proves are pruned, though bottom-up evaluation covers all.
+    for engine, left in [('dict', examples[1:]), ('trail', [])]:
+      path = RuleBasedPredicate('path')
+      path.add_rule( Head=(v.X, v.Y), Body=(edge(v.X, v.Y),) )
+      path.add_rule( Head=(v.X, v.Y), Body=(edge(v.X, v.Z), path(v.Z, v.Y)) )
+      training_set = TrainingSet(path, [v.X, v.Y], examples, [], 
+                                 engine=engine)
+      collection = training_set.positive_examples
+      collection.prune_covered(path.rules[-1])
+      self.assertEquals( left, [ex.root.values for ex in collection._examples] )
+      two = RuleBasedPredicate('two')
+      two.add_rule( Head=(v.X, v.Y), Body=(edge(v.X, v.Z), edge(v.Z, v.Y)) )
+      training_set = TrainingSet(two, [v.X, v.Y], examples, [], 
+                                 engine=engine)
+      collection = training_set.positive_examples
+      collection.prune_covered(two.rules[-1])
+      expected = [ex for ex in examples 
+                  if not list(fol_bc_ask([two(*ex)], {}, engine))]
+      self.assertEquals( expected, 
+                         [ex.root.values for ex in collection._examples] )
+
+  def testParallelSearch(self):
+    v = self.v
+    parent = RuleBasedPredicate('parent')
+    for pair in self.parents:
+      parent.add_rule( Head=pair )
+    grandparent = self.grandparent
+    rule = MutableRule(grandparent, (v.X, v.Y), [])
+    grandparent.rules.append(rule)
+    results = []
+    for processes in (None, 2):
+      training_set = self.createTrainingSet()
+      new_literals, determinate_literals = (
+          find_gainful_and_determinate_literals(grandparent, rule, 
+                                                training_set, [parent], 
+                                                UniqueVariableFactory(),
+                                                grab_size=3,
+                                                processes=processes))
+      results.append(([(gain, str(literal), map(str, new_variables)) 
+                       for gain, literal, new_variables in new_literals],
+                      [(str(literal), map(str, new_variables))
+                       for literal, new_variables in determinate_literals]))
+      self.assertEquals( [], rule.body )
+    self.assertEquals( 3, len(results[0][0]) )
+    self.assertEquals( results[0], results[1] )
+
+  def testParallelProbesAreBatched(self):
+    from trimlogic.foil import ProbePool, probe_literals_parallel
+    from trimlogic.foil import probe_literals, PROBE_BATCH_SIZE
+    v = self.v
+    parent = RuleBasedPredicate('parent')
+    for pair in self.parents:
+      parent.add_rule( Head=pair )
+    grandparent = self.grandparent
+    rule = MutableRule(grandparent, (v.X, v.Y), [])
+    grandparent.rules.append(rule)
+    candidates = []
+    for x in (v.X, v.Y, v.Z, v.W):
+      for y in (v.X, v.Y, v.Z, v.W):
+        new_variables = [var for var in [v.Z, v.W] if var in (x, y)]
+        candidates.append((parent(x, y), new_variables))
+    expected = list(probe_literals(self.createTrainingSet(), rule.body, 
+                                   candidates))
+    pulled = []
+    def generate():
+      for candidate in candidates:
+        pulled.append(candidate)
+        yield candidate
+    pool = ProbePool(2, [parent, grandparent])
+    try:
+      probes = probe_literals_parallel(pool, self.createTrainingSet(), 
+                                       grandparent, rule, generate())
+      results = [probes.next()]
+      # the candidates after the first batch are generated once its results
+      # have been consumed.
+      self.assertEquals( 2 * PROBE_BATCH_SIZE, len(pulled) )
+      results.extend(probes)
+    finally:
+      pool.close()
+    self.assertEquals( expected, results )
+    self.assertEquals( [], rule.body )
+
+  def testParallelFoil(self):
+    import multiprocessing
+    created = []
+    Pool = multiprocessing.Pool
+    def create_pool(*args):
+      created.append(args)
+      return Pool(*args)
+    learned = []
+    for processes in (None, 2):
+      parent = RuleBasedPredicate('parent')
+      for pair in self.parents:
+        parent.add_rule( Head=pair )
+      grandparent = RuleBasedPredicate('grandparent', (str, str))
+      multiprocessing.Pool = create_pool
+      try:
+        foil(grandparent, self.positive, self.negative, 
+             [parent, grandparent], engine='trail', processes=processes)
+      finally:
+        multiprocessing.Pool = Pool
+      learned.append(map(str, grandparent.rules))
+    self.assertEquals( learned[0], learned[1] )
+    # a single pool searches for every literal of the run.
+    self.assertEquals( [(2,)], created )
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from trimlogic.algorithm import fol_bc_ask
+from trimlogic.algorithm import fol_bc_ask, ask_many
 
 PRINT_RULES = True
 
@@ -25,6 +25,12 @@ class FoilTestCase(unittest.TestCase):
     else:
       self.fail()
       
+  def assertAllFollow(self, predicate, tuples, msg=None):
+    covered = ask_many(predicate, tuples)
+    for i in xrange(len(tuples)):
+      if not covered[i]:
+        self.fail(msg or "%s does not follow." % predicate(*tuples[i]))
+      
   def assertNotFollows(self, arg0, arg1=None):
     msg, term = None, None
     if isinstance(arg0, str):
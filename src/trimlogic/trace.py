@@ -0,0 +1,200 @@
+"""
+Structured tracing of the resolution engines and the FOIL search.
+
+Subscribers are callables taking the name of an event and a dict of its
+details. Nothing is traced unless a subscriber is attached, the code being
+traced only testing the module's enabled flag, so no message or detail is
+built while tracing is off.
+
+The engines report the four ports of the box model of every call: CALL when
+a goal is called, EXIT when it succeeds, REDO when it is backtracked into for
+another solution and FAIL when it has none left. The details of a port are
+the goal, instantiated as far as it is when the port is passed, and the depth
+of the call, counted like the depth of QueryLimits. A call discarded by a cut
+passes no further port. The unifications and the clauses a call is resolved
+with are reported too, and FOIL reports the extensions of the examples, the
+candidate literals it scores, gives up and chooses, the clauses it learns and
+the examples it prunes.
+
+The EXIT port is passed by a goal added after the body of every clause a call
+resolves with, so while tracing the query limits also count those goals as
+resolution steps.
+
+The debug log output of the engines and of FOIL is a LoggingSubscriber, which
+log_events attaches.
+"""
+import logging
+from trimlogic.term import Pred
+
+# True while any subscriber is attached.
+enabled = False
+
+_subscribers = []
+
+# the ports of a call.
+CALL = 'call'
+EXIT = 'exit'
+REDO = 'redo'
+FAIL = 'fail'
+PORTS = (CALL, EXIT, REDO, FAIL)
+
+# the resolution events.
+UNIFY = 'unify'
+CLAUSE = 'clause'
+
+# the FOIL search events.
+EXTEND = 'extend'
+BINDINGS = 'bindings'
+LITERAL_SCORED = 'literal_scored'
+LITERAL_PRUNED = 'literal_pruned'
+LITERAL_CHOSEN = 'literal_chosen'
+LITERAL_REJECTED = 'literal_rejected'
+CLAUSE_LEARNED = 'clause_learned'
+EXAMPLE_PRUNED = 'example_pruned'
+
+def subscribe(subscriber):
+  """
+  Attaches a subscriber, which is called with the name and the details of
+  every event from then on, and returns it.
+  """
+  global enabled
+  _subscribers.append(subscriber)
+  enabled = True
+  return subscriber
+
+def unsubscribe(subscriber):
+  """
+  Detaches a subscriber attached by subscribe.
+
+  @raise ValueError: If the subscriber is not attached.
+  """
+  global enabled
+  _subscribers.remove(subscriber)
+  enabled = len(_subscribers) > 0
+
+def emit(event, **details):
+  """
+  Passes an event to every subscriber. Callers test enabled first, so that
+  the details are only built while tracing.
+  """
+  for subscriber in list(_subscribers):
+    subscriber(event, details)
+
+def log_events(level=logging.DEBUG):
+  """
+  Attaches a LoggingSubscriber logging at level and returns it.
+  """
+  return subscribe(LoggingSubscriber(level))
+
+def observe_bodies(goal, depth, bodies):
+  """
+  Returns the alternatives of a call to goal at depth, the bodies of the
+  clauses it resolves with, passing the ports of the call as they are taken.
+  """
+  if _is_exit(goal.predicate):
+    return bodies
+  exit = _Exit(goal.predicate, depth)(*goal.terms)
+  return _ports(goal, depth, bodies, lambda body: tuple(body) + (exit,))
+
+def observe_resolvents(goal, depth, resolvents):
+  """
+  Like observe_bodies for the (unifier, body, variables) resolvents generated
+  by the _resolve of the goal's predicate.
+  """
+  if _is_exit(goal.predicate):
+    return resolvents
+  exit = _Exit(goal.predicate, depth)(*goal.terms)
+  def add_exit(resolvent):
+    mgu, body, variables = resolvent
+    return (mgu, list(body) + [exit], variables)
+  return _ports(goal, depth, resolvents, add_exit)
+
+def _is_exit(predicate):
+  # the goals counting solutions for the stats collector are not traced
+  # either.
+  from trimlogic.stats import _Exit as _StatsExit
+  return isinstance(predicate, (_Exit, _StatsExit))
+
+def _ports(goal, depth, alternatives, add_exit):
+  emit(CALL, goal=goal, depth=depth)
+  for alternative in alternatives:
+    yield add_exit(alternative)
+    emit(REDO, goal=goal, depth=depth)
+  emit(FAIL, goal=goal, depth=depth)
+
+
+class _Exit:
+  """
+  The predicate of the goal following the body of a clause, which passes the
+  EXIT port of the call that resolved with the clause. Its arguments are
+  those of the call.
+  """
+
+  def __init__(self, predicate, depth):
+    self.name = "exit(%s)" % predicate
+    self.predicate = predicate
+    self.depth = depth
+
+  def _resolve(self, terms):
+    if enabled:
+      emit(EXIT, goal=self.predicate(*terms), depth=self.depth)
+    yield ({}, [], set())
+
+  def __call__(self, *terms):
+    return Pred(self, *terms)
+
+  def __str__(self):
+    return self.name
+
+
+class LoggingSubscriber:
+  """
+  Logs every event as a message, those of the engines to the logger of
+  trimlogic.algorithm and those of FOIL to the logger of trimlogic.foil.
+  Messages are only formatted if their logger is enabled for the level.
+  """
+
+  MESSAGES = {
+    CALL: ('trimlogic.algorithm', "call %(goal)s at depth %(depth)s"),
+    EXIT: ('trimlogic.algorithm', "exit %(goal)s at depth %(depth)s"),
+    REDO: ('trimlogic.algorithm', "redo %(goal)s at depth %(depth)s"),
+    FAIL: ('trimlogic.algorithm', "fail %(goal)s at depth %(depth)s"),
+    UNIFY: ('trimlogic.algorithm', "unify(%(left)s, %(right)s, %(bindings)s)"),
+    CLAUSE: ('trimlogic.algorithm',
+             "%(predicate)s._resolve( %(terms)s ) considering rule "
+             "%(rule)s, substitutions: %(unifier)s"),
+    EXTEND: ('trimlogic.foil',
+             "extend( %(goals)s, %(variables)s ) performed %(extensions)s "
+             "extensions."),
+    BINDINGS: ('trimlogic.foil',
+               "enumerate_nodes_bindings( %(level)s, %(node)s ) bindings "
+               "'%(bindings)s'."),
+    LITERAL_SCORED: ('trimlogic.foil',
+                     "Considering literal '%(literal)s' with gain of "
+                     "%(gain)s which yields %(positives)s positive and "
+                     "%(negatives)s negative extensions."),
+    LITERAL_PRUNED: ('trimlogic.foil',
+                     "Gave up on literal '%(literal)s': %(reason)s."),
+    LITERAL_CHOSEN: ('trimlogic.foil',
+                     "Trying solution: %(literal)s with gain of %(gain)s."),
+    LITERAL_REJECTED: ('trimlogic.foil',
+                       "Trying next solution after %(literal)s."),
+    CLAUSE_LEARNED: ('trimlogic.foil', "Found a rule %(rule)s."),
+    EXAMPLE_PRUNED: ('trimlogic.foil',
+                     "Example '%(example)s' pruned: %(pruned)s."),
+  }
+
+  def __init__(self, level=logging.DEBUG):
+    self.level = level
+
+  def __call__(self, event, details):
+    try:
+      name, message = self.MESSAGES[event]
+    except KeyError:
+      logger = logging.getLogger('trimlogic.trace')
+      if logger.isEnabledFor(self.level):
+        logger.log(self.level, "%s %s", event, details)
+      return
+    logger = logging.getLogger(name)
+    if logger.isEnabledFor(self.level):
+      logger.log(self.level, message % details)
@@ -0,0 +1,273 @@
+from trimlogic.term import Pred, Var, Function, TupleList
+from trimlogic.predicate import RuleBasedPredicate, CutPredicate
+from trimlogic import stats, trace
+
+_VISIT, _BUILD, _EXHAUSTED = object(), object(), object()
+
+
+class BindingStore:
+  """
+  A binding environment in the style of the Warren Abstract Machine. Every
+  bound variable has a cell holding its value, bindings are made by updating
+  the cells in place and are recorded on a trail. Backtracking resets the
+  cells bound since a mark by unwinding the trail, so no substitution is ever
+  copied or composed.
+  """
+
+  def __init__(self):
+    self.cells = {}
+    self.trail = []
+
+  def deref(self, term):
+    """
+    Follows the chain of bound variables starting at term, returning the first
+    term which is not a bound variable.
+    """
+    cells = self.cells
+    while isinstance(term, Var):
+      try:
+        term = cells[term]
+      except KeyError:
+        break
+    return term
+
+  def bind(self, var, value):
+    self.cells[var] = value
+    self.trail.append(var)
+
+  def mark(self):
+    return len(self.trail)
+
+  def undo(self, mark):
+    cells, trail = self.cells, self.trail
+    while len(trail) > mark:
+      del cells[trail.pop()]
+
+  def unify(self, s1, s2):
+    """
+    Unifies two terms, or two sequences of terms, binding variables in the
+    store. Returns False, with the store left as it was, if the terms do not
+    unify. The older of the two terms, such as the arguments of a call, should
+    be given first.
+    """
+    mark = len(self.trail)
+    stack = [(s1, s2)]
+    while stack:
+      s1, s2 = stack.pop()
+      s1, s2 = self.deref(s1), self.deref(s2)
+      if s1 is s2:
+        continue
+      if isinstance(s1, Var):
+        if not isinstance(s2, Var):
+          self.bind(s1, s2)
+        elif not s1 == s2:
+          # s2 comes from the newer term, usually a renamed rule head, and is 
+          # bound to s1 so that chains of variables do not grow with depth.
+          self.bind(s2, s1)
+      elif isinstance(s2, Var):
+        self.bind(s2, s1)
+      elif isinstance(s1, Pred) and isinstance(s2, Pred):
+        # compared argument by argument rather than with ==, which recurses 
+        # through the whole of two long lists.
+        if s1.predicate != s2.predicate or len(s1.terms) != len(s2.terms):
+          self.undo(mark)
+          return False
+        if isinstance(s1, TupleList) and isinstance(s2, TupleList):
+          stack.extend(s1.pairs(s2))
+        else:
+          stack.extend(zip(s1.terms, s2.terms))
+      elif s1 == s2:
+        continue
+      elif (isinstance(s1, (tuple, list)) and isinstance(s2, (tuple, list))
+            and len(s1) == len(s2)):
+        stack.extend(zip(s1, s2))
+      else:
+        self.undo(mark)
+        return False
+    return True
+
+  def resolve(self, term):
+    """
+    Returns term with every bound variable replaced by its value. Terms are
+    rebuilt from an explicit stack, so arbitrarily long lists can be resolved.
+    """
+    result = []
+    stack = [(_VISIT, term, result)]
+    while stack:
+      action, term, out = stack.pop()
+      if action is _BUILD:
+        term, args = term
+        if isinstance(term, TupleList):
+          out.append(TupleList(term.predicate, tuple(args[:-1]), 0, args[-1]))
+        elif isinstance(term, Pred):
+          out.append(term.predicate(*args))
+        elif isinstance(term, Function):
+          out.append(Function(term.function, *args))
+        else:
+          out.append(tuple(args))
+        continue
+      term = self.deref(term)
+      if isinstance(term, (Pred, Function)):
+        if term.ground:
+          out.append(term)
+          continue
+        if isinstance(term, TupleList):
+          # a list is resolved element by element, not cell by cell.
+          if not term.variables:
+            out.append(term)
+            continue
+          children = term.items[term.offset:] + (term.tail,)
+        else:
+          children = term.terms
+      elif isinstance(term, tuple):
+        children = term
+      else:
+        out.append(term)
+        continue
+      if not children:
+        out.append(term)
+        continue
+      args = []
+      stack.append((_BUILD, (term, args), out))
+      for child in reversed(children):
+        stack.append((_VISIT, child, args))
+    return result[0]
+
+
+_resolves_by_rules = {}
+
+def _is_rule_resolver(predicate):
+  """
+  True if the predicate answers calls from its rules through the indexed
+  RuleBasedPredicate._resolve, in which case the engine can unify the rule
+  heads in the store itself, unless the predicate is tabled.
+  """
+  cls = predicate.__class__
+  try:
+    return _resolves_by_rules[cls]
+  except KeyError:
+    resolve = getattr(cls, '_resolve', None)
+    by_rules = (resolve != None
+                and resolve.im_func is RuleBasedPredicate._resolve.im_func)
+    _resolves_by_rules[cls] = by_rules
+    return by_rules
+
+def _chain(goals, barrier, rest):
+  for goal in reversed(goals):
+    rest = (goal, barrier, rest)
+  return rest
+
+def _rule_alternatives(store, predicate, terms):
+  for rule in predicate._select_rules(terms):
+    template = rule.template
+    frame = template.new_frame()
+    if store.unify(terms, template.head(frame)):
+      yield template.body(frame)
+
+def _resolve_alternatives(store, predicate, terms):
+  for mgu, new_goals, variables in predicate._resolve(terms):
+    mark = store.mark()
+    unified = True
+    for var, value in mgu.iteritems():
+      if not store.unify(var, value):
+        unified = False
+        break
+    if unified:
+      yield new_goals
+    store.undo(mark)
+
+def _find_variables(terms):
+  variables = set()
+  stack = list(terms)
+  while stack:
+    term = stack.pop()
+    if isinstance(term, Var):
+      variables.add(term)
+    elif isinstance(term, (Pred, Function)):
+      stack.extend(term.terms)
+    elif isinstance(term, (tuple, list)):
+      stack.extend(term)
+  return variables
+
+def _answer(store, substitutions, query_variables):
+  # like the answers of fol_bc_ask, a query variable left unbound is given a 
+  # fresh variable as its value.
+  mark = store.mark()
+  for var in query_variables:
+    root = store.deref(var)
+    if isinstance(root, Var):
+      store.bind(root, Var.get_unique(root))
+  bindings = {}
+  for var in substitutions:
+    bindings[var] = store.resolve(var)
+  for var in query_variables:
+    bindings[var] = store.resolve(var)
+  store.undo(mark)
+  return bindings
+
+def trail_bc_ask(goals, substitutions, monitor=None):
+  """
+  Generates the same answers as fol_bc_ask, but keeps the bindings in a
+  BindingStore instead of composing substitutions at every resolution step.
+  
+  The engine does not recurse. The goals still to be proved form a linked 
+  list of (goal, cut barrier, rest) frames, and every call which may have 
+  further alternatives pushes a choicepoint holding its alternatives, its
+  continuation, the height of the choicepoint stack when it was called and a
+  mark of the trail. Failing pops back to the newest choicepoint, undoing the
+  trail. The body goals of a clause carry the height at which their call was
+  made, and a cut truncates the choicepoint stack to that height, discarding
+  the alternatives of the call and of every goal before the cut. No sentinel
+  is generated for a cut.
+  
+  The depth of a call, which monitor counts along with the resolution steps
+  if given, is the height of the choicepoint stack once it is pushed.
+  """
+  store = BindingStore()
+  for var, value in substitutions.iteritems():
+    store.bind(var, value)
+  query_variables = _find_variables(goals)
+  goals = _chain(goals, 0, None)
+  choicepoints = []
+  while True:
+    if goals == None:
+      yield _answer(store, substitutions, query_variables)
+    else:
+      goal, barrier, rest = goals
+      goal = store.deref(goal)
+      predicate = goal.predicate
+      if isinstance(predicate, CutPredicate):
+        del choicepoints[barrier:]
+        goals = rest
+        continue
+      if monitor != None:
+        monitor.call(len(choicepoints) + 1)
+      terms = goal.terms
+      if _is_rule_resolver(predicate) and not predicate.tabled:
+        terms = tuple([store.deref(term) for term in terms])
+        alternatives = _rule_alternatives(store, predicate, terms)
+      else:
+        terms = tuple([store.resolve(term) for term in terms])
+        alternatives = _resolve_alternatives(store, predicate, terms)
+      if stats.collector != None:
+        alternatives = stats.collector.observe_bodies(predicate, alternatives)
+      if trace.enabled:
+        call = predicate(*[store.resolve(term) for term in terms])
+        alternatives = trace.observe_bodies(call, len(choicepoints) + 1,
+                                            alternatives)
+      choicepoints.append((alternatives, rest, len(choicepoints), 
+                           store.mark()))
+    # take the next alternative of the newest choicepoint, popping those which
+    # have none left.
+    goals = None
+    while choicepoints:
+      alternatives, rest, height, mark = choicepoints[-1]
+      store.undo(mark)
+      body = next(alternatives, _EXHAUSTED)
+      if body is _EXHAUSTED:
+        choicepoints.pop()
+      else:
+        goals = _chain(body, height, rest)
+        break
+    else:
+      return